@@ -1,149 +1,195 @@
-# app.py
-import threading
-import logging
-from flask import Flask, request
-from bot.bot import run_bot
-from bot.database import init_db
-from bot.funpay_integration import create_funpay_webhook_handler
-from apscheduler.schedulers.background import BackgroundScheduler
-from bot.scheduler import check_expired_rentals
-import asyncio
-
-# YooKassa
-try:
-    import yookassa
-    from yookassa import Webhook
-    YOOKASSA_IMPORT_SUCCESS = True
-except ImportError:
-    logging.error("Не удалось импортировать YooKassa SDK.")
-    YOOKASSA_IMPORT_SUCCESS = False
-    yookassa = None
-    Webhook = None
-
-# Импорты для вебхука Юкассы
-from bot.config import YOOKASSA_ENABLED, YOOKASSA_ACCOUNT_ID, YOOKASSA_SECRET_KEY, YOOKASSA_WEBHOOK_URL
-from bot.database import get_db
-from bot.models import Owner
-# import json # json уже импортирован в Flask
-
-def create_app():
-    """Создает и конфигурирует Flask приложение."""
-    app = Flask(__name__)
-    app.logger.setLevel(logging.INFO)
-
-    # Инициализируем БД
-    init_db()
-
-    # Регистрируем вебхук FunPay
-    create_funpay_webhook_handler(app)
-
-    # Функция-обертка для запуска асинхронной задачи в синхронном планировщике
-    def run_check_expired_rentals():
-        """Обертка для запуска асинхронной задачи check_expired_rentals."""
-        try:
-            loop = asyncio.get_event_loop()
-        except RuntimeError:
-            loop = asyncio.new_event_loop()
-            asyncio.set_event_loop(loop)
-        loop.run_until_complete(check_expired_rentals())
-
-    # Инициализируем и запускаем планировщик
-    scheduler = BackgroundScheduler()
-    # Задача выполняется каждые 5 минут
-    scheduler.add_job(run_check_expired_rentals, 'interval', minutes=5, id='check_expired_rentals')
-    scheduler.start()
-    logging.info("APScheduler started with check_expired_rentals job.")
-
-    # --- YooKassa Webhook ---
-    if YOOKASSA_ENABLED and YOOKASSA_IMPORT_SUCCESS and YOOKASSA_ACCOUNT_ID and YOOKASSA_SECRET_KEY:
-        @app.route('/payment/yookassa/webhook', methods=['POST'])
-        def yookassa_webhook():
-            """Обрабатывает вебхук от YooKassa о статусе платежа."""
-            # Получаем данные и подпись из запроса
-            event_json = request.get_json()
-            # signature = request.headers.get('yookassa-signature') # Опционально для проверки
-
-            logging.debug(f"[YOOKASSA WEBHOOK] Получены данные: {event_json}")
-            
-            try:
-                # Проверяем подпись для безопасности (рекомендуется)
-                # if signature: Webhook.check_sign(event_json, signature) 
-                
-                if event_json.get('event') == 'payment.succeeded':
-                    payment_object = event_json.get('object')
-                    # Извлекаем данные из метаданных платежа
-                    user_id_str = payment_object.get('metadata', {}).get('tg_user_id')
-                    amount_value = payment_object.get('amount', {}).get('value')
-                    currency = payment_object.get('amount', {}).get('currency')
-                    payment_id = payment_object.get('id')
-
-                    if user_id_str and amount_value and currency == "RUB":
-                        try:
-                            user_id = int(user_id_str)
-                            amount = float(amount_value)
-                            
-                            # Начисляем средства владельцу
-                            db_gen = get_db()
-                            db = next(db_gen)
-                            owner = db.query(Owner).filter(Owner.tg_id == user_id).first()
-                            if owner:
-                                owner.balance = float(owner.balance or 0) + amount
-                                db.commit()
-                                
-                                # Логируем успешное пополнение
-                                logging.info(
-                                    f"[YOOKASSA] Баланс пользователя {user_id} "
-                                    f"пополнен на {amount} {currency}. Payment ID: {payment_id}"
-                                )
-                                
-                                db.close()
-                                return '', 200 # Важно вернуть 200, чтобы Юкасса не ретранслировала
-                            else:
-                                db.close()
-                                logging.error(f"[YOOKASSA] Владелец с TG ID {user_id} не найден.")
-                                return 'Owner not found', 400
-                        except ValueError as e:
-                            logging.error(f"[YOOKASSA] Ошибка конвертации данных: {e}")
-                            return 'Bad Data', 400
-                    else:
-                        logging.error(f"[YOOKASSA] Некорректные данные в вебхуке: {event_json}")
-                        return 'Bad Request', 400
-                else:
-                    logging.info(f"[YOOKASSA] Получено другое событие: {event_json.get('event')}")
-                return '', 200
-            except Exception as e:
-                logging.error(f"[YOOKASSA] Ошибка обработки вебхука: {e}", exc_info=True)
-                # Не возвращаем 500, чтобы Юкасса не считала это критической ошибкой сразу
-                return 'Internal Error', 500 
-
-        logging.info(f"Вебхук YooKassa зарегистрирован по адресу: {YOOKASSA_WEBHOOK_URL}")
-    else:
-        logging.info("Вебхук YooKassa НЕ зарегистрирован (SDK не импортирован или конфигурация отсутствует).")
-
-    @app.route('/')
-    def index():
-        """Простая страница для проверки работы Flask."""
-        return "Steam Rental Bot is running!"
-
-    return app
-
-# --- Точка входа при запуске файла напрямую ---
-if __name__ == '__main__':
-    import os
-    # Определяем режим запуска: 'bot', 'web', 'all'
-    mode = os.environ.get('RUN_MODE', 'all')
-
-    if mode in ['all', 'web']:
-        # Запускаем Flask-приложение (веб-сервер для вебхуков)
-        app = create_app()
-        port = int(os.environ.get("PORT", 5000))
-        # Запуск Flask в отдельном потоке, чтобы не блокировать основной поток
-        flask_thread = threading.Thread(target=lambda: app.run(host='0.0.0.0', port=port, debug=False))
-        flask_thread.start()
-        print(f"Flask server started on port {port}")
-
-    if mode in ['all', 'bot']:
-        # Запускаем Telegram-бота
-        print("Starting Telegram Bot...")
-        # ИСПРАВЛЕНО: Вызываем run_bot, а не main
-        run_bot() # run_bot() сам по себе блокирующий
+# app.py
+# Единая точка входа. Режим задает RUN_MODE:
+#   web       - вебхуки FunPay и YooKassa на gevent WSGIServer (bot/server.py)
+#   bot       - Telegram-бот в режиме polling (и доставка уведомлений из очереди)
+#   worker    - зачисление сохраненных уведомлений YooKassa
+#   scheduler - глобальные задачи планировщика (аренды, партиции, ключи, состояние бота); реплик может быть
+#               несколько - каждую задачу выполняет одна из них под арендой в scheduler_leases (bot/leases.py)
+#   webhook   - web (Flask на многопоточном waitress) + бот, получающий апдейты через тот же веб-сервер,
+#               + worker и scheduler
+#   all       - все в одном процессе (waitress + polling)
+# Метрики (/metrics, формат Prometheus) отдаются на порту PORT: в web, webhook и all - веб-сервером,
+# в bot, worker и scheduler - встроенным HTTP-сервером bot.metrics.start_http_server.
+# Модули импортируются внутри режимов: процесс грузит только то, что ему нужно (веб - без PTB,
+# бот - без Flask-вебхуков); steam, yookassa и funpay_lib (bs4/lxml) грузятся при первом обращении.
+import os
+if __name__ == '__main__' and os.environ.get('RUN_MODE') == 'web':
+    # gevent должен пропатчить socket/threading/ssl до импорта остальных модулей (см. bot/server.py)
+    from gevent import monkey
+    monkey.patch_all()
+
+import threading
+import logging
+from datetime import datetime, timedelta
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from bot.telegram_webhook import WebhookBot
+
+def start_scheduler(global_jobs: bool = True, blocking: bool = False):
+    """
+    Запускает планировщик. Задачи кэшей и сессий FunPay - в каждом процессе; глобальные задачи
+    (аренды, партиции, ключи, состояние бота) - только при global_jobs. blocking - в текущем потоке.
+    """
+    from apscheduler.schedulers.background import BackgroundScheduler
+    from apscheduler.schedulers.blocking import BlockingScheduler
+    from bot.utils import purge_secret_cache
+    from bot.funpay_pool import funpay_pool, keep_sessions_alive
+
+    scheduler = BlockingScheduler() if blocking else BackgroundScheduler()
+    scheduler.add_job(purge_secret_cache, 'interval', seconds=15, id='purge_secret_cache')
+    scheduler.add_job(funpay_pool.evict_idle, 'interval', minutes=10, id='funpay_pool_evict_idle')
+    scheduler.add_job(keep_sessions_alive, 'interval', minutes=1, id='funpay_keep_sessions_alive')
+    if global_jobs:
+        from bot.config import SCHEDULER_POLL_INTERVAL
+        from bot.leases import leased
+        from bot.middleware import run_async_job
+        from bot.scheduler import check_expired_rentals, purge_expired_user_state
+        from bot.partitions import maintain_transaction_partitions
+        from bot.key_rotation import reencrypt_secrets
+
+        def add_global_job(func, job_id: str, interval: timedelta):
+            # Проверяется в каждой реплике, выполняется той, что захватила аренду, раз в interval (bot/leases.py)
+            scheduler.add_job(leased(job_id, interval)(func), 'interval', seconds=SCHEDULER_POLL_INTERVAL,
+                              id=job_id, next_run_time=datetime.now())
+
+        # Задача выполняется каждые 5 минут (своя сессия БД и event loop на каждый запуск)
+        add_global_job(run_async_job(check_expired_rentals), 'check_expired_rentals', timedelta(minutes=5))
+        add_global_job(maintain_transaction_partitions, 'maintain_transaction_partitions', timedelta(hours=24))
+        add_global_job(reencrypt_secrets, 'reencrypt_secrets', timedelta(hours=6))
+        add_global_job(run_async_job(purge_expired_user_state), 'purge_expired_user_state', timedelta(hours=24))
+    logging.info(f"APScheduler started ({'все задачи' if global_jobs else 'только локальные задачи процесса'}).")
+    scheduler.start()
+    return scheduler
+
+def start_yookassa_worker():
+    """Зачисление уведомлений YooKassa в фоновом потоке (если YooKassa включена)."""
+    from bot.config import YOOKASSA_ENABLED
+    from bot.payments import YOOKASSA_SDK_AVAILABLE, yookassa_inbox_worker
+    if YOOKASSA_ENABLED and YOOKASSA_SDK_AVAILABLE:
+        yookassa_inbox_worker.start()
+
+def create_app(webhook_bot: 'WebhookBot' = None):
+    """Создает и конфигурирует Flask приложение. С webhook_bot - принимает и апдейты Telegram."""
+    from flask import Flask, Response
+    from bot import metrics
+    from bot.config import YOOKASSA_ENABLED, YOOKASSA_WEBHOOK_URL
+    from bot.database import init_db
+    from bot.middleware import register_flask_session_scope
+    from bot.funpay_integration import create_funpay_webhook_handler
+    from bot.payments import YOOKASSA_SDK_AVAILABLE, create_yookassa_webhook_handler
+
+    app = Flask(__name__)
+    app.logger.setLevel(logging.INFO)
+
+    # Инициализируем БД
+    init_db()
+    register_flask_session_scope(app)
+
+    # Регистрируем вебхук FunPay
+    create_funpay_webhook_handler(app)
+    if webhook_bot is not None:
+        from bot.telegram_webhook import register_telegram_webhook
+        register_telegram_webhook(app, webhook_bot)
+
+    # --- YooKassa Webhook --- (зачисление - в режиме worker)
+    if YOOKASSA_ENABLED and YOOKASSA_SDK_AVAILABLE:
+        create_yookassa_webhook_handler(app)
+        logging.info(f"Вебхук YooKassa зарегистрирован по адресу: {YOOKASSA_WEBHOOK_URL}")
+    else:
+        logging.info("Вебхук YooKassa НЕ зарегистрирован (SDK не импортирован или конфигурация отсутствует).")
+
+    @app.route('/')
+    def index():
+        """Простая страница для проверки работы Flask."""
+        return "Steam Rental Bot is running!"
+
+    @app.route('/metrics')
+    def metrics_endpoint():
+        """Внутрипроцессные метрики (сессии БД и т.д.) в формате Prometheus."""
+        return Response(metrics.render_text(), mimetype='text/plain')
+
+    return app
+
+# --- Режимы запуска ---
+def run_web(port: int):
+    from bot.server import serve_forever
+    app = create_app()
+    start_scheduler(global_jobs=False)
+    serve_forever(app, port=port)
+
+def run_bot_mode(port: int):
+    from bot import metrics
+    from bot.bot import run_bot
+    from bot.database import init_db
+    init_db()
+    metrics.start_http_server(port)
+    start_scheduler(global_jobs=False)
+    logging.info("Запуск Telegram-бота (polling)...")
+    run_bot() # run_bot() сам по себе блокирующий
+
+def run_worker(port: int):
+    from bot import metrics
+    from bot.config import YOOKASSA_ENABLED
+    from bot.database import init_db
+    from bot.payments import YOOKASSA_SDK_AVAILABLE, yookassa_inbox_worker
+    if not (YOOKASSA_ENABLED and YOOKASSA_SDK_AVAILABLE):
+        logging.warning("YooKassa выключена или SDK не установлен - воркеру нечего обрабатывать.")
+        return
+    init_db()
+    metrics.start_http_server(port)
+    start_scheduler(global_jobs=False)
+    yookassa_inbox_worker.run() # Блокирующий цикл
+
+def run_scheduler_mode(port: int):
+    from bot import metrics
+    from bot.database import init_db
+    init_db()
+    metrics.start_http_server(port)
+    start_scheduler(blocking=True)
+
+def run_webhook(port: int):
+    from bot.server import serve_threaded
+    from bot.telegram_webhook import WebhookBot
+    webhook_bot = WebhookBot()
+    webhook_bot.start()
+    app = create_app(webhook_bot)
+    start_yookassa_worker()
+    start_scheduler()
+    logging.info(f"Flask-сервер с webhook Telegram запущен на порту {port}.")
+    serve_threaded(app, port=port)
+
+def run_all(port: int):
+    from bot.bot import run_bot
+    from bot.server import create_threaded_server, stop_threaded_server
+    # Запускаем Flask-приложение (веб-сервер для вебхуков)
+    app = create_app()
+    start_yookassa_worker()
+    # Веб-сервер в отдельном потоке: главный поток занимает polling бота (и его обработка сигналов)
+    server = create_threaded_server(app, port=port)
+    threading.Thread(target=server.run, daemon=True, name="web-server").start()
+    logging.info(f"Flask-сервер запущен на порту {port}.")
+    start_scheduler()
+    # Запускаем Telegram-бота
+    logging.info("Запуск Telegram-бота (polling)...")
+    try:
+        run_bot()
+    finally:
+        stop_threaded_server(server)
+
+RUN_MODES = {
+    'web': run_web,
+    'bot': run_bot_mode,
+    'worker': run_worker,
+    'scheduler': run_scheduler_mode,
+    'webhook': run_webhook,
+    'all': run_all,
+}
+
+# --- Точка входа ---
+if __name__ == '__main__':
+    mode = os.environ.get('RUN_MODE', 'all')
+    if mode not in RUN_MODES:
+        raise SystemExit(f"Неизвестный RUN_MODE={mode!r}, допустимо: {', '.join(RUN_MODES)}")
+    logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', level=logging.INFO)
+    RUN_MODES[mode](int(os.environ.get("PORT", 5000)))
@@ -1 +1 @@
-# This file is intentionally left blank to mark the directory as a Python package.
+# This file is intentionally left blank to mark the directory as a Python package.
@@ -1,45 +1,70 @@
-# bot/bot.py
-import logging
-from telegram import Update
-from telegram.ext import ApplicationBuilder, CommandHandler, MessageHandler, filters, CallbackQueryHandler
-from bot.handlers import (
-    start, show_main_menu, subscribe, button_handler, text_message_handler, process_add_funpay_step, process_add_steam_step,
-    topup_amount_handler, admin_stats, admin_activate_subscription, unknown_command
-)
-from bot.config import TELEGRAM_BOT_TOKEN
-
-logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', level=logging.INFO)
-
-BOT_INSTANCE = None
-
-def get_bot_instance():
-    global BOT_INSTANCE
-    return BOT_INSTANCE
-
-async def post_init(application) -> None:
-    global BOT_INSTANCE
-    BOT_INSTANCE = application.bot
-    logging.info("Экземпляр Telegram бота сохранен.")
-
-def run_bot():
-    if not TELEGRAM_BOT_TOKEN:
-        raise ValueError("TELEGRAM_BOT_TOKEN не установлен")
-
-    application = ApplicationBuilder().token(TELEGRAM_BOT_TOKEN).post_init(post_init).build()
-
-    # Команды
-    application.add_handler(CommandHandler("start", start))
-    application.add_handler(CommandHandler("menu", show_main_menu))
-    application.add_handler(CommandHandler("subscribe", subscribe))
-    application.add_handler(CommandHandler("admin_stats", admin_stats))
-    application.add_handler(CommandHandler("admin_activate_subscription", admin_activate_subscription))
-
-    # Обработчики
-    application.add_handler(CallbackQueryHandler(button_handler)) # Для инлайн-кнопок (если остались)
-    application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, text_message_handler)) # <-- ДОБАВИЛИ
-    application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, process_add_funpay_step))
-    application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, process_add_steam_step))
-    application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, topup_amount_handler))
-    application.add_handler(MessageHandler(filters.COMMAND, unknown_command))
-
-    application.run_polling(allowed_updates=Update.ALL_TYPES)
+# bot/bot.py
+import logging
+from telegram import Update
+from telegram.ext import Application, ApplicationBuilder, CommandHandler, MessageHandler, filters, CallbackQueryHandler
+from bot.handlers import (
+    start, show_main_menu, subscribe, button_handler, text_message_handler,
+    admin_stats, admin_activate_subscription, unknown_command
+)
+from bot.config import TELEGRAM_BOT_TOKEN
+from bot.database import async_session_scope
+from bot.notifications import notification_worker
+from bot.persistence import PostgresPersistence
+
+logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', level=logging.INFO)
+
+BOT_INSTANCE = None
+
+class SessionScopedApplication(Application):
+    """Application, оборачивающий обработку каждого апдейта в async_session_scope()."""
+
+    async def process_update(self, update: object) -> None:
+        # AsyncSession не берет соединение из пула до первого запроса, так что апдейты без БД ничего не стоят
+        async with async_session_scope():
+            await super().process_update(update)
+
+def get_bot_instance():
+    global BOT_INSTANCE
+    return BOT_INSTANCE
+
+async def post_init(application) -> None:
+    global BOT_INSTANCE
+    BOT_INSTANCE = application.bot
+    logging.info("Экземпляр Telegram бота сохранен.")
+    # Уведомления из очереди в БД доставляет процесс бота (их ставят и веб-процесс, и планировщик)
+    application.create_task(notification_worker.run(application.bot))
+
+# Типы апдейтов, которые потребляют обработчики ниже (остальные Telegram даже не присылает)
+ALLOWED_UPDATES = [Update.MESSAGE, Update.CALLBACK_QUERY]
+
+def build_application():
+    """Создает Application со всеми обработчиками (общий для режимов polling и webhook)."""
+    if not TELEGRAM_BOT_TOKEN:
+        raise ValueError("TELEGRAM_BOT_TOKEN не установлен")
+
+    application = (
+        ApplicationBuilder()
+        .token(TELEGRAM_BOT_TOKEN)
+        .application_class(SessionScopedApplication) # Одна сессия БД на апдейт
+        .persistence(PostgresPersistence()) # user_data (меню, пошаговые диалоги) переживает рестарт
+        .post_init(post_init)
+        .build()
+    )
+
+    # Команды
+    application.add_handler(CommandHandler("start", start))
+    application.add_handler(CommandHandler("menu", show_main_menu))
+    application.add_handler(CommandHandler("subscribe", subscribe))
+    application.add_handler(CommandHandler("admin_stats", admin_stats))
+    application.add_handler(CommandHandler("admin_activate_subscription", admin_activate_subscription))
+
+    # Обработчики
+    application.add_handler(CallbackQueryHandler(button_handler)) # Для инлайн-кнопок (если остались)
+    # Весь текст - один обработчик: шаг активного диалога (bot.conversations) или кнопка меню (bot.router)
+    application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, text_message_handler))
+    application.add_handler(MessageHandler(filters.COMMAND, unknown_command))
+    return application
+
+def run_bot():
+    """Long polling (блокирующий вызов). Режим webhook - bot.telegram_webhook."""
+    build_application().run_polling(allowed_updates=ALLOWED_UPDATES)
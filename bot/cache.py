@@ -0,0 +1,86 @@
+# bot/cache.py
+# Небольшой потокобезопасный LRU-кэш с TTL и ограничением размера.
+# Попадания, промахи и вытеснения публикуются в bot.metrics с меткой cache=<name>.
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Hashable, Optional
+from bot import metrics
+
+_MISSING = object()
+
+class TTLCache:
+    def __init__(self, name: str, maxsize: int = 1024, ttl: float = 30.0,
+                 on_evict: Optional[Callable[[Hashable, Any], None]] = None):
+        if maxsize <= 0:
+            raise ValueError("maxsize должен быть больше нуля")
+        self.name = name
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.on_evict = on_evict # Вызывается для каждого удаленного значения (истекшего, вытесненного, сброшенного)
+        self._data: OrderedDict = OrderedDict() # key -> (expires_at, value)
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        evicted = None
+        with self._lock:
+            item = self._data.get(key, _MISSING)
+            if item is not _MISSING:
+                expires_at, value = item
+                if expires_at > time.monotonic():
+                    self._data.move_to_end(key)
+                    metrics.inc("cache_hits_total", cache=self.name)
+                    return value
+                evicted = self._data.pop(key)[1]
+        metrics.inc("cache_misses_total", cache=self.name)
+        if evicted is not None:
+            self._evicted(key, evicted, "expired")
+        return default
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None):
+        evicted = []
+        with self._lock:
+            old = self._data.pop(key, _MISSING)
+            if old is not _MISSING and old[1] is not value:
+                evicted.append((key, old[1], "replaced"))
+            self._data[key] = (time.monotonic() + (self.ttl if ttl is None else ttl), value)
+            while len(self._data) > self.maxsize:
+                old_key, (_, old_value) = self._data.popitem(last=False)
+                evicted.append((old_key, old_value, "size"))
+            metrics.set_gauge("cache_size", len(self._data), cache=self.name)
+        for old_key, old_value, reason in evicted:
+            self._evicted(old_key, old_value, reason)
+
+    def invalidate(self, key: Hashable):
+        with self._lock:
+            item = self._data.pop(key, _MISSING)
+            metrics.set_gauge("cache_size", len(self._data), cache=self.name)
+        if item is not _MISSING:
+            self._evicted(key, item[1], "invalidated")
+
+    def clear(self):
+        with self._lock:
+            items = list(self._data.items())
+            self._data.clear()
+            metrics.set_gauge("cache_size", 0, cache=self.name)
+        for key, (_, value) in items:
+            self._evicted(key, value, "invalidated")
+
+    def purge_expired(self):
+        """Удаляет истекшие записи (без этого они живут до обращения или вытеснения)."""
+        now = time.monotonic()
+        with self._lock:
+            expired = [(key, value) for key, (expires_at, value) in self._data.items() if expires_at <= now]
+            for key, _ in expired:
+                del self._data[key]
+            metrics.set_gauge("cache_size", len(self._data), cache=self.name)
+        for key, value in expired:
+            self._evicted(key, value, "expired")
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def _evicted(self, key: Hashable, value: Any, reason: str):
+        metrics.inc("cache_evictions_total", cache=self.name, reason=reason)
+        if self.on_evict:
+            self.on_evict(key, value)
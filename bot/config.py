@@ -1,50 +1,173 @@
-# bot/config.py
-import os
-import json
-from dotenv import load_dotenv
-from datetime import timedelta
-
-load_dotenv()
-
-# Telegram Bot
-TELEGRAM_BOT_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
-if not TELEGRAM_BOT_TOKEN:
-    raise ValueError("TELEGRAM_BOT_TOKEN не установлен в .env файле")
-
-# Database
-DB_HOST = os.getenv("DB_HOST", "localhost")
-DB_PORT = os.getenv("DB_PORT", "5432")
-DB_NAME = os.getenv("DB_NAME", "steam_rental_db")
-DB_USER = os.getenv("DB_USER", "tradebatyachrono")
-DB_PASS = os.getenv("DB_PASS", "260502")
-
-DATABASE_URL = f"postgresql://{DB_USER}:{DB_PASS}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
-
-# Security
-MASTER_ENCRYPTION_KEY = os.getenv("MASTER_ENCRYPTION_KEY")
-if not MASTER_ENCRYPTION_KEY or len(MASTER_ENCRYPTION_KEY.encode()) < 32:
-    raise ValueError("MASTER_ENCRYPTION_KEY должен быть длиной не менее 32 символов")
-
-# Admins
-ADMIN_USER_IDS = [int(id.strip()) for id in os.getenv("ADMIN_USER_IDS", "").split(",") if id.strip().isdigit()]
-
-# YooKassa
-YOOKASSA_ACCOUNT_ID = os.getenv("YOOKASSA_ACCOUNT_ID")
-YOOKASSA_SECRET_KEY = os.getenv("YOOKASSA_SECRET_KEY")
-YOOKASSA_WEBHOOK_URL = os.getenv("YOOKASSA_WEBHOOK_URL", "https://yourdomain.com/payment/yookassa/webhook")
-YOOKASSA_ENABLED = bool(YOOKASSA_ACCOUNT_ID and YOOKASSA_SECRET_KEY)
-
-# Subscription
-try:
-    SUBSCRIPTION_PLANS = json.loads(os.getenv("SUBSCRIPTION_PLANS", "{}"))
-except json.JSONDecodeError:
-    SUBSCRIPTION_PLANS = {
-        '1w': {'duration_days': 7, 'price': 50.00},
-        '1m': {'duration_days': 30, 'price': 150.00},
-        '3m': {'duration_days': 90, 'price': 400.00},
-    }
-
-try:
-    MIN_TOPUP_AMOUNT = float(os.getenv("MIN_TOPUP_AMOUNT", "10.0"))
-except ValueError:
-    MIN_TOPUP_AMOUNT = 10.0
\ No newline at end of file
+# bot/config.py
+import os
+import json
+import base64
+from dotenv import load_dotenv
+from datetime import timedelta
+
+load_dotenv()
+
+# Telegram Bot
+TELEGRAM_BOT_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
+if not TELEGRAM_BOT_TOKEN:
+    raise ValueError("TELEGRAM_BOT_TOKEN не установлен в .env файле")
+# Режим webhook (RUN_MODE=webhook): апдейты приходят POST-запросами на веб-сервер по адресу
+# TELEGRAM_WEBHOOK_URL (публичный https URL, путь - TELEGRAM_WEBHOOK_PATH). Telegram подписывает запросы
+# заголовком X-Telegram-Bot-Api-Secret-Token; без TELEGRAM_WEBHOOK_SECRET секрет генерируется при каждом запуске.
+TELEGRAM_WEBHOOK_URL = os.getenv("TELEGRAM_WEBHOOK_URL")
+TELEGRAM_WEBHOOK_PATH = os.getenv("TELEGRAM_WEBHOOK_PATH", "/telegram/webhook")
+TELEGRAM_WEBHOOK_SECRET = os.getenv("TELEGRAM_WEBHOOK_SECRET")
+# Сколько секунд Flask-обработчик ждет постановки апдейта в очередь бота, прежде чем ответить 503
+TELEGRAM_WEBHOOK_SUBMIT_TIMEOUT = float(os.getenv("TELEGRAM_WEBHOOK_SUBMIT_TIMEOUT", "5"))
+
+# Database
+DB_HOST = os.getenv("DB_HOST", "localhost")
+DB_PORT = os.getenv("DB_PORT", "5432")
+DB_NAME = os.getenv("DB_NAME", "steam_rental_db")
+DB_USER = os.getenv("DB_USER", "tradebatyachrono")
+DB_PASS = os.getenv("DB_PASS", "260502")
+
+DATABASE_URL = f"postgresql://{DB_USER}:{DB_PASS}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
+ASYNC_DATABASE_URL = f"postgresql+asyncpg://{DB_USER}:{DB_PASS}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
+# Накатывать миграции схемы при старте (иначе: python -m bot.migrations upgrade)
+AUTO_MIGRATE = os.getenv("AUTO_MIGRATE", "true").lower() in ("1", "true", "yes")
+
+# Security
+MASTER_ENCRYPTION_KEY = os.getenv("MASTER_ENCRYPTION_KEY")
+if not MASTER_ENCRYPTION_KEY or len(MASTER_ENCRYPTION_KEY.encode()) < 32:
+    raise ValueError("MASTER_ENCRYPTION_KEY должен быть длиной не менее 32 символов")
+
+# Ключи шифрования с версиями: JSON {"<key_id>": "<32 байта в base64>"}; новые значения шифруются ключом
+# ACTIVE_KEY_ID, старые расшифровываются ключом из заголовка. Ротация: добавить ключ, сменить ACTIVE_KEY_ID,
+# дождаться перешифрования (python -m bot.key_rotation), затем удалить старый ключ.
+# Без ENCRYPTION_KEYS используется MASTER_ENCRYPTION_KEY под key id 1.
+try:
+    ENCRYPTION_KEYS = {int(key_id): base64.b64decode(key)
+                       for key_id, key in json.loads(os.getenv("ENCRYPTION_KEYS", "{}")).items()}
+except (json.JSONDecodeError, ValueError) as e:
+    raise ValueError(f"ENCRYPTION_KEYS должен быть JSON вида {{\"1\": \"<base64>\"}}: {e}")
+if not ENCRYPTION_KEYS:
+    ENCRYPTION_KEYS = {1: MASTER_ENCRYPTION_KEY.encode()[:32]}
+ACTIVE_KEY_ID = int(os.getenv("ACTIVE_KEY_ID", str(max(ENCRYPTION_KEYS))))
+# Фоновое перешифрование: размер пачки и ограничение скорости записи (строк в секунду)
+REENCRYPT_BATCH_SIZE = int(os.getenv("REENCRYPT_BATCH_SIZE", "200"))
+REENCRYPT_MAX_ROWS_PER_SECOND = float(os.getenv("REENCRYPT_MAX_ROWS_PER_SECOND", "100"))
+
+# Admins
+ADMIN_USER_IDS = [int(id.strip()) for id in os.getenv("ADMIN_USER_IDS", "").split(",") if id.strip().isdigit()]
+
+# YooKassa
+YOOKASSA_ACCOUNT_ID = os.getenv("YOOKASSA_ACCOUNT_ID")
+YOOKASSA_SECRET_KEY = os.getenv("YOOKASSA_SECRET_KEY")
+YOOKASSA_WEBHOOK_URL = os.getenv("YOOKASSA_WEBHOOK_URL", "https://yourdomain.com/payment/yookassa/webhook")
+YOOKASSA_ENABLED = bool(YOOKASSA_ACCOUNT_ID and YOOKASSA_SECRET_KEY)
+
+# Subscription
+try:
+    SUBSCRIPTION_PLANS = json.loads(os.getenv("SUBSCRIPTION_PLANS", "{}"))
+except json.JSONDecodeError:
+    SUBSCRIPTION_PLANS = {
+        '1w': {'duration_days': 7, 'price': 50.00},
+        '1m': {'duration_days': 30, 'price': 150.00},
+        '3m': {'duration_days': 90, 'price': 400.00},
+    }
+
+try:
+    MIN_TOPUP_AMOUNT = float(os.getenv("MIN_TOPUP_AMOUNT", "10.0"))
+except ValueError:
+    MIN_TOPUP_AMOUNT = 10.0
+
+# Кэш статистики для меню FunPay аккаунтов
+STATS_CACHE_TTL = float(os.getenv("STATS_CACHE_TTL", "30"))
+STATS_CACHE_SIZE = int(os.getenv("STATS_CACHE_SIZE", "10000"))
+
+# Кэш владельцев (подписка и учетные данные FunPay) для декораторов хендлеров
+OWNER_CACHE_TTL = float(os.getenv("OWNER_CACHE_TTL", "60"))
+OWNER_CACHE_SIZE = int(os.getenv("OWNER_CACHE_SIZE", "10000"))
+
+# Незавершенные пошаговые диалоги (добавление аккаунтов, пополнение): сколько хранить без активности
+CONVERSATION_TTL = float(os.getenv("CONVERSATION_TTL", str(30 * 60)))
+# Хранение user_data бота в БД (таблица bot_user_state): как часто PTB сбрасывает изменения и через
+# сколько секунд без активности состояние пользователя удаляется (и не загружается при старте)
+PERSISTENCE_UPDATE_INTERVAL = float(os.getenv("PERSISTENCE_UPDATE_INTERVAL", "5"))
+PERSISTENCE_USER_TTL = float(os.getenv("PERSISTENCE_USER_TTL", str(7 * 24 * 60 * 60)))
+
+# Кэш расшифрованных секретов (пароли, shared_secret, учетные данные FunPay)
+SECRET_CACHE_TTL = float(os.getenv("SECRET_CACHE_TTL", "30"))
+SECRET_CACHE_SIZE = int(os.getenv("SECRET_CACHE_SIZE", "1024"))
+
+# Помесячные партиции transactions: сколько месяцев создавать заранее, сколько хранить в БД
+# и куда выгружать архив отсоединенных партиций
+TRANSACTIONS_PARTITION_MONTHS_AHEAD = int(os.getenv("TRANSACTIONS_PARTITION_MONTHS_AHEAD", "3"))
+TRANSACTIONS_RETENTION_MONTHS = int(os.getenv("TRANSACTIONS_RETENTION_MONTHS", "24"))
+TRANSACTIONS_ARCHIVE_DIR = os.getenv("TRANSACTIONS_ARCHIVE_DIR", "/app/data/archive/transactions")
+# Сколько секунд DETACH PARTITION ждет блокировку transactions, прежде чем отложить месяц до следующего запуска
+PARTITION_DETACH_LOCK_TIMEOUT = float(os.getenv("PARTITION_DETACH_LOCK_TIMEOUT", "3"))
+
+# Пул залогиненных FunPay аккаунтов: интервал обновления сессии (Account.get раз в 40-60 минут),
+# вытеснение неиспользуемых и максимальный размер пула
+FUNPAY_SESSION_REFRESH_MIN = float(os.getenv("FUNPAY_SESSION_REFRESH_MIN", str(40 * 60)))
+FUNPAY_SESSION_REFRESH_MAX = float(os.getenv("FUNPAY_SESSION_REFRESH_MAX", str(60 * 60)))
+# Сколько сессий фоновое обновление освежает за один тик (раз в минуту)
+FUNPAY_SESSION_REFRESH_BATCH = int(os.getenv("FUNPAY_SESSION_REFRESH_BATCH", "20"))
+FUNPAY_POOL_IDLE_TTL = float(os.getenv("FUNPAY_POOL_IDLE_TTL", str(6 * 60 * 60)))
+FUNPAY_POOL_SIZE = int(os.getenv("FUNPAY_POOL_SIZE", "500"))
+# Переопределение лимитов запросов к FunPay: JSON {"page"|"runner"|"chat_send"|"multi_user_send"|"proxy":
+# [токенов в секунду, емкость]}. Значения по умолчанию - в funpay_lib/common/ratelimit.py
+try:
+    FUNPAY_RATE_LIMITS = json.loads(os.getenv("FUNPAY_RATE_LIMITS", "{}"))
+except json.JSONDecodeError:
+    FUNPAY_RATE_LIMITS = {}
+# Очередь исходящих сообщений покупателям: попыток на сообщение (отказы из-за флуда не считаются),
+# базовая пауза между попытками и максимальная длина склеенного сообщения
+FUNPAY_OUTBOX_MAX_ATTEMPTS = int(os.getenv("FUNPAY_OUTBOX_MAX_ATTEMPTS", "5"))
+FUNPAY_OUTBOX_RETRY_DELAY = float(os.getenv("FUNPAY_OUTBOX_RETRY_DELAY", "5"))
+FUNPAY_MESSAGE_MAX_LEN = int(os.getenv("FUNPAY_MESSAGE_MAX_LEN", "2000"))
+
+# Общий каталог категорий FunPay: как часто перестраивать и где хранить снимок на диске
+FUNPAY_CATALOG_TTL = float(os.getenv("FUNPAY_CATALOG_TTL", str(24 * 60 * 60)))
+FUNPAY_CATALOG_SNAPSHOT_PATH = os.getenv("FUNPAY_CATALOG_SNAPSHOT_PATH", "/app/data/funpay_catalog.pickle")
+# Очередь уведомлений владельцам в Telegram (таблица notification_outbox): глобальный лимит (сообщений в секунду),
+# минимальный интервал между сообщениями в один чат, попытки, пауза между ними (умножается на номер попытки)
+NOTIFY_GLOBAL_RATE = float(os.getenv("NOTIFY_GLOBAL_RATE", "25"))
+NOTIFY_PER_CHAT_INTERVAL = float(os.getenv("NOTIFY_PER_CHAT_INTERVAL", "1.0"))
+NOTIFY_MAX_ATTEMPTS = int(os.getenv("NOTIFY_MAX_ATTEMPTS", "5"))
+NOTIFY_RETRY_DELAY = float(os.getenv("NOTIFY_RETRY_DELAY", "30"))
+NOTIFY_BATCH_SIZE = int(os.getenv("NOTIFY_BATCH_SIZE", "50"))
+NOTIFY_POLL_INTERVAL = float(os.getenv("NOTIFY_POLL_INTERVAL", "2"))
+# Уведомления с ключом дайджеста копятся NOTIFY_DIGEST_WINDOW секунд; от NOTIFY_DIGEST_MIN штук
+# в один чат уходят одним сообщением ("Завершено аренд: 12")
+NOTIFY_DIGEST_WINDOW = float(os.getenv("NOTIFY_DIGEST_WINDOW", "60"))
+NOTIFY_DIGEST_MIN = int(os.getenv("NOTIFY_DIGEST_MIN", "3"))
+
+# Входящие уведомления YooKassa (таблица yookassa_inbox): вебхук только сохраняет уведомление,
+# зачисление делает фоновый обработчик после сверки платежа через API YooKassa.
+# Уведомления принимаются только с IP YooKassa; за reverse proxy - по X-Forwarded-For (YOOKASSA_TRUST_PROXY=true)
+YOOKASSA_VERIFY_IP = os.getenv("YOOKASSA_VERIFY_IP", "true").lower() in ("1", "true", "yes")
+YOOKASSA_TRUST_PROXY = os.getenv("YOOKASSA_TRUST_PROXY", "false").lower() in ("1", "true", "yes")
+YOOKASSA_INBOX_BATCH_SIZE = int(os.getenv("YOOKASSA_INBOX_BATCH_SIZE", "20"))
+YOOKASSA_INBOX_POLL_INTERVAL = float(os.getenv("YOOKASSA_INBOX_POLL_INTERVAL", "5"))
+YOOKASSA_INBOX_MAX_ATTEMPTS = int(os.getenv("YOOKASSA_INBOX_MAX_ATTEMPTS", "10"))
+YOOKASSA_INBOX_RETRY_DELAY = float(os.getenv("YOOKASSA_INBOX_RETRY_DELAY", "30"))
+# На сколько секунд воркер забирает пачку уведомлений: должно хватать на проверку всей пачки через API
+YOOKASSA_INBOX_CLAIM_TTL = float(os.getenv("YOOKASSA_INBOX_CLAIM_TTL", "300"))
+
+# Веб-сервер (RUN_MODE=web, gevent): максимум одновременных соединений и сколько ждать при остановке
+# завершения запросов, заказов FunPay в обработке и отправки сообщений покупателям
+WEB_MAX_CONNECTIONS = int(os.getenv("WEB_MAX_CONNECTIONS", "1000"))
+WEB_SHUTDOWN_TIMEOUT = float(os.getenv("WEB_SHUTDOWN_TIMEOUT", "60"))
+# Потоки ОС для блокирующих вызовов веб-сервера (смена пароля Steam при аренде) - столько аренд идет параллельно
+WEB_BLOCKING_THREADS = int(os.getenv("WEB_BLOCKING_THREADS", "10"))
+# Потоки waitress в RUN_MODE=webhook и all - столько запросов (в т.ч. аренд со сменой пароля) обрабатывается параллельно
+WEB_THREADS = int(os.getenv("WEB_THREADS", "16"))
+
+# Глобальные задачи планировщика (таблица scheduler_leases): срок аренды задачи - пока задача идет,
+# аренда продлевается; если реплика упала, задачу подхватит другая не позже чем через SCHEDULER_LEASE_TTL
+SCHEDULER_LEASE_TTL = float(os.getenv("SCHEDULER_LEASE_TTL", "60"))
+# Как часто реплика проверяет, не пора ли запускать глобальную задачу (интервал задачи считается по БД,
+# поэтому рестарт реплики не сдвигает и не пропускает запуски)
+SCHEDULER_POLL_INTERVAL = float(os.getenv("SCHEDULER_POLL_INTERVAL", "60"))
+# Завершение аренд: сколько истекших аренд захватывать за раз и на сколько (с запасом на логин в Steam);
+# если смена пароля не удалась или реплика упала, аренда снова станет истекшей через RENTAL_RETURN_CLAIM_TTL
+RENTAL_RETURN_BATCH_SIZE = int(os.getenv("RENTAL_RETURN_BATCH_SIZE", "10"))
+RENTAL_RETURN_CLAIM_TTL = float(os.getenv("RENTAL_RETURN_CLAIM_TTL", str(15 * 60)))
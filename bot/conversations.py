@@ -0,0 +1,84 @@
+# bot/conversations.py
+# Пошаговые диалоги (добавление FunPay/Steam аккаунта, пополнение баланса) как конечный автомат.
+# Состояние пользователя - одна компактная запись [flow, step, data, expires_at] в context.user_data
+# (ключ 'conversation'), а не набор флагов: вместе с user_data она сохраняется в БД (bot/persistence.py),
+# поэтому диалог переживает рестарт. Брошенный диалог (вместе с введенными в нем паролями и ключами)
+# забывается через CONVERSATION_TTL секунд бездействия.
+# Обработчик шага выбирается одним поиском в dict по (flow, step) и возвращает следующий шаг
+# (тот же шаг - повторить ввод, None - диалог завершен).
+import time
+from typing import Any, Awaitable, Callable, Optional
+from bot import metrics
+from bot.config import CONVERSATION_TTL
+
+StepHandler = Callable[..., Awaitable[Optional[str]]]
+
+USER_DATA_KEY = 'conversation'
+
+class Conversation:
+    __slots__ = ('flow', 'step', 'data')
+
+    def __init__(self, flow: str, step: str, data: dict):
+        self.flow = flow
+        self.step = step
+        self.data = data
+
+class ConversationMachine:
+    def __init__(self, ttl: float = CONVERSATION_TTL):
+        self.ttl = ttl
+        self._steps: dict[tuple[str, str], StepHandler] = {}
+
+    def step(self, flow: str, step: str):
+        """Декоратор: регистрирует обработчик шага handler(update, context, conversation, text) -> следующий шаг."""
+        def register(handler: StepHandler) -> StepHandler:
+            self._steps[(flow, step)] = handler
+            return handler
+        return register
+
+    def start(self, context, flow: str, step: str, **data: Any):
+        """Начинает диалог (предыдущий незавершенный диалог пользователя отбрасывается)."""
+        if (flow, step) not in self._steps:
+            raise KeyError(f"Шаг {flow}:{step} не зарегистрирован")
+        context.user_data[USER_DATA_KEY] = [flow, step, data, time.time() + self.ttl]
+        metrics.inc("conversations_started_total", flow=flow)
+
+    def get(self, context) -> Optional[Conversation]:
+        state = context.user_data.get(USER_DATA_KEY)
+        if state is None:
+            return None
+        if state[3] <= time.time():
+            context.user_data.pop(USER_DATA_KEY, None)
+            metrics.inc("conversations_expired_total", flow=state[0])
+            return None
+        return Conversation(state[0], state[1], state[2])
+
+    def finish(self, context):
+        context.user_data.pop(USER_DATA_KEY, None)
+
+    async def dispatch(self, update, context) -> bool:
+        """Передает текст шагу активного диалога пользователя. False - если диалога нет."""
+        conversation = self.get(context)
+        if conversation is None:
+            return False
+        state = context.user_data[USER_DATA_KEY]
+        route = f"{conversation.flow}:{conversation.step}"
+        started = time.monotonic()
+        try:
+            next_step = await self._steps[(conversation.flow, conversation.step)](
+                update, context, conversation, update.message.text.strip())
+        except Exception:
+            self.finish(context)
+            raise
+        finally:
+            metrics.observe("handler_latency_seconds", time.monotonic() - started, route=route)
+        if context.user_data.get(USER_DATA_KEY) is not state:
+            return True # Обработчик сам завершил или начал другой диалог
+        if next_step is None:
+            self.finish(context)
+            metrics.inc("conversations_finished_total", flow=conversation.flow)
+        else:
+            state[1] = next_step
+            state[3] = time.time() + self.ttl
+        return True
+
+conversations = ConversationMachine()
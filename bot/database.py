@@ -1,21 +1,106 @@
-# bot/database.py
-from sqlalchemy import create_engine
-from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
-from bot.config import DATABASE_URL
-
-engine = create_engine(DATABASE_URL, pool_pre_ping=True) # pool_pre_ping помогает избежать ошибок соединения
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
-
-Base = declarative_base()
-
-def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
-
-def init_db():
-    from bot import models
-    Base.metadata.create_all(bind=engine)
+# bot/database.py
+import asyncio
+import time
+import weakref
+from contextlib import contextmanager, asynccontextmanager
+from contextvars import ContextVar
+from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
+from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.orm import sessionmaker
+from bot.config import DATABASE_URL, ASYNC_DATABASE_URL, AUTO_MIGRATE
+from bot import metrics
+
+engine = create_engine(DATABASE_URL, pool_pre_ping=True) # pool_pre_ping помогает избежать ошибок соединения
+SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+# --- Асинхронный доступ (asyncpg) ---
+# Соединения asyncpg привязаны к event loop, поэтому держим отдельный движок на каждый loop:
+# PTB работает в своем loop, а задачи планировщика - в своем.
+_async_engines = weakref.WeakKeyDictionary()
+AsyncSessionLocal = async_sessionmaker(class_=AsyncSession, autoflush=False, expire_on_commit=False)
+
+Base = declarative_base()
+
+def get_async_engine():
+    """Возвращает асинхронный движок для текущего event loop."""
+    loop = asyncio.get_running_loop()
+    async_engine = _async_engines.get(loop)
+    if async_engine is None:
+        async_engine = create_async_engine(ASYNC_DATABASE_URL, pool_pre_ping=True)
+        _async_engines[loop] = async_engine
+    return async_engine
+
+def get_async_session() -> AsyncSession:
+    """Создает AsyncSession, привязанную к движку текущего event loop."""
+    return AsyncSessionLocal(bind=get_async_engine())
+
+async def dispose_async_engine():
+    """Закрывает пул соединений текущего event loop (для короткоживущих loop'ов)."""
+    async_engine = _async_engines.pop(asyncio.get_running_loop(), None)
+    if async_engine is not None:
+        await async_engine.dispose()
+
+# --- Сессия на единицу работы (апдейт Telegram, HTTP-запрос, задача планировщика) ---
+# Первый scope открывает сессию и кладет ее в ContextVar, вложенные scope'ы переиспользуют ее.
+_current_session = ContextVar("current_db_session", default=None)
+_current_async_session = ContextVar("current_async_db_session", default=None)
+
+def _record_session_closed(kind: str, started: float, failed: bool):
+    metrics.add_gauge("db_sessions_active", -1, kind=kind)
+    metrics.observe("db_session_duration_seconds", time.monotonic() - started, kind=kind)
+    if failed:
+        metrics.inc("db_sessions_failed_total", kind=kind)
+
+@contextmanager
+def session_scope():
+    """Синхронная сессия на единицу работы (Flask-запрос, поток обработки заказа)."""
+    db = _current_session.get()
+    if db is not None:
+        yield db
+        return
+    db = SessionLocal()
+    token = _current_session.set(db)
+    started = time.monotonic()
+    metrics.inc("db_sessions_opened_total", kind="sync")
+    metrics.add_gauge("db_sessions_active", 1, kind="sync")
+    failed = False
+    try:
+        yield db
+    except BaseException:
+        failed = True
+        db.rollback()
+        raise
+    finally:
+        _current_session.reset(token)
+        db.close()
+        _record_session_closed("sync", started, failed)
+
+@asynccontextmanager
+async def async_session_scope():
+    """Асинхронная сессия на единицу работы (апдейт Telegram, задача планировщика)."""
+    session = _current_async_session.get()
+    if session is not None:
+        yield session
+        return
+    session = get_async_session()
+    token = _current_async_session.set(session)
+    started = time.monotonic()
+    metrics.inc("db_sessions_opened_total", kind="async")
+    metrics.add_gauge("db_sessions_active", 1, kind="async")
+    failed = False
+    try:
+        yield session
+    except BaseException:
+        failed = True
+        await session.rollback()
+        raise
+    finally:
+        _current_async_session.reset(token)
+        await session.close()
+        _record_session_closed("async", started, failed)
+
+def init_db():
+    """Сверяет номер версии схемы и при необходимости накатывает миграции."""
+    from bot.migrations import check_schema_version
+    check_schema_version(auto_migrate=AUTO_MIGRATE)
@@ -0,0 +1,77 @@
+# bot/funpay_catalog.py
+# Общий каталог категорий/подкатегорий FunPay для всех Account из пула.
+# Каталог одинаков для всех продавцов, поэтому парсится один раз (а не при каждом холодном Account.get),
+# хранится в памяти в одном экземпляре и сохраняется снимком на диск, чтобы после рестарта не парсить заново.
+# Перестраивается не чаще раза в FUNPAY_CATALOG_TTL секунд - при инициализации очередного аккаунта.
+import logging
+import os
+import pickle
+import threading
+import time
+from typing import Callable, Optional
+from bot import metrics
+from bot.config import FUNPAY_CATALOG_TTL, FUNPAY_CATALOG_SNAPSHOT_PATH
+
+# Версия формата снимка: увеличить при изменении структуры Account.parse_categories / funpay_lib.types
+CATALOG_FORMAT_VERSION = 1
+
+class CategoryCatalog:
+    def __init__(self, snapshot_path: Optional[str] = FUNPAY_CATALOG_SNAPSHOT_PATH, ttl: float = FUNPAY_CATALOG_TTL):
+        self.snapshot_path = snapshot_path
+        self.ttl = ttl
+        self._data: Optional[tuple] = None
+        self._built_at = 0.0 # time.time() построения (переживает рестарт через снимок)
+        self._lock = threading.Lock()
+
+    def _is_fresh(self) -> bool:
+        return self._data is not None and time.time() - self._built_at < self.ttl
+
+    def _load_snapshot(self):
+        if not self.snapshot_path or not os.path.exists(self.snapshot_path):
+            return
+        try:
+            with open(self.snapshot_path, "rb") as f:
+                snapshot = pickle.load(f)
+        except Exception as e:
+            logging.warning(f"[FUNPAY CATALOG] Не удалось прочитать снимок {self.snapshot_path}: {e}")
+            return
+        if snapshot.get("version") != CATALOG_FORMAT_VERSION:
+            return
+        self._data, self._built_at = snapshot["data"], snapshot["built_at"]
+        metrics.inc("funpay_catalog_loads_total", source="snapshot")
+
+    def _save_snapshot(self):
+        if not self.snapshot_path:
+            return
+        try:
+            os.makedirs(os.path.dirname(self.snapshot_path) or ".", exist_ok=True)
+            tmp_path = self.snapshot_path + ".tmp"
+            with open(tmp_path, "wb") as f:
+                pickle.dump({"version": CATALOG_FORMAT_VERSION, "built_at": self._built_at, "data": self._data}, f)
+            os.replace(tmp_path, self.snapshot_path)
+        except Exception as e:
+            logging.warning(f"[FUNPAY CATALOG] Не удалось сохранить снимок {self.snapshot_path}: {e}")
+
+    def get(self, build: Callable[[], tuple]) -> tuple:
+        """Возвращает общий каталог; build() (парсинг страницы) вызывается, только если каталог пуст или устарел."""
+        with self._lock:
+            if self._data is None:
+                self._load_snapshot()
+            if self._is_fresh():
+                metrics.inc("funpay_catalog_hits_total")
+                return self._data
+            started = time.monotonic()
+            data = build()
+            metrics.observe("funpay_catalog_build_seconds", time.monotonic() - started)
+            categories = data[0]
+            if not categories:
+                # Страница без списка игр (разметка, ошибка) - пустой результат не кэшируем и не затираем им каталог
+                logging.warning("[FUNPAY CATALOG] Категории не найдены на странице.")
+                return self._data if self._data is not None else data
+            self._data, self._built_at = data, time.time()
+            metrics.inc("funpay_catalog_loads_total", source="parse")
+            metrics.set_gauge("funpay_catalog_categories", len(categories))
+            self._save_snapshot()
+            return self._data
+
+category_catalog = CategoryCatalog()
@@ -0,0 +1,167 @@
+# bot/funpay_outbox.py
+# Очередь исходящих сообщений покупателям FunPay, по одной на FunPay аккаунт владельца.
+# - Отправку выполняет отдельный поток на аккаунт (живет, пока очередь не пуста), темп задает rate_limiter пула.
+# - Отказ "слишком часто" не теряет сообщение: оно возвращается в начало очереди и уходит после паузы,
+#   которую ограничитель выставил по ошибке FunPay.
+# - Несколько ожидающих текстов в один чат склеиваются в одно сообщение (в пределах FUNPAY_MESSAGE_MAX_LEN).
+# Если сообщение так и не доставлено за FUNPAY_OUTBOX_MAX_ATTEMPTS попыток, вызывается on_failure.
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Optional
+from bot import metrics
+from bot.config import FUNPAY_OUTBOX_MAX_ATTEMPTS, FUNPAY_OUTBOX_RETRY_DELAY, FUNPAY_MESSAGE_MAX_LEN
+from bot import funpay_pool
+from bot.funpay_pool import run_for_owner
+
+COALESCE_SEPARATOR = "\n\n"
+
+class _FloodRejected(Exception):
+    def __init__(self, cooldown: float):
+        super().__init__(f"flood cooldown {cooldown:.1f}s")
+        self.cooldown = cooldown
+
+class _PendingMessage:
+    def __init__(self, text: str, on_failure: Optional[Callable[[str], Any]]):
+        self.text = text
+        self.on_failure = on_failure
+        self.enqueued_at = time.monotonic()
+
+class _AccountOutbox:
+    def __init__(self, owner_tg_id: int):
+        self.owner_tg_id = owner_tg_id
+        self.label = f"owner:{owner_tg_id}"
+        self.chats: OrderedDict = OrderedDict() # chat_id -> [_PendingMessage]
+        self.attempts: dict = {} # chat_id -> неудачных попыток подряд
+        self.not_before = 0.0 # monotonic: раньше этого времени не отправляем (после отказа)
+        self.worker: Optional[threading.Thread] = None
+
+    def depth(self) -> int:
+        return sum(len(messages) for messages in self.chats.values())
+
+def _coalesce(messages: list) -> tuple[str, list]:
+    """Склеивает тексты начала очереди чата, пока помещаются в FUNPAY_MESSAGE_MAX_LEN. Возвращает (текст, взятые)."""
+    taken = [messages[0]]
+    text = messages[0].text
+    for message in messages[1:]:
+        candidate = text + COALESCE_SEPARATOR + message.text
+        if len(candidate) > FUNPAY_MESSAGE_MAX_LEN:
+            break
+        text = candidate
+        taken.append(message)
+    return text, taken
+
+def _send(chat_id, text: str):
+    def send(fp_acc):
+        try:
+            return fp_acc.send_message(chat_id, text)
+        except funpay_pool.FunPayAPI.exceptions.MessageNotDeliveredError:
+            # send вызывается только на аккаунте пула - библиотека и ограничитель уже загружены
+            api, limiter = funpay_pool.FunPayAPI, funpay_pool.rate_limiter
+            cooldown = max(limiter.cooldown_left(fp_acc, api.ratelimit.CHAT_SEND),
+                           limiter.cooldown_left(fp_acc, api.ratelimit.MULTI_USER_SEND))
+            if cooldown:
+                raise _FloodRejected(cooldown)
+            raise
+    return send
+
+class FunPayOutbox:
+    def __init__(self):
+        self._outboxes: dict[int, _AccountOutbox] = {}
+        self._lock = threading.Lock()
+        self._idle = threading.Condition(self._lock)
+
+    def enqueue(self, owner_tg_id: int, chat_id, text: str, on_failure: Optional[Callable[[str], Any]] = None):
+        """Ставит сообщение в очередь аккаунта владельца. on_failure(text) - если доставить не удалось."""
+        with self._lock:
+            outbox = self._outboxes.get(owner_tg_id)
+            if outbox is None:
+                outbox = self._outboxes[owner_tg_id] = _AccountOutbox(owner_tg_id)
+            outbox.chats.setdefault(chat_id, []).append(_PendingMessage(text, on_failure))
+            metrics.set_gauge("funpay_outbox_depth", outbox.depth(), account=outbox.label)
+            if outbox.worker is None:
+                outbox.worker = threading.Thread(target=self._drain, args=(outbox,), daemon=True,
+                                                 name=f"funpay-outbox-{owner_tg_id}")
+                outbox.worker.start()
+
+    def wait_idle(self, timeout: float) -> bool:
+        """Ждет, пока все очереди опустеют (остановка процесса). False - если за timeout не дождались."""
+        deadline = time.monotonic() + timeout
+        with self._idle:
+            while self._outboxes:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self._idle.wait(remaining)
+        return True
+
+    def _next_batch(self, outbox: _AccountOutbox):
+        """Берет (chat_id, текст, сообщения) из начала очереди или None, если очередь пуста (поток завершается)."""
+        with self._lock:
+            if not outbox.chats:
+                outbox.worker = None
+                del self._outboxes[outbox.owner_tg_id]
+                self._idle.notify_all()
+                return None
+            chat_id, messages = next(iter(outbox.chats.items()))
+            text, taken = _coalesce(messages)
+            return chat_id, text, taken
+
+    def _finish(self, outbox: _AccountOutbox, chat_id, taken: list):
+        with self._lock:
+            messages = outbox.chats[chat_id]
+            del messages[:len(taken)]
+            if not messages:
+                del outbox.chats[chat_id]
+            outbox.attempts.pop(chat_id, None)
+            metrics.set_gauge("funpay_outbox_depth", outbox.depth(), account=outbox.label)
+
+    def _rotate(self, outbox: _AccountOutbox, chat_id):
+        # Чат уходит в конец очереди, чтобы его повторы не задерживали остальных покупателей
+        with self._lock:
+            outbox.chats.move_to_end(chat_id)
+
+    def _drain(self, outbox: _AccountOutbox):
+        while True:
+            delay = outbox.not_before - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            batch = self._next_batch(outbox)
+            if batch is None:
+                return
+            chat_id, text, taken = batch
+            try:
+                if run_for_owner(outbox.owner_tg_id, _send(chat_id, text)) is None:
+                    raise RuntimeError("FunPay аккаунт владельца недоступен")
+            except _FloodRejected as e:
+                # Не считаем попыткой: FunPay просит подождать, ждем ровно выставленную паузу
+                metrics.inc("funpay_outbox_flood_retries_total", account=outbox.label)
+                outbox.not_before = time.monotonic() + e.cooldown
+                continue
+            except Exception as e:
+                attempts = outbox.attempts.get(chat_id, 0) + 1
+                outbox.attempts[chat_id] = attempts
+                logging.error(f"[FUNPAY OUTBOX] Ошибка отправки в чат {chat_id} ({attempts}/{FUNPAY_OUTBOX_MAX_ATTEMPTS}): {e}")
+                if attempts < FUNPAY_OUTBOX_MAX_ATTEMPTS:
+                    outbox.not_before = time.monotonic() + FUNPAY_OUTBOX_RETRY_DELAY * attempts
+                    self._rotate(outbox, chat_id)
+                    continue
+                metrics.inc("funpay_outbox_failed_total", len(taken), account=outbox.label)
+                self._finish(outbox, chat_id, taken)
+                for message in taken:
+                    if message.on_failure:
+                        try:
+                            message.on_failure(message.text)
+                        except Exception as callback_error:
+                            logging.error(f"[FUNPAY OUTBOX] Ошибка on_failure: {callback_error}")
+                continue
+            now = time.monotonic()
+            for message in taken:
+                metrics.observe("funpay_outbox_delivery_seconds", now - message.enqueued_at, account=outbox.label)
+            metrics.inc("funpay_outbox_sent_total", account=outbox.label)
+            if len(taken) > 1:
+                metrics.inc("funpay_outbox_coalesced_total", len(taken) - 1, account=outbox.label)
+            self._finish(outbox, chat_id, taken)
+
+funpay_outbox = FunPayOutbox()
@@ -0,0 +1,251 @@
+# bot/funpay_pool.py
+# Пул инициализированных FunPay Account (funpay_lib) по владельцу / FunPay аккаунту.
+# Account создается и логинится (Account.get) один раз, дальше переиспользуется: отправка
+# сообщения покупателю - один запрос, а не полный вход. Сессия (PHPSESSID / csrf_token)
+# обновляется раз в FUNPAY_SESSION_REFRESH_MIN..MAX секунд (Account.get требует 40-60 минут)
+# облегченным Account.refresh_session - в фоне (keep_sessions_alive) или, если фон не успел,
+# при обращении. При UnauthorizedError аккаунт перелогинивается и вызов повторяется один раз.
+# Неиспользуемые аккаунты вытесняются через FUNPAY_POOL_IDLE_TTL секунд.
+# Все запросы аккаунтов пула проходят через общий rate_limiter (funpay_lib/common/ratelimit.py).
+import importlib.util
+import logging
+import os
+import random
+import sys
+import threading
+import time
+from typing import Any, Callable, Hashable, Optional
+from bot import metrics
+from bot.config import (FUNPAY_SESSION_REFRESH_MIN, FUNPAY_SESSION_REFRESH_MAX, FUNPAY_SESSION_REFRESH_BATCH,
+                        FUNPAY_POOL_IDLE_TTL, FUNPAY_POOL_SIZE, FUNPAY_RATE_LIMITS)
+from bot.database import session_scope
+from bot.funpay_catalog import category_catalog
+from bot.models import Owner, FunPayAccount
+from bot.utils import decrypt_data, decrypt_owner_funpay_creds
+
+FUNPAY_LIB_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'funpay_lib')
+
+def _load_funpay_api():
+    """
+    Загружает локальную копию funpay_lib под именем FunPayAPI: внутри библиотеки
+    абсолютные импорты вида `import FunPayAPI.common.enums`.
+    """
+    module = sys.modules.get('FunPayAPI')
+    if module is not None:
+        return module
+    spec = importlib.util.spec_from_file_location(
+        'FunPayAPI', os.path.join(FUNPAY_LIB_DIR, '__init__.py'), submodule_search_locations=[FUNPAY_LIB_DIR]
+    )
+    module = importlib.util.module_from_spec(spec)
+    sys.modules['FunPayAPI'] = module
+    try:
+        spec.loader.exec_module(module)
+    except BaseException:
+        sys.modules.pop('FunPayAPI', None)
+        raise
+    return module
+
+def _on_rate_limit_wait(endpoint_class: str, seconds: float):
+    metrics.inc("funpay_rate_limit_waits_total", endpoint=endpoint_class)
+    metrics.inc("funpay_rate_limit_wait_seconds_total", seconds, endpoint=endpoint_class)
+
+# funpay_lib тянет requests, bs4 и lxml - загружается при первом обращении к API (funpay_api()),
+# а не при импорте модуля: процессы, которые не работают с FunPay (бот, воркеры), его не грузят
+FunPayAPI = None
+# Один ограничитель на процесс: ведра на аккаунт + общий бюджет на прокси/IP
+rate_limiter = None
+_api_lock = threading.Lock()
+_api_error: Optional[BaseException] = None
+
+def funpay_api():
+    """Модуль FunPayAPI (загружается при первом вызове) или None, если библиотека недоступна."""
+    global FunPayAPI, rate_limiter, _api_error
+    if FunPayAPI is not None or _api_error is not None:
+        return FunPayAPI
+    with _api_lock:
+        if FunPayAPI is None and _api_error is None:
+            try:
+                module = _load_funpay_api()
+            except (ImportError, FileNotFoundError) as e:
+                logging.warning(f"FunPayCardinal не найден или ошибка импорта: {e}")
+                _api_error = e
+                return None
+            module.Account.category_catalog = category_catalog # Один каталог категорий на все аккаунты пула
+            rate_limiter = module.ratelimit.RateLimiter(
+                limits={name: tuple(limit) for name, limit in FUNPAY_RATE_LIMITS.items()}, on_wait=_on_rate_limit_wait
+            )
+            FunPayAPI = module
+            logging.info("FunPayCardinal (локальная копия) успешно импортирован.")
+    return FunPayAPI
+
+class _PooledAccount:
+    def __init__(self, key: Hashable, account):
+        self.key = key
+        self.account = account
+        self.lock = threading.Lock() # Логин/обновление сессии одного аккаунта - строго по одному
+        self.refreshed_at = 0.0
+        self.next_refresh_at = 0.0
+        self.last_used_at = time.monotonic()
+
+    def schedule_refresh(self):
+        self.refreshed_at = time.monotonic()
+        self.next_refresh_at = self.refreshed_at + random.uniform(FUNPAY_SESSION_REFRESH_MIN, FUNPAY_SESSION_REFRESH_MAX)
+
+class FunPayAccountPool:
+    """Реестр залогиненных FunPay Account. Ключи: ('owner', tg_id) или ('funpay_account', id)."""
+
+    def __init__(self, maxsize: int = FUNPAY_POOL_SIZE, idle_ttl: float = FUNPAY_POOL_IDLE_TTL):
+        self.maxsize = maxsize
+        self.idle_ttl = idle_ttl
+        self._entries: dict[Hashable, _PooledAccount] = {}
+        self._lock = threading.Lock()
+
+    def _login(self, entry: _PooledAccount, reason: str):
+        """Полный вход (Account.get) или, для reason='refresh', облегченное обновление сессии."""
+        started = time.monotonic()
+        try:
+            if reason == "refresh":
+                entry.account.refresh_session()
+            else:
+                entry.account.get()
+        except Exception:
+            metrics.inc("funpay_login_failures_total", reason=reason)
+            raise
+        finally:
+            metrics.observe("funpay_login_seconds", time.monotonic() - started, reason=reason)
+        metrics.inc("funpay_logins_total", reason=reason)
+        entry.schedule_refresh()
+
+    def _entry(self, key: Hashable, load_golden_key: Callable[[], Optional[str]]) -> Optional[_PooledAccount]:
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry is None:
+            golden_key = load_golden_key()
+            if not golden_key:
+                return None
+            with self._lock:
+                entry = self._entries.get(key)
+                if entry is None:
+                    entry = self._entries[key] = _PooledAccount(
+                        key, FunPayAPI.Account(golden_key=golden_key, rate_limiter=rate_limiter))
+                    self._evict_over_limit()
+                    metrics.set_gauge("funpay_pool_accounts", len(self._entries))
+        entry.last_used_at = time.monotonic()
+        with entry.lock:
+            if not entry.account.is_initiated:
+                self._login(entry, "init")
+            elif time.monotonic() >= entry.next_refresh_at:
+                self._login(entry, "refresh")
+        return entry
+
+    def _evict_over_limit(self):
+        # Вызывается под self._lock
+        while len(self._entries) > self.maxsize:
+            oldest = min(self._entries.values(), key=lambda e: e.last_used_at)
+            del self._entries[oldest.key]
+            metrics.inc("funpay_pool_evictions_total", reason="size")
+
+    def run(self, key: Hashable, load_golden_key: Callable[[], Optional[str]], func: Callable[[Any], Any]) -> Any:
+        """
+        Выполняет func(account) на залогиненном аккаунте. При UnauthorizedError перелогинивается
+        и повторяет вызов один раз. Возвращает None, если учетных данных нет или API недоступен.
+        """
+        api = funpay_api()
+        if api is None:
+            return None
+        entry = self._entry(key, load_golden_key)
+        if entry is None:
+            return None
+        try:
+            return func(entry.account)
+        except api.exceptions.UnauthorizedError:
+            logging.warning(f"[FUNPAY POOL] Сессия {key} недействительна, перелогиниваемся.")
+            with entry.lock:
+                self._login(entry, "reauth")
+            return func(entry.account)
+
+    def refresh_due(self, limit: int) -> int:
+        """
+        Обновляет сессии, срок которых подошел, - не больше limit за вызов, чтобы нагрузка
+        распределялась по времени. Аккаунты, занятые другим потоком, пропускаются до следующего раза.
+        При UnauthorizedError делается полный вход. Возвращает число обновленных аккаунтов.
+        """
+        now = time.monotonic()
+        due = sorted((e for e in self.entries() if e.account.is_initiated and e.next_refresh_at <= now),
+                     key=lambda e: e.next_refresh_at)
+        refreshed = 0
+        for entry in due[:limit]:
+            if not entry.lock.acquire(blocking=False):
+                continue
+            try:
+                try:
+                    self._login(entry, "refresh")
+                except FunPayAPI.exceptions.UnauthorizedError:
+                    self._login(entry, "reauth")
+                refreshed += 1
+            except Exception as e:
+                # Повторим в следующий тик; при обращении к аккаунту пул тоже попробует обновить сессию
+                logging.error(f"[FUNPAY POOL] Не удалось обновить сессию {entry.key}: {e}")
+            finally:
+                entry.lock.release()
+        self._publish_session_ages()
+        return refreshed
+
+    def _publish_session_ages(self):
+        now = time.monotonic()
+        ages = [now - e.refreshed_at for e in self.entries() if e.refreshed_at]
+        metrics.set_gauge("funpay_session_age_seconds_max", max(ages, default=0))
+        metrics.set_gauge("funpay_session_age_seconds_avg", sum(ages) / len(ages) if ages else 0)
+
+    def invalidate(self, key: Hashable):
+        """Убирает аккаунт из пула (например, после смены golden_key)."""
+        with self._lock:
+            if self._entries.pop(key, None) is not None:
+                metrics.inc("funpay_pool_evictions_total", reason="invalidated")
+            metrics.set_gauge("funpay_pool_accounts", len(self._entries))
+
+    def evict_idle(self):
+        """Вытесняет аккаунты, которыми не пользовались дольше idle_ttl."""
+        deadline = time.monotonic() - self.idle_ttl
+        with self._lock:
+            idle = [key for key, entry in self._entries.items() if entry.last_used_at < deadline]
+            for key in idle:
+                del self._entries[key]
+            metrics.set_gauge("funpay_pool_accounts", len(self._entries))
+        if idle:
+            metrics.inc("funpay_pool_evictions_total", len(idle), reason="idle")
+            logging.info(f"[FUNPAY POOL] Вытеснено неактивных аккаунтов: {len(idle)}.")
+
+    def entries(self) -> list[_PooledAccount]:
+        with self._lock:
+            return list(self._entries.values())
+
+funpay_pool = FunPayAccountPool()
+
+def keep_sessions_alive():
+    """Задача планировщика: фоновое обновление сессий, чтобы запросы не ждали логина."""
+    if FunPayAPI is not None: # Пока к FunPay не обращались, пул пуст и библиотеку не грузим
+        funpay_pool.refresh_due(FUNPAY_SESSION_REFRESH_BATCH)
+
+# --- Загрузка golden_key из БД (только при первом обращении к ключу пула) ---
+def _owner_golden_key(owner_tg_id: int) -> Optional[str]:
+    with session_scope() as db:
+        owner = db.query(Owner).filter(Owner.tg_id == owner_tg_id).first()
+        creds = decrypt_owner_funpay_creds(owner)
+    if not creds:
+        logging.warning(f"FP creds not found for owner {owner_tg_id}")
+        return None
+    return creds[1]
+
+def _funpay_account_golden_key(funpay_account_id: int) -> Optional[str]:
+    with session_scope() as db:
+        fp_account = db.query(FunPayAccount).filter(FunPayAccount.id == funpay_account_id).first()
+        encrypted = fp_account.golden_key_encrypted if fp_account and fp_account.is_active else None
+    return decrypt_data(encrypted) if encrypted else None
+
+def run_for_owner(owner_tg_id: int, func: Callable[[Any], Any]) -> Any:
+    return funpay_pool.run(('owner', owner_tg_id), lambda: _owner_golden_key(owner_tg_id), func)
+
+def run_for_funpay_account(funpay_account_id: int, func: Callable[[Any], Any]) -> Any:
+    return funpay_pool.run(('funpay_account', funpay_account_id),
+                           lambda: _funpay_account_golden_key(funpay_account_id), func)
@@ -0,0 +1,112 @@
+# bot/key_rotation.py
+# Фоновое перешифрование секретов активным ключом (ACTIVE_KEY_ID) после ротации ключей.
+# Таблицы обходятся keyset-пагинацией по id короткими транзакциями, без блокировки таблиц:
+# строка обновляется только если шифротекст не изменился с момента чтения, поэтому
+# параллельные изменения (смена пароля, новые учетные данные) не перетираются.
+# Запуск: python -m bot.key_rotation (или задача планировщика reencrypt_secrets).
+import logging
+import time
+from sqlalchemy import text
+from bot import metrics
+from bot.config import REENCRYPT_BATCH_SIZE, REENCRYPT_MAX_ROWS_PER_SECOND
+from bot.database import engine
+from bot.utils import decrypt_bytes, encrypt_bytes, needs_reencrypt, active_key_header
+
+# Таблица -> зашифрованные колонки
+ENCRYPTED_COLUMNS = {
+    "owners": ("funpay_user_id_encrypted", "funpay_golden_key_encrypted"),
+    "funpay_accounts": ("user_id_encrypted", "golden_key_encrypted"),
+    "accounts": ("base_password_encrypted", "shared_secret_encrypted"),
+    "bot_user_state": ("data",), # Состояние пользователей PTB (bot/persistence.py)
+}
+# Ключ пагинации, если он не id
+KEY_COLUMNS = {
+    "bot_user_state": "user_id",
+}
+
+def _select_batch_sql(table: str, columns: tuple, key: str = "id") -> str:
+    # В SQL отсекаем строки, где все значения уже под активным ключом (или NULL)
+    stale = " OR ".join(f"({col} IS NOT NULL AND substring({col} from 1 for :header_len) <> :header)" for col in columns)
+    return (
+        f"SELECT {key} AS id, {', '.join(columns)} FROM {table} "
+        f"WHERE {key} > :last_id AND ({stale}) ORDER BY {key} LIMIT :batch_size"
+    )
+
+def _reencrypt_row(conn, table: str, columns: tuple, row, key: str = "id") -> int:
+    """Перешифровывает одну строку. Возвращает количество перешифрованных байт открытого текста."""
+    stale = [(col, bytes(row[col])) for col in columns if row[col] is not None and needs_reencrypt(row[col])]
+    if not stale:
+        return 0
+    params = {"id": row["id"]}
+    assignments, guards = [], []
+    reencrypted_bytes = 0
+    for i, (col, old_value) in enumerate(stale):
+        # Без кэша секретов: каждое значение читается один раз, а обход не должен вытеснять горячие секреты
+        data = decrypt_bytes(old_value)
+        params[f"new_{i}"] = encrypt_bytes(data)
+        params[f"old_{i}"] = old_value
+        assignments.append(f"{col} = :new_{i}")
+        guards.append(f"{col} = :old_{i}")
+        reencrypted_bytes += len(data)
+    result = conn.execute(text(
+        f"UPDATE {table} SET {', '.join(assignments)} WHERE {key} = :id AND {' AND '.join(guards)}"
+    ), params)
+    if not result.rowcount:
+        return 0 # Строку изменили параллельно - новое значение уже зашифровано активным ключом
+    return reencrypted_bytes
+
+def reencrypt_table(table: str, batch_size: int = REENCRYPT_BATCH_SIZE,
+                    max_rows_per_second: float = REENCRYPT_MAX_ROWS_PER_SECOND) -> tuple[int, int]:
+    """Перешифровывает устаревшие значения таблицы. Возвращает (строк, байт)."""
+    columns = ENCRYPTED_COLUMNS[table]
+    key = KEY_COLUMNS.get(table, "id")
+    header = active_key_header()
+    select_sql = text(_select_batch_sql(table, columns, key))
+    last_id, total_rows, total_bytes = 0, 0, 0
+    while True:
+        batch_started = time.monotonic()
+        with engine.begin() as conn:
+            rows = conn.execute(select_sql, {
+                "last_id": last_id, "batch_size": batch_size, "header": header, "header_len": len(header)
+            }).mappings().all()
+            if not rows:
+                return total_rows, total_bytes
+            for row in rows:
+                reencrypted_bytes = _reencrypt_row(conn, table, columns, row, key)
+                if reencrypted_bytes:
+                    total_rows += 1
+                    total_bytes += reencrypted_bytes
+            last_id = rows[-1]["id"]
+        metrics.inc("reencrypt_rows_total", len(rows), table=table)
+        # Ограничение скорости записи: пачка из N строк занимает не меньше N / max_rows_per_second секунд
+        if max_rows_per_second:
+            delay = len(rows) / max_rows_per_second - (time.monotonic() - batch_started)
+            if delay > 0:
+                time.sleep(delay)
+
+def reencrypt_secrets():
+    """Задача планировщика: перешифровать все таблицы и сообщить пропускную способность."""
+    started = time.monotonic()
+    rows, size = 0, 0
+    try:
+        for table in ENCRYPTED_COLUMNS:
+            table_rows, table_bytes = reencrypt_table(table)
+            rows += table_rows
+            size += table_bytes
+    except Exception as e:
+        logging.error(f"[KEY ROTATION] Ошибка перешифрования: {e}", exc_info=True)
+        return
+    if rows:
+        elapsed = time.monotonic() - started
+        bytes_per_second = size / elapsed if elapsed else 0.0
+        metrics.set_gauge("reencrypt_bytes_per_second", bytes_per_second)
+        logging.info(f"[KEY ROTATION] Перешифровано {rows} строк ({size} байт) за {elapsed:.1f} с, "
+                     f"{bytes_per_second:.0f} байт/с.")
+    for op in ("encrypt", "decrypt"):
+        seconds = metrics.get_counter("crypto_seconds_total", op=op)
+        if seconds:
+            metrics.set_gauge("crypto_bytes_per_second", metrics.get_counter("crypto_bytes_total", op=op) / seconds, op=op)
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    reencrypt_secrets()
@@ -0,0 +1,116 @@
+# bot/leases.py
+# Глобальные задачи планировщика при нескольких репликах (таблица scheduler_leases, миграция v0008).
+# Каждая реплика раз в SCHEDULER_POLL_INTERVAL проверяет задачи, захватывая аренду строки задачи
+# одним INSERT ... ON CONFLICT DO UPDATE ... WHERE ... RETURNING:
+# - аренда свободна (lease_until в прошлом) и с прошлого запуска прошел интервал задачи - запускаемся;
+# - иначе запуск пропускается: задачу выполняет или только что выполнила другая реплика.
+# Пока задача идет, аренда продлевается в фоне; по завершении освобождается. Если реплика упала,
+# аренда истекает через SCHEDULER_LEASE_TTL и задачу подхватывает следующая реплика.
+# Аренда не фенсинг: задачи сами захватывают строки (FOR UPDATE SKIP LOCKED) или обновляют их
+# условным UPDATE, поэтому даже при потере аренды посреди запуска строка не обрабатывается дважды.
+# Все сроки считаются по часам БД (now()), а не реплик: расхождение часов между хостами не продлевает
+# и не обрывает чужую аренду.
+import functools
+import logging
+import os
+import socket
+import threading
+import time
+from datetime import timedelta
+from typing import Callable
+from sqlalchemy import text
+from bot import metrics
+from bot.config import SCHEDULER_LEASE_TTL
+from bot.database import engine
+
+HOLDER = f"{socket.gethostname()}:{os.getpid()}"
+
+# Время БД в UTC без часового пояса, как и остальные TIMESTAMP схемы (datetime.utcnow()).
+# now() - время начала транзакции, одно на весь запрос; интервалы передаются секундами.
+_NOW = "(now() AT TIME ZONE 'utc')"
+
+_ACQUIRE_SQL = text(
+    "INSERT INTO scheduler_leases (job_id, holder, lease_until, last_started_at) "
+    f"VALUES (:job_id, :holder, {_NOW} + make_interval(secs => :ttl), {_NOW}) "
+    "ON CONFLICT (job_id) DO UPDATE SET holder = EXCLUDED.holder, lease_until = EXCLUDED.lease_until, "
+    "last_started_at = EXCLUDED.last_started_at "
+    f"WHERE scheduler_leases.lease_until < {_NOW} "
+    f"AND scheduler_leases.last_started_at <= {_NOW} - make_interval(secs => :interval) "
+    "RETURNING job_id"
+)
+
+def try_acquire(job_id: str, interval: timedelta, ttl: float = SCHEDULER_LEASE_TTL) -> bool:
+    """Захватывает аренду задачи, если она свободна и задачу пора запускать."""
+    with engine.begin() as conn:
+        acquired = conn.execute(_ACQUIRE_SQL, {
+            "job_id": job_id, "holder": HOLDER, "ttl": float(ttl), "interval": interval.total_seconds(),
+        }).scalar_one_or_none()
+    return acquired is not None
+
+def renew(job_id: str, ttl: float = SCHEDULER_LEASE_TTL) -> bool:
+    """Продлевает свою аренду. False - аренда потеряна (истекла и захвачена другой репликой)."""
+    with engine.begin() as conn:
+        result = conn.execute(text(
+            f"UPDATE scheduler_leases SET lease_until = {_NOW} + make_interval(secs => :ttl) "
+            "WHERE job_id = :job_id AND holder = :holder"
+        ), {"job_id": job_id, "holder": HOLDER, "ttl": float(ttl)})
+    return result.rowcount == 1
+
+def release(job_id: str):
+    with engine.begin() as conn:
+        conn.execute(text(
+            f"UPDATE scheduler_leases SET lease_until = {_NOW}, last_finished_at = {_NOW} "
+            "WHERE job_id = :job_id AND holder = :holder"
+        ), {"job_id": job_id, "holder": HOLDER})
+
+def _keep_renewed(job_id: str, stop: threading.Event, ttl: float):
+    while not stop.wait(ttl / 3):
+        try:
+            if not renew(job_id, ttl):
+                logging.error(f"[LEASES] Аренда задачи {job_id} потеряна во время выполнения.")
+                metrics.inc("scheduler_lease_lost_total", job=job_id)
+                return
+        except Exception as e:
+            # Временная ошибка БД: попробуем на следующем тике, пока аренда не истекла
+            logging.warning(f"[LEASES] Не удалось продлить аренду задачи {job_id}: {e}")
+
+def leased(job_id: str, interval: timedelta, ttl: float = SCHEDULER_LEASE_TTL):
+    """
+    Декоратор задачи планировщика: запуск только под арендой job_id, не чаще раза в interval
+    на все реплики. Запуски без аренды пропускаются.
+    """
+    def decorator(func: Callable[[], None]):
+        @functools.wraps(func)
+        def runner():
+            try:
+                acquired = try_acquire(job_id, interval, ttl)
+            except Exception as e:
+                logging.error(f"[LEASES] Не удалось захватить аренду задачи {job_id}: {e}")
+                metrics.inc("scheduler_job_runs_total", job=job_id, result="lease_error")
+                return
+            if not acquired:
+                logging.debug(f"[LEASES] Задача {job_id} выполняется или выполнена другой репликой, пропускаем.")
+                metrics.inc("scheduler_job_runs_total", job=job_id, result="skipped")
+                return
+            stop = threading.Event()
+            heartbeat = threading.Thread(target=_keep_renewed, args=(job_id, stop, ttl), daemon=True,
+                                         name=f"lease-{job_id}")
+            heartbeat.start()
+            started = time.monotonic()
+            result = "ok"
+            try:
+                func()
+            except Exception:
+                result = "error"
+                raise
+            finally:
+                stop.set()
+                heartbeat.join()
+                metrics.inc("scheduler_job_runs_total", job=job_id, result=result)
+                metrics.observe("scheduler_job_seconds", time.monotonic() - started, job=job_id)
+                try:
+                    release(job_id)
+                except Exception as e:
+                    logging.warning(f"[LEASES] Не удалось освободить аренду задачи {job_id}: {e}")
+        return runner
+    return decorator
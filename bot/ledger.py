@@ -0,0 +1,63 @@
+# bot/ledger.py
+# Изменения баланса и подписки владельца одним SQL-выражением UPDATE ... RETURNING.
+# Баланс не читается в Python и не пишется обратно, поэтому параллельные пополнения и покупки
+# не затирают друг друга, а арифметика идет в NUMERIC без потери точности (суммы - Decimal).
+# Запись в transactions добавляется в ту же сессию; коммитит вызывающий - изменение баланса
+# и его транзакция фиксируются вместе.
+from datetime import datetime, timedelta
+from decimal import Decimal
+from typing import Optional
+from sqlalchemy import update, func
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+from bot.models import Owner, Transaction
+
+def to_money(value) -> Decimal:
+    """Сумма в Decimal с копейками (float из конфига переводится через str, без двоичных хвостов)."""
+    return Decimal(str(value)).quantize(Decimal("0.01"))
+
+def _credit_stmt(tg_id: int, amount: Decimal):
+    return (update(Owner).where(Owner.tg_id == tg_id)
+            .values(balance=Owner.balance + amount)
+            .returning(Owner.balance))
+
+def _subscription_end_expr(days: int, now: datetime):
+    # Истекшая (или отсутствующая) подписка продлевается от текущего момента, активная - от даты окончания
+    return func.greatest(func.coalesce(Owner.subscription_end, now), now) + timedelta(days=days)
+
+def _purchase_stmt(tg_id: int, price: Decimal, days: int, now: datetime):
+    return (update(Owner).where(Owner.tg_id == tg_id, Owner.balance >= price)
+            .values(balance=Owner.balance - price, subscription_end=_subscription_end_expr(days, now))
+            .returning(Owner.balance, Owner.subscription_end))
+
+def _extend_stmt(tg_id: int, days: int, now: datetime):
+    return (update(Owner).where(Owner.tg_id == tg_id)
+            .values(subscription_end=_subscription_end_expr(days, now))
+            .returning(Owner.subscription_end))
+
+def credit_balance(db: Session, tg_id: int, amount, transaction_type: str = 'topup',
+                   external_id: Optional[str] = None) -> Optional[Decimal]:
+    """Зачисляет amount на баланс (синхронная сессия). Новый баланс или None, если владельца нет."""
+    amount = to_money(amount)
+    balance = db.execute(_credit_stmt(tg_id, amount)).scalar_one_or_none()
+    if balance is None:
+        return None
+    db.add(Transaction(owner_tg_id=tg_id, transaction_type=transaction_type, external_id=external_id,
+                       amount=amount, status='completed'))
+    return balance
+
+async def purchase_subscription(session: AsyncSession, tg_id: int, price, days: int) -> Optional[tuple[Decimal, datetime]]:
+    """
+    Списывает price и продлевает подписку на days дней, только если баланса хватает.
+    Возвращает (остаток, новая дата окончания) или None (владельца нет или недостаточно средств).
+    """
+    price = to_money(price)
+    row = (await session.execute(_purchase_stmt(tg_id, price, days, datetime.utcnow()))).one_or_none()
+    if row is None:
+        return None
+    session.add(Transaction(owner_tg_id=tg_id, transaction_type='subscription', amount=price, status='completed'))
+    return row[0], row[1]
+
+async def extend_subscription(session: AsyncSession, tg_id: int, days: int) -> Optional[datetime]:
+    """Продлевает подписку без списания (активация администратором). Новая дата окончания или None."""
+    return (await session.execute(_extend_stmt(tg_id, days, datetime.utcnow()))).scalar_one_or_none()
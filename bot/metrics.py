@@ -0,0 +1,104 @@
+# bot/metrics.py
+# Простые внутрипроцессные метрики (счетчики, гауджи, гистограммы) без внешних зависимостей.
+# Отдаются в текстовом формате Prometheus через /metrics: в процессах с веб-сервером (RUN_MODE=web,
+# webhook, all) - маршрутом Flask, в остальных (bot, worker, scheduler) - встроенным HTTP-сервером
+# start_http_server на порту PORT.
+import logging
+import threading
+from typing import Optional
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+_lock = threading.Lock()
+_counters = {}
+_gauges = {}
+_histograms = {}
+
+def _key(name: str, labels: dict) -> tuple:
+    return name, tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+def inc(name: str, value: float = 1, **labels):
+    """Увеличивает счетчик."""
+    key = _key(name, labels)
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+
+def set_gauge(name: str, value: float, **labels):
+    """Устанавливает значение гауджа."""
+    with _lock:
+        _gauges[_key(name, labels)] = value
+
+def add_gauge(name: str, delta: float, **labels):
+    """Изменяет значение гауджа на delta."""
+    key = _key(name, labels)
+    with _lock:
+        _gauges[key] = _gauges.get(key, 0) + delta
+
+def observe(name: str, value: float, buckets: Optional[tuple] = None, **labels):
+    """Добавляет наблюдение в гистограмму (обычно длительность в секундах)."""
+    key = _key(name, labels)
+    with _lock:
+        hist = _histograms.get(key)
+        if hist is None:
+            bounds = buckets or DEFAULT_BUCKETS
+            hist = _histograms[key] = {'bounds': bounds, 'counts': [0] * len(bounds), 'count': 0, 'sum': 0.0}
+        hist['count'] += 1
+        hist['sum'] += value
+        for i, bound in enumerate(hist['bounds']):
+            if value <= bound:
+                hist['counts'][i] += 1
+
+def get_counter(name: str, **labels) -> float:
+    with _lock:
+        return _counters.get(_key(name, labels), 0)
+
+def get_gauge(name: str, **labels) -> float:
+    with _lock:
+        return _gauges.get(_key(name, labels), 0)
+
+def _format_labels(labels: tuple, extra: Optional[tuple] = None) -> str:
+    items = list(labels) + list(extra or ())
+    if not items:
+        return ""
+    return "{" + ",".join(f'{k}="{v}"' for k, v in items) + "}"
+
+def render_text() -> str:
+    """Возвращает все метрики в текстовом формате Prometheus."""
+    lines = []
+    with _lock:
+        for (name, labels), value in sorted(_counters.items()):
+            lines.append(f"{name}{_format_labels(labels)} {value}")
+        for (name, labels), value in sorted(_gauges.items()):
+            lines.append(f"{name}{_format_labels(labels)} {value}")
+        for (name, labels), hist in sorted(_histograms.items()):
+            for bound, count in zip(hist['bounds'], hist['counts']):
+                lines.append(f"{name}_bucket{_format_labels(labels, (('le', bound),))} {count}")
+            lines.append(f"{name}_bucket{_format_labels(labels, (('le', '+Inf'),))} {hist['count']}")
+            lines.append(f"{name}_count{_format_labels(labels)} {hist['count']}")
+            lines.append(f"{name}_sum{_format_labels(labels)} {hist['sum']}")
+    return "\n".join(lines) + "\n"
+
+def start_http_server(port: int, host: str = '0.0.0.0'):
+    """Отдает /metrics из фонового потока (для процессов без Flask). Возвращает сервер."""
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split('?', 1)[0] != '/metrics':
+                self.send_error(404)
+                return
+            body = render_text().encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass # Опрос Prometheus не пишем в лог
+
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True, name="metrics-http").start()
+    logging.info(f"[METRICS] /metrics доступен на {host}:{port}.")
+    return server
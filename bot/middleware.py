@@ -0,0 +1,47 @@
+# bot/middleware.py
+# Одна сессия БД на единицу работы: апдейт Telegram, HTTP-запрос Flask, запуск задачи планировщика.
+# Код ниже по стеку получает ту же сессию через session_scope() / async_session_scope().
+# Для апдейтов Telegram - SessionScopedApplication в bot/bot.py (чтобы веб-процесс не импортировал PTB),
+# Flask импортируется только при регистрации в веб-приложении (планировщику нужен лишь run_async_job).
+import asyncio
+import functools
+from typing import TYPE_CHECKING
+from bot.database import session_scope, async_session_scope, dispose_async_engine
+
+if TYPE_CHECKING:
+    from flask import Flask
+
+def register_flask_session_scope(app: 'Flask'):
+    """Открывает синхронную сессию на время каждого запроса Flask."""
+    from flask import g
+
+    @app.before_request
+    def _open_db_session():
+        scope = session_scope()
+        scope.__enter__()
+        g._db_session_scope = scope
+
+    @app.teardown_request
+    def _close_db_session(exc):
+        scope = g.pop('_db_session_scope', None)
+        if scope is not None:
+            if exc is not None:
+                scope.__exit__(type(exc), exc, exc.__traceback__)
+            else:
+                scope.__exit__(None, None, None)
+
+def run_async_job(job_func):
+    """
+    Оборачивает асинхронную задачу для BackgroundScheduler: отдельный event loop,
+    одна сессия БД на запуск и закрытие пула asyncpg этого loop'а по завершении.
+    """
+    @functools.wraps(job_func)
+    def runner():
+        async def _run():
+            try:
+                async with async_session_scope():
+                    await job_func()
+            finally:
+                await dispose_async_engine()
+        asyncio.run(_run())
+    return runner
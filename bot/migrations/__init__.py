@@ -0,0 +1,89 @@
+# bot/migrations/__init__.py
+# Версионные миграции схемы БД.
+# Текущая версия хранится в одной строке таблицы schema_version, поэтому проверка при старте -
+# это один SELECT, а не рефлексия всей схемы, как у Base.metadata.create_all.
+#
+# Каждая миграция - модуль vNNNN_*.py с VERSION, TRANSACTIONAL и upgrade(conn).
+# TRANSACTIONAL = False означает, что upgrade выполняется в режиме AUTOCOMMIT (нужно для
+# CREATE INDEX CONCURRENTLY и пакетных бэкфиллов, которые коммитят каждую пачку отдельно).
+import logging
+import time
+from sqlalchemy import text
+from bot.database import engine
+from bot.migrations import v0001_initial_schema, v0002_rental_indexes, v0003_rollups, v0004_partition_transactions, \
+    v0005_notification_outbox, v0006_bot_user_state, v0007_yookassa_inbox, v0008_scheduler_leases, v0009_shard_global_counters
+
+MIGRATIONS = [
+    v0001_initial_schema,
+    v0002_rental_indexes,
+    v0003_rollups,
+    v0004_partition_transactions,
+    v0005_notification_outbox,
+    v0006_bot_user_state,
+    v0007_yookassa_inbox,
+    v0008_scheduler_leases,
+    v0009_shard_global_counters,
+]
+LATEST_VERSION = MIGRATIONS[-1].VERSION
+
+# Ключ advisory lock, чтобы две реплики не накатывали миграции одновременно
+MIGRATIONS_LOCK_KEY = 727001
+
+def get_current_version(conn) -> int:
+    if conn.execute(text("SELECT to_regclass('schema_version')")).scalar() is None:
+        return 0
+    version = conn.execute(text("SELECT version FROM schema_version WHERE id = 1")).scalar()
+    return version or 0
+
+def _set_version(conn, version: int):
+    conn.execute(text(
+        "CREATE TABLE IF NOT EXISTS schema_version ("
+        " id SMALLINT PRIMARY KEY DEFAULT 1 CHECK (id = 1),"
+        " version INTEGER NOT NULL,"
+        " updated_at TIMESTAMP NOT NULL DEFAULT now())"
+    ))
+    conn.execute(text(
+        "INSERT INTO schema_version (id, version, updated_at) VALUES (1, :version, now()) "
+        "ON CONFLICT (id) DO UPDATE SET version = EXCLUDED.version, updated_at = EXCLUDED.updated_at"
+    ), {"version": version})
+
+def upgrade(target: int | None = None) -> int:
+    """Накатывает миграции до target (по умолчанию до последней). Возвращает итоговую версию."""
+    target = LATEST_VERSION if target is None else target
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as lock_conn:
+        lock_conn.execute(text("SELECT pg_advisory_lock(:key)"), {"key": MIGRATIONS_LOCK_KEY})
+        try:
+            current = get_current_version(lock_conn)
+            for migration in MIGRATIONS:
+                if migration.VERSION <= current or migration.VERSION > target:
+                    continue
+                logging.info(f"[MIGRATIONS] Применяем {migration.__name__} (версия {migration.VERSION})...")
+                started = time.monotonic()
+                if migration.TRANSACTIONAL:
+                    with engine.begin() as conn:
+                        migration.upgrade(conn)
+                        _set_version(conn, migration.VERSION)
+                else:
+                    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+                        migration.upgrade(conn)
+                        _set_version(conn, migration.VERSION)
+                current = migration.VERSION
+                logging.info(f"[MIGRATIONS] Версия {current} применена за {time.monotonic() - started:.1f} с.")
+            return current
+        finally:
+            lock_conn.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": MIGRATIONS_LOCK_KEY})
+
+def check_schema_version(auto_migrate: bool = True) -> int:
+    """Проверка при старте: сравнивает только номер версии схемы."""
+    with engine.connect() as conn:
+        current = get_current_version(conn)
+    if current == LATEST_VERSION:
+        return current
+    if current > LATEST_VERSION:
+        raise RuntimeError(f"Версия схемы БД ({current}) новее кода ({LATEST_VERSION}). Обновите приложение.")
+    if not auto_migrate:
+        raise RuntimeError(
+            f"Схема БД устарела (версия {current}, нужна {LATEST_VERSION}). "
+            f"Выполните: python -m bot.migrations upgrade"
+        )
+    return upgrade()
@@ -0,0 +1,26 @@
+# bot/migrations/__main__.py
+# Использование: python -m bot.migrations [upgrade [VERSION] | current]
+import sys
+import logging
+from bot.database import engine
+from bot.migrations import upgrade, get_current_version, LATEST_VERSION
+
+logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', level=logging.INFO)
+
+def main(argv):
+    command = argv[0] if argv else "upgrade"
+    if command == "upgrade":
+        target = int(argv[1]) if len(argv) > 1 else None
+        version = upgrade(target)
+        print(f"Схема БД на версии {version}.")
+    elif command == "current":
+        with engine.connect() as conn:
+            version = get_current_version(conn)
+        print(f"Текущая версия: {version}, последняя: {LATEST_VERSION}.")
+    else:
+        print("Использование: python -m bot.migrations [upgrade [VERSION] | current]")
+        return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,39 @@
+# bot/migrations/helpers.py
+import logging
+import time
+from sqlalchemy import text
+
+# --- Хелперы для онлайн-миграций (TRANSACTIONAL = False) ---
+def create_index_concurrently(conn, index_name: str, ddl: str):
+    """
+    CREATE INDEX CONCURRENTLY без блокировки записи. Если прошлый запуск оборвался и оставил
+    невалидный индекс, он удаляется и создается заново.
+    """
+    is_valid = conn.execute(text(
+        "SELECT i.indisvalid FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid WHERE c.relname = :name"
+    ), {"name": index_name}).scalar()
+    if is_valid is True:
+        return
+    if is_valid is False:
+        logging.warning(f"[MIGRATIONS] Индекс {index_name} невалиден, пересоздаем.")
+        conn.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {index_name}"))
+    conn.execute(text(ddl))
+
+def batched_backfill(conn, table: str, set_clause: str, where_clause: str,
+                     batch_size: int = 1000, pause: float = 0.05, key: str = "id") -> int:
+    """
+    Обновляет строки пачками, каждая пачка - отдельная короткая транзакция (conn в AUTOCOMMIT).
+    where_clause должен перестать выбирать строку после ее обновления, иначе цикл не закончится.
+    """
+    total = 0
+    while True:
+        result = conn.execute(text(
+            f"UPDATE {table} SET {set_clause} WHERE {key} IN ("
+            f" SELECT {key} FROM {table} WHERE {where_clause} LIMIT :batch_size FOR UPDATE SKIP LOCKED)"
+        ), {"batch_size": batch_size})
+        if not result.rowcount:
+            return total
+        total += result.rowcount
+        logging.info(f"[MIGRATIONS] {table}: обновлено {total} строк...")
+        if pause:
+            time.sleep(pause)
@@ -0,0 +1,70 @@
+# bot/migrations/v0001_initial_schema.py
+# Базовая схема (то, что раньше создавал Base.metadata.create_all).
+# IF NOT EXISTS делает миграцию безопасной для баз, созданных до появления миграций.
+from sqlalchemy import text
+
+VERSION = 1
+TRANSACTIONAL = True
+
+STATEMENTS = [
+    """
+    CREATE TABLE IF NOT EXISTS owners (
+        id SERIAL PRIMARY KEY,
+        tg_id BIGINT NOT NULL,
+        subscription_end TIMESTAMP,
+        is_active BOOLEAN NOT NULL,
+        balance NUMERIC(10, 2) NOT NULL,
+        funpay_user_id_encrypted BYTEA,
+        funpay_golden_key_encrypted BYTEA
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS ix_owners_id ON owners (id)",
+    "CREATE UNIQUE INDEX IF NOT EXISTS ix_owners_tg_id ON owners (tg_id)",
+    """
+    CREATE TABLE IF NOT EXISTS funpay_accounts (
+        id SERIAL PRIMARY KEY,
+        owner_id INTEGER NOT NULL REFERENCES owners (id),
+        name VARCHAR(100) NOT NULL,
+        user_id_encrypted BYTEA NOT NULL,
+        golden_key_encrypted BYTEA NOT NULL,
+        is_active BOOLEAN NOT NULL
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS ix_funpay_accounts_id ON funpay_accounts (id)",
+    """
+    CREATE TABLE IF NOT EXISTS accounts (
+        id SERIAL PRIMARY KEY,
+        owner_tg_id BIGINT NOT NULL REFERENCES owners (tg_id),
+        funpay_account_id INTEGER REFERENCES funpay_accounts (id),
+        login VARCHAR(64) NOT NULL,
+        base_password_encrypted BYTEA NOT NULL,
+        shared_secret_encrypted BYTEA NOT NULL,
+        current_password VARCHAR(64),
+        price_per_hour NUMERIC(10, 2) NOT NULL,
+        status VARCHAR(20) NOT NULL,
+        renter_username VARCHAR(64),
+        rent_end_time TIMESTAMP,
+        max_rental_duration INTEGER,
+        allowed_regions TEXT,
+        game_limits TEXT
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS ix_accounts_id ON accounts (id)",
+    "CREATE UNIQUE INDEX IF NOT EXISTS ix_accounts_login ON accounts (login)",
+    """
+    CREATE TABLE IF NOT EXISTS transactions (
+        id VARCHAR(36) PRIMARY KEY,
+        owner_tg_id BIGINT NOT NULL REFERENCES owners (tg_id),
+        account_id INTEGER REFERENCES accounts (id),
+        transaction_type VARCHAR(20) NOT NULL,
+        external_id VARCHAR(64),
+        timestamp TIMESTAMP NOT NULL,
+        amount NUMERIC(10, 2) NOT NULL,
+        status VARCHAR(20) NOT NULL
+    )
+    """,
+]
+
+def upgrade(conn):
+    for ddl in STATEMENTS:
+        conn.execute(text(ddl))
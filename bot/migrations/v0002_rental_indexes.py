@@ -0,0 +1,61 @@
+# bot/migrations/v0002_rental_indexes.py
+# Индексы под горячие запросы аренды. Создаются CONCURRENTLY, без блокировки записи.
+# Перед уникальным индексом по transactions.external_id дубликаты (старый обработчик YooKassa мог
+# зачислить один платеж дважды) выводятся в лог и помечаются, иначе индекс не построится.
+import logging
+from sqlalchemy import text
+from bot.migrations.helpers import create_index_concurrently
+
+VERSION = 2
+TRANSACTIONAL = False
+
+INDEXES = [
+    ("ix_funpay_accounts_owner_id",
+     "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_funpay_accounts_owner_id ON funpay_accounts (owner_id)"),
+    # check_expired_rentals: status='rented' AND rent_end_time < now
+    ("ix_accounts_rented_rent_end_time",
+     "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_accounts_rented_rent_end_time "
+     "ON accounts (rent_end_time) WHERE status = 'rented'"),
+    ("ix_accounts_funpay_account_id_status",
+     "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_accounts_funpay_account_id_status "
+     "ON accounts (funpay_account_id, status)"),
+    ("ix_transactions_owner_tg_id_timestamp",
+     "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_transactions_owner_tg_id_timestamp "
+     "ON transactions (owner_tg_id, timestamp)"),
+    ("uq_transactions_external_id",
+     "CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS uq_transactions_external_id ON transactions (external_id)"),
+]
+
+DUPLICATE_PREFIX = "dup:"
+
+def mark_duplicate_external_ids(conn) -> int:
+    """
+    Для каждого external_id, встречающегося несколько раз, оставляет его у самой ранней транзакции,
+    а у остальных заменяет на 'dup:<id транзакции>'. Строки не удаляются (история и баланс не меняются),
+    все найденные дубликаты пишутся в лог для ручной сверки. Возвращает число помеченных строк.
+    """
+    groups = conn.execute(text(
+        "SELECT external_id, array_agg(id ORDER BY timestamp, id), array_agg(owner_tg_id ORDER BY timestamp, id), "
+        "array_agg(amount ORDER BY timestamp, id) FROM transactions "
+        "WHERE external_id IS NOT NULL GROUP BY external_id HAVING count(*) > 1"
+    )).all()
+    duplicate_ids = []
+    for external_id, ids, owners, amounts in groups:
+        logging.warning(
+            f"[MIGRATIONS] Дубликат external_id={external_id}: транзакции {ids} (владельцы {owners}, "
+            f"суммы {[str(amount) for amount in amounts]}). Оставлена {ids[0]}, у остальных external_id "
+            f"заменен на '{DUPLICATE_PREFIX}<id>'."
+        )
+        duplicate_ids.extend(ids[1:])
+    if duplicate_ids:
+        conn.execute(text(
+            "UPDATE transactions SET external_id = :prefix || id WHERE id = ANY(:ids)"
+        ), {"prefix": DUPLICATE_PREFIX, "ids": duplicate_ids})
+        logging.warning(f"[MIGRATIONS] Помечено дубликатов external_id: {len(duplicate_ids)}.")
+    return len(duplicate_ids)
+
+def upgrade(conn):
+    for index_name, ddl in INDEXES:
+        if index_name == "uq_transactions_external_id":
+            mark_duplicate_external_ids(conn)
+        create_index_concurrently(conn, index_name, ddl)
@@ -0,0 +1,172 @@
+# bot/migrations/v0003_rollups.py
+# Агрегаты выручки/загрузки и глобальные счетчики, поддерживаемые триггерами.
+# Статистика читает готовые строки вместо сканирования transactions и accounts.
+#
+# revenue_rollups: (scope, scope_id, granularity, bucket_start, transaction_type) ->
+#   tx_count, amount, rented_hours. scope: global / owner / funpay_account / account,
+#   granularity: hour / day / total (для total bucket_start = epoch).
+# global_counters: owners, accounts, accounts_rented.
+#
+# На время миграции таблицы блокируются от записи, чтобы бэкфилл и триггеры не разошлись.
+from sqlalchemy import text
+
+VERSION = 3
+TRANSACTIONAL = True
+
+STATEMENTS = [
+    "LOCK TABLE owners, accounts, transactions IN SHARE ROW EXCLUSIVE MODE",
+    """
+    CREATE TABLE IF NOT EXISTS revenue_rollups (
+        scope VARCHAR(16) NOT NULL,
+        scope_id BIGINT NOT NULL,
+        granularity VARCHAR(8) NOT NULL,
+        bucket_start TIMESTAMP NOT NULL,
+        transaction_type VARCHAR(20) NOT NULL,
+        tx_count INTEGER NOT NULL DEFAULT 0,
+        amount NUMERIC(14, 2) NOT NULL DEFAULT 0,
+        rented_hours NUMERIC(14, 2) NOT NULL DEFAULT 0,
+        PRIMARY KEY (scope, scope_id, granularity, bucket_start, transaction_type)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS global_counters (
+        name VARCHAR(32) PRIMARY KEY,
+        value BIGINT NOT NULL DEFAULT 0
+    )
+    """,
+    """
+    CREATE OR REPLACE FUNCTION rollup_add(p_scope TEXT, p_scope_id BIGINT, p_granularity TEXT,
+                                          p_bucket TIMESTAMP, p_type TEXT, p_amount NUMERIC, p_hours NUMERIC)
+    RETURNS VOID AS $$
+    BEGIN
+        INSERT INTO revenue_rollups AS r (scope, scope_id, granularity, bucket_start, transaction_type,
+                                          tx_count, amount, rented_hours)
+        VALUES (p_scope, p_scope_id, p_granularity, p_bucket, p_type, 1, p_amount, p_hours)
+        ON CONFLICT (scope, scope_id, granularity, bucket_start, transaction_type) DO UPDATE
+        SET tx_count = r.tx_count + 1,
+            amount = r.amount + EXCLUDED.amount,
+            rented_hours = r.rented_hours + EXCLUDED.rented_hours;
+    END;
+    $$ LANGUAGE plpgsql
+    """,
+    """
+    CREATE OR REPLACE FUNCTION rollup_transaction() RETURNS TRIGGER AS $$
+    DECLARE
+        fp_id INTEGER;
+        hours NUMERIC := 0;
+        g TEXT;
+        bucket TIMESTAMP;
+    BEGIN
+        IF NEW.status <> 'completed' THEN
+            RETURN NULL;
+        END IF;
+        IF NEW.account_id IS NOT NULL THEN
+            SELECT a.funpay_account_id,
+                   CASE WHEN NEW.transaction_type = 'rental' AND a.price_per_hour > 0
+                        THEN round(NEW.amount / a.price_per_hour, 2) ELSE 0 END
+              INTO fp_id, hours
+              FROM accounts a WHERE a.id = NEW.account_id;
+        END IF;
+        FOREACH g IN ARRAY ARRAY['hour', 'day', 'total'] LOOP
+            bucket := CASE WHEN g = 'total' THEN TIMESTAMP 'epoch' ELSE date_trunc(g, NEW.timestamp) END;
+            PERFORM rollup_add('global', 0, g, bucket, NEW.transaction_type, NEW.amount, hours);
+            PERFORM rollup_add('owner', NEW.owner_tg_id, g, bucket, NEW.transaction_type, NEW.amount, hours);
+            IF fp_id IS NOT NULL THEN
+                PERFORM rollup_add('funpay_account', fp_id, g, bucket, NEW.transaction_type, NEW.amount, hours);
+            END IF;
+            IF NEW.account_id IS NOT NULL THEN
+                PERFORM rollup_add('account', NEW.account_id, g, bucket, NEW.transaction_type, NEW.amount, hours);
+            END IF;
+        END LOOP;
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql
+    """,
+    "DROP TRIGGER IF EXISTS trg_transactions_rollup ON transactions",
+    """
+    CREATE TRIGGER trg_transactions_rollup AFTER INSERT ON transactions
+    FOR EACH ROW EXECUTE FUNCTION rollup_transaction()
+    """,
+    """
+    CREATE OR REPLACE FUNCTION count_owners() RETURNS TRIGGER AS $$
+    BEGIN
+        IF TG_OP = 'INSERT' THEN
+            UPDATE global_counters SET value = value + 1 WHERE name = 'owners';
+        ELSIF TG_OP = 'DELETE' THEN
+            UPDATE global_counters SET value = value - 1 WHERE name = 'owners';
+        END IF;
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql
+    """,
+    "DROP TRIGGER IF EXISTS trg_owners_count ON owners",
+    """
+    CREATE TRIGGER trg_owners_count AFTER INSERT OR DELETE ON owners
+    FOR EACH ROW EXECUTE FUNCTION count_owners()
+    """,
+    """
+    CREATE OR REPLACE FUNCTION count_accounts() RETURNS TRIGGER AS $$
+    BEGIN
+        IF TG_OP = 'INSERT' THEN
+            UPDATE global_counters SET value = value + 1 WHERE name = 'accounts';
+            IF NEW.status = 'rented' THEN
+                UPDATE global_counters SET value = value + 1 WHERE name = 'accounts_rented';
+            END IF;
+        ELSIF TG_OP = 'DELETE' THEN
+            UPDATE global_counters SET value = value - 1 WHERE name = 'accounts';
+            IF OLD.status = 'rented' THEN
+                UPDATE global_counters SET value = value - 1 WHERE name = 'accounts_rented';
+            END IF;
+        ELSIF NEW.status IS DISTINCT FROM OLD.status THEN
+            IF NEW.status = 'rented' THEN
+                UPDATE global_counters SET value = value + 1 WHERE name = 'accounts_rented';
+            ELSIF OLD.status = 'rented' THEN
+                UPDATE global_counters SET value = value - 1 WHERE name = 'accounts_rented';
+            END IF;
+        END IF;
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql
+    """,
+    "DROP TRIGGER IF EXISTS trg_accounts_count ON accounts",
+    """
+    CREATE TRIGGER trg_accounts_count AFTER INSERT OR DELETE OR UPDATE OF status ON accounts
+    FOR EACH ROW EXECUTE FUNCTION count_accounts()
+    """,
+    # --- Бэкфилл по существующим данным ---
+    "DELETE FROM global_counters",
+    """
+    INSERT INTO global_counters (name, value)
+    SELECT 'owners', count(*) FROM owners
+    UNION ALL SELECT 'accounts', count(*) FROM accounts
+    UNION ALL SELECT 'accounts_rented', count(*) FROM accounts WHERE status = 'rented'
+    """,
+    "DELETE FROM revenue_rollups",
+    """
+    INSERT INTO revenue_rollups (scope, scope_id, granularity, bucket_start, transaction_type,
+                                 tx_count, amount, rented_hours)
+    SELECT s.scope, s.scope_id, g.granularity,
+           CASE WHEN g.granularity = 'total' THEN TIMESTAMP 'epoch'
+                ELSE date_trunc(g.granularity, t.timestamp) END AS bucket_start,
+           t.transaction_type,
+           count(*),
+           sum(t.amount),
+           sum(CASE WHEN t.transaction_type = 'rental' AND a.price_per_hour > 0
+                    THEN round(t.amount / a.price_per_hour, 2) ELSE 0 END)
+    FROM transactions t
+    LEFT JOIN accounts a ON a.id = t.account_id
+    CROSS JOIN (VALUES ('hour'), ('day'), ('total')) AS g (granularity)
+    CROSS JOIN LATERAL (VALUES
+        ('global', 0::BIGINT),
+        ('owner', t.owner_tg_id),
+        ('funpay_account', a.funpay_account_id::BIGINT),
+        ('account', t.account_id::BIGINT)
+    ) AS s (scope, scope_id)
+    WHERE t.status = 'completed' AND s.scope_id IS NOT NULL
+    GROUP BY 1, 2, 3, 4, 5
+    """,
+]
+
+def upgrade(conn):
+    for ddl in STATEMENTS:
+        conn.execute(text(ddl))
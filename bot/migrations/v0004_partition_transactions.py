@@ -0,0 +1,97 @@
+# bot/migrations/v0004_partition_transactions.py
+# transactions -> таблица, секционированная по месяцам (PARTITION BY RANGE (timestamp)).
+# Вставки и выборки за последние месяцы работают с маленькими партициями и их индексами,
+# а старые месяцы отсоединяются и архивируются целиком (см. bot/partitions.py).
+#
+# Уникальный индекс на партиционированной таблице обязан включать ключ партиционирования,
+# поэтому глобальная уникальность external_id держится в transaction_external_ids,
+# которую заполняет BEFORE INSERT триггер.
+#
+# Данные копируются под блокировкой таблицы: это разовая операция при обновлении.
+from datetime import datetime
+from sqlalchemy import text
+from bot.config import TRANSACTIONS_PARTITION_MONTHS_AHEAD
+from bot.partitions import month_start, add_months, create_partition_sql
+
+VERSION = 4
+TRANSACTIONAL = True
+
+PREPARE = [
+    "LOCK TABLE transactions IN ACCESS EXCLUSIVE MODE",
+    "DROP TRIGGER IF EXISTS trg_transactions_rollup ON transactions",
+    "ALTER TABLE transactions RENAME TO transactions_old",
+    "DROP INDEX IF EXISTS ix_transactions_owner_tg_id_timestamp",
+    "DROP INDEX IF EXISTS uq_transactions_external_id",
+    """
+    CREATE TABLE transactions (
+        id VARCHAR(36) NOT NULL,
+        owner_tg_id BIGINT NOT NULL REFERENCES owners (tg_id),
+        account_id INTEGER REFERENCES accounts (id),
+        transaction_type VARCHAR(20) NOT NULL,
+        external_id VARCHAR(64),
+        timestamp TIMESTAMP NOT NULL,
+        amount NUMERIC(10, 2) NOT NULL,
+        status VARCHAR(20) NOT NULL,
+        PRIMARY KEY (id, timestamp)
+    ) PARTITION BY RANGE (timestamp)
+    """,
+    "CREATE TABLE transactions_default PARTITION OF transactions DEFAULT",
+    "CREATE INDEX ix_transactions_owner_tg_id_timestamp ON transactions (owner_tg_id, timestamp)",
+    "CREATE INDEX ix_transactions_external_id ON transactions (external_id)",
+    """
+    CREATE TABLE transaction_external_ids (
+        external_id VARCHAR(64) PRIMARY KEY,
+        transaction_id VARCHAR(36) NOT NULL,
+        timestamp TIMESTAMP NOT NULL
+    )
+    """,
+    "CREATE INDEX ix_transaction_external_ids_timestamp ON transaction_external_ids (timestamp)",
+]
+
+FINISH = [
+    """
+    INSERT INTO transaction_external_ids (external_id, transaction_id, timestamp)
+    SELECT external_id, id, timestamp FROM transactions_old WHERE external_id IS NOT NULL
+    """,
+    """
+    INSERT INTO transactions (id, owner_tg_id, account_id, transaction_type, external_id, timestamp, amount, status)
+    SELECT id, owner_tg_id, account_id, transaction_type, external_id, timestamp, amount, status
+    FROM transactions_old
+    """,
+    "DROP TABLE transactions_old",
+    """
+    CREATE OR REPLACE FUNCTION claim_transaction_external_id() RETURNS TRIGGER AS $$
+    BEGIN
+        IF NEW.external_id IS NOT NULL THEN
+            INSERT INTO transaction_external_ids (external_id, transaction_id, timestamp)
+            VALUES (NEW.external_id, NEW.id, NEW.timestamp);
+        END IF;
+        RETURN NEW;
+    END;
+    $$ LANGUAGE plpgsql
+    """,
+    # Триггеры на партиционированной таблице наследуются всеми текущими и будущими партициями
+    """
+    CREATE TRIGGER trg_transactions_external_id BEFORE INSERT ON transactions
+    FOR EACH ROW EXECUTE FUNCTION claim_transaction_external_id()
+    """,
+    """
+    CREATE TRIGGER trg_transactions_rollup AFTER INSERT ON transactions
+    FOR EACH ROW EXECUTE FUNCTION rollup_transaction()
+    """,
+]
+
+def upgrade(conn):
+    for ddl in PREPARE:
+        conn.execute(text(ddl))
+
+    # Партиции с самого старого месяца в истории и на TRANSACTIONS_PARTITION_MONTHS_AHEAD вперед
+    oldest = conn.execute(text("SELECT min(timestamp) FROM transactions_old")).scalar()
+    last = add_months(month_start(datetime.utcnow()), TRANSACTIONS_PARTITION_MONTHS_AHEAD)
+    month = month_start(oldest) if oldest else month_start(datetime.utcnow())
+    while month <= last:
+        conn.execute(text(create_partition_sql(month)))
+        month = add_months(month, 1)
+
+    for ddl in FINISH:
+        conn.execute(text(ddl))
@@ -0,0 +1,28 @@
+# bot/migrations/v0005_notification_outbox.py
+# Очередь уведомлений владельцам в Telegram (bot/notifications.py): строка живет до доставки,
+# поэтому рестарт бота не теряет неотправленные уведомления.
+from sqlalchemy import text
+
+VERSION = 5
+TRANSACTIONAL = True
+
+STATEMENTS = [
+    """
+    CREATE TABLE IF NOT EXISTS notification_outbox (
+        id BIGSERIAL PRIMARY KEY,
+        chat_id BIGINT NOT NULL,
+        text TEXT NOT NULL,
+        digest_key VARCHAR(32),
+        created_at TIMESTAMP NOT NULL DEFAULT (now() AT TIME ZONE 'utc'),
+        not_before TIMESTAMP NOT NULL DEFAULT (now() AT TIME ZONE 'utc'),
+        attempts INTEGER NOT NULL DEFAULT 0,
+        last_error TEXT
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS ix_notification_outbox_not_before ON notification_outbox (not_before)",
+    "CREATE INDEX IF NOT EXISTS ix_notification_outbox_chat_id_digest_key ON notification_outbox (chat_id, digest_key)",
+]
+
+def upgrade(conn):
+    for ddl in STATEMENTS:
+        conn.execute(text(ddl))
@@ -0,0 +1,21 @@
+# bot/migrations/v0006_bot_user_state.py
+# user_data Telegram бота (меню, активный пошаговый диалог) для PostgresPersistence (bot/persistence.py).
+from sqlalchemy import text
+
+VERSION = 6
+TRANSACTIONAL = True
+
+STATEMENTS = [
+    """
+    CREATE TABLE IF NOT EXISTS bot_user_state (
+        user_id BIGINT PRIMARY KEY,
+        data BYTEA NOT NULL,
+        updated_at TIMESTAMP NOT NULL
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS ix_bot_user_state_updated_at ON bot_user_state (updated_at)",
+]
+
+def upgrade(conn):
+    for ddl in STATEMENTS:
+        conn.execute(text(ddl))
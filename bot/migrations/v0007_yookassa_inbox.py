@@ -0,0 +1,31 @@
+# bot/migrations/v0007_yookassa_inbox.py
+# Входящие уведомления YooKassa (bot/payments.py). payment_id - первичный ключ: повторная доставка
+# того же платежа не создает вторую строку и не зачисляет деньги дважды.
+from sqlalchemy import text
+
+VERSION = 7
+TRANSACTIONAL = True
+
+STATEMENTS = [
+    """
+    CREATE TABLE IF NOT EXISTS yookassa_inbox (
+        payment_id VARCHAR(64) PRIMARY KEY,
+        tg_user_id BIGINT,
+        amount NUMERIC(10, 2),
+        currency VARCHAR(3),
+        payload TEXT NOT NULL,
+        status VARCHAR(16) NOT NULL DEFAULT 'pending',
+        attempts INTEGER NOT NULL DEFAULT 0,
+        last_error TEXT,
+        received_at TIMESTAMP NOT NULL,
+        not_before TIMESTAMP NOT NULL,
+        processed_at TIMESTAMP
+    )
+    """,
+    # Очередь обработчика: только необработанные строки
+    "CREATE INDEX IF NOT EXISTS ix_yookassa_inbox_pending ON yookassa_inbox (not_before) WHERE status = 'pending'",
+]
+
+def upgrade(conn):
+    for ddl in STATEMENTS:
+        conn.execute(text(ddl))
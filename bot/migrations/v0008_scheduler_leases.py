@@ -0,0 +1,23 @@
+# bot/migrations/v0008_scheduler_leases.py
+# Аренды глобальных задач планировщика (bot/leases.py): одна строка на задачу, запускает ее только
+# реплика, захватившая аренду; упавшая реплика теряет аренду по истечении lease_until.
+from sqlalchemy import text
+
+VERSION = 8
+TRANSACTIONAL = True
+
+STATEMENTS = [
+    """
+    CREATE TABLE IF NOT EXISTS scheduler_leases (
+        job_id VARCHAR(64) PRIMARY KEY,
+        holder VARCHAR(128) NOT NULL,
+        lease_until TIMESTAMP NOT NULL,
+        last_started_at TIMESTAMP NOT NULL,
+        last_finished_at TIMESTAMP
+    )
+    """,
+]
+
+def upgrade(conn):
+    for ddl in STATEMENTS:
+        conn.execute(text(ddl))
@@ -0,0 +1,111 @@
+# bot/migrations/v0009_shard_global_counters.py
+# Шардирование глобальных агрегатов.
+# Раньше каждая вставка транзакции обновляла одни и те же строки scope='global' в revenue_rollups,
+# а каждое изменение владельцев/аккаунтов - одну строку global_counters, и все пишущие транзакции
+# выстраивались в очередь за блокировкой этих строк.
+# Теперь у каждого глобального агрегата COUNTER_SLOTS строк-слотов, читатели их суммируют:
+# - global_counters: PRIMARY KEY (name, slot);
+# - revenue_rollups: для scope='global' в scope_id пишется номер слота.
+# Слот выбирается по pg_backend_pid(): транзакции разных соединений почти всегда пишут в разные строки,
+# а одна транзакция всегда пишет в один слот, поэтому порядок блокировок не меняется и дедлоков нет.
+# Существующие строки остаются в слоте 0.
+from sqlalchemy import text
+
+VERSION = 9
+TRANSACTIONAL = True
+
+COUNTER_SLOTS = 16
+
+STATEMENTS = [
+    "LOCK TABLE global_counters, revenue_rollups IN SHARE ROW EXCLUSIVE MODE",
+    "ALTER TABLE global_counters ADD COLUMN IF NOT EXISTS slot SMALLINT NOT NULL DEFAULT 0",
+    "ALTER TABLE global_counters DROP CONSTRAINT IF EXISTS global_counters_pkey",
+    "ALTER TABLE global_counters ADD PRIMARY KEY (name, slot)",
+    f"""
+    CREATE OR REPLACE FUNCTION counter_slot() RETURNS SMALLINT AS $$
+        SELECT (pg_backend_pid() % {COUNTER_SLOTS})::SMALLINT
+    $$ LANGUAGE sql STABLE
+    """,
+    """
+    CREATE OR REPLACE FUNCTION counter_add(p_name TEXT, p_delta BIGINT) RETURNS VOID AS $$
+    BEGIN
+        INSERT INTO global_counters AS c (name, slot, value) VALUES (p_name, counter_slot(), p_delta)
+        ON CONFLICT (name, slot) DO UPDATE SET value = c.value + EXCLUDED.value;
+    END;
+    $$ LANGUAGE plpgsql
+    """,
+    """
+    CREATE OR REPLACE FUNCTION count_owners() RETURNS TRIGGER AS $$
+    BEGIN
+        IF TG_OP = 'INSERT' THEN
+            PERFORM counter_add('owners', 1);
+        ELSIF TG_OP = 'DELETE' THEN
+            PERFORM counter_add('owners', -1);
+        END IF;
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql
+    """,
+    """
+    CREATE OR REPLACE FUNCTION count_accounts() RETURNS TRIGGER AS $$
+    BEGIN
+        IF TG_OP = 'INSERT' THEN
+            PERFORM counter_add('accounts', 1);
+            IF NEW.status = 'rented' THEN
+                PERFORM counter_add('accounts_rented', 1);
+            END IF;
+        ELSIF TG_OP = 'DELETE' THEN
+            PERFORM counter_add('accounts', -1);
+            IF OLD.status = 'rented' THEN
+                PERFORM counter_add('accounts_rented', -1);
+            END IF;
+        ELSIF NEW.status IS DISTINCT FROM OLD.status THEN
+            IF NEW.status = 'rented' THEN
+                PERFORM counter_add('accounts_rented', 1);
+            ELSIF OLD.status = 'rented' THEN
+                PERFORM counter_add('accounts_rented', -1);
+            END IF;
+        END IF;
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql
+    """,
+    """
+    CREATE OR REPLACE FUNCTION rollup_transaction() RETURNS TRIGGER AS $$
+    DECLARE
+        fp_id INTEGER;
+        hours NUMERIC := 0;
+        g TEXT;
+        bucket TIMESTAMP;
+        slot SMALLINT := counter_slot();
+    BEGIN
+        IF NEW.status <> 'completed' THEN
+            RETURN NULL;
+        END IF;
+        IF NEW.account_id IS NOT NULL THEN
+            SELECT a.funpay_account_id,
+                   CASE WHEN NEW.transaction_type = 'rental' AND a.price_per_hour > 0
+                        THEN round(NEW.amount / a.price_per_hour, 2) ELSE 0 END
+              INTO fp_id, hours
+              FROM accounts a WHERE a.id = NEW.account_id;
+        END IF;
+        FOREACH g IN ARRAY ARRAY['hour', 'day', 'total'] LOOP
+            bucket := CASE WHEN g = 'total' THEN TIMESTAMP 'epoch' ELSE date_trunc(g, NEW.timestamp) END;
+            PERFORM rollup_add('global', slot, g, bucket, NEW.transaction_type, NEW.amount, hours);
+            PERFORM rollup_add('owner', NEW.owner_tg_id, g, bucket, NEW.transaction_type, NEW.amount, hours);
+            IF fp_id IS NOT NULL THEN
+                PERFORM rollup_add('funpay_account', fp_id, g, bucket, NEW.transaction_type, NEW.amount, hours);
+            END IF;
+            IF NEW.account_id IS NOT NULL THEN
+                PERFORM rollup_add('account', NEW.account_id, g, bucket, NEW.transaction_type, NEW.amount, hours);
+            END IF;
+        END LOOP;
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql
+    """,
+]
+
+def upgrade(conn):
+    for ddl in STATEMENTS:
+        conn.execute(text(ddl))
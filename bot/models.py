@@ -1,95 +1,220 @@
-# bot/models.py
-from sqlalchemy import Column, Integer, String, DECIMAL, DateTime, Boolean, BigInteger, Text, ForeignKey, Numeric
-from sqlalchemy.dialects.postgresql import BYTEA
-from sqlalchemy.orm import relationship
-from bot.database import Base
-from datetime import datetime
-import uuid
-
-class Owner(Base):
-    __tablename__ = "owners"
-
-    id = Column(Integer, primary_key=True, index=True)
-    tg_id = Column(BigInteger, unique=True, nullable=False, index=True)
-    subscription_end = Column(DateTime, nullable=True)
-    is_active = Column(Boolean, default=True, nullable=False)
-    balance = Column(DECIMAL(10, 2), default=0.0, nullable=False)
-    funpay_user_id_encrypted = Column(BYTEA, nullable=True)
-    funpay_golden_key_encrypted = Column(BYTEA, nullable=True)
-
-    funpay_accounts = relationship("FunPayAccount", back_populates="owner", cascade="all, delete-orphan")
-    steam_accounts = relationship("Account", back_populates="owner_rel")
-    transactions = relationship("Transaction", back_populates="owner_rel")
-
-    def is_subscribed(self) -> bool:
-        if not self.subscription_end:
-            return False
-        return self.subscription_end > datetime.utcnow()
-
-    def has_funpay_credentials(self) -> bool:
-        return self.funpay_user_id_encrypted is not None and self.funpay_golden_key_encrypted is not None
-
-    def __repr__(self):
-        return f"<Owner(id={self.id}, tg_id={self.tg_id}, subscribed={self.is_subscribed()})>"
-
-class FunPayAccount(Base):
-    __tablename__ = "funpay_accounts"
-
-    id = Column(Integer, primary_key=True, index=True)
-    owner_id = Column(Integer, ForeignKey('owners.id'), nullable=False)
-    name = Column(String(100), nullable=False)
-    user_id_encrypted = Column(BYTEA, nullable=False)
-    golden_key_encrypted = Column(BYTEA, nullable=False)
-    is_active = Column(Boolean, default=True, nullable=False)
-
-    owner_rel = relationship("Owner", back_populates="funpay_accounts")
-    steam_accounts = relationship("Account", back_populates="funpay_account_rel")
-
-    def __repr__(self):
-        return f"<FunPayAccount(id={self.id}, name='{self.name}', owner_id={self.owner_id})>"
-
-class Account(Base): # Steam Account
-    __tablename__ = "accounts"
-
-    id = Column(Integer, primary_key=True, index=True)
-    owner_tg_id = Column(BigInteger, ForeignKey('owners.tg_id'), nullable=False) # Внешний ключ на Owner.tg_id
-    funpay_account_id = Column(Integer, ForeignKey('funpay_accounts.id'), nullable=True)
-    
-    login = Column(String(64), unique=True, nullable=False, index=True)
-    base_password_encrypted = Column(BYTEA, nullable=False) # BYTEA для бинарных данных
-    shared_secret_encrypted = Column(BYTEA, nullable=False)
-    current_password = Column(String(64), nullable=True) # Хранится в открытом виде, действует только во время аренды
-    price_per_hour = Column(DECIMAL(10, 2), nullable=False) # DECIMAL для точности денег
-    status = Column(String(20), default='available', nullable=False) # available, rented, blocked
-    renter_username = Column(String(64), nullable=True)
-    rent_end_time = Column(DateTime, nullable=True)
-    max_rental_duration = Column(Integer, nullable=True) # Макс. время аренды в часах
-    allowed_regions = Column(Text, nullable=True) # JSON или просто текст
-    game_limits = Column(Text, nullable=True) # JSON или просто текст
-
-    owner_rel = relationship("Owner", back_populates="steam_accounts")
-    funpay_account_rel = relationship("FunPayAccount", back_populates="steam_accounts")
-    transactions = relationship("Transaction", back_populates="account_rel")
-
-    def __repr__(self):
-        return f"<Account(id={self.id}, login='{self.login}', status='{self.status}')>"
-
-class Transaction(Base):
-    __tablename__ = "transactions"
-
-    id = Column(String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
-    owner_tg_id = Column(BigInteger, ForeignKey('owners.tg_id'), nullable=False)
-    account_id = Column(Integer, ForeignKey('accounts.id'), nullable=True)
-    
-    transaction_type = Column(String(20), nullable=False) # 'rental', 'topup', 'subscription'
-    external_id = Column(String(64), nullable=True) # ID заказа FunPay или платежа YooKassa
-    
-    timestamp = Column(DateTime, default=datetime.utcnow, nullable=False)
-    amount = Column(DECIMAL(10, 2), nullable=False) # DECIMAL для точности денег
-    status = Column(String(20), default='completed', nullable=False) # 'pending', 'completed', 'failed'
-
-    owner_rel = relationship("Owner", back_populates="transactions")
-    account_rel = relationship("Account", back_populates="transactions")
-
-    def __repr__(self):
-        return f"<Transaction(id='{self.id}', type='{self.transaction_type}', amount={self.amount})>"
+# bot/models.py
+from sqlalchemy import Column, Integer, String, DECIMAL, DateTime, Boolean, BigInteger, SmallInteger, Text, ForeignKey, Numeric, Index, text
+from sqlalchemy.dialects.postgresql import BYTEA
+from sqlalchemy.orm import relationship
+from bot.database import Base
+from datetime import datetime
+import uuid
+
+class Owner(Base):
+    __tablename__ = "owners"
+
+    id = Column(Integer, primary_key=True, index=True)
+    tg_id = Column(BigInteger, unique=True, nullable=False, index=True)
+    subscription_end = Column(DateTime, nullable=True)
+    is_active = Column(Boolean, default=True, nullable=False)
+    balance = Column(DECIMAL(10, 2), default=0.0, nullable=False)
+    funpay_user_id_encrypted = Column(BYTEA, nullable=True)
+    funpay_golden_key_encrypted = Column(BYTEA, nullable=True)
+
+    funpay_accounts = relationship("FunPayAccount", back_populates="owner", cascade="all, delete-orphan")
+    steam_accounts = relationship("Account", back_populates="owner_rel")
+    transactions = relationship("Transaction", back_populates="owner_rel")
+
+    def is_subscribed(self) -> bool:
+        if not self.subscription_end:
+            return False
+        return self.subscription_end > datetime.utcnow()
+
+    def has_funpay_credentials(self) -> bool:
+        return self.funpay_user_id_encrypted is not None and self.funpay_golden_key_encrypted is not None
+
+    def __repr__(self):
+        return f"<Owner(id={self.id}, tg_id={self.tg_id}, subscribed={self.is_subscribed()})>"
+
+class FunPayAccount(Base):
+    __tablename__ = "funpay_accounts"
+
+    id = Column(Integer, primary_key=True, index=True)
+    owner_id = Column(Integer, ForeignKey('owners.id'), nullable=False, index=True)
+    name = Column(String(100), nullable=False)
+    user_id_encrypted = Column(BYTEA, nullable=False)
+    golden_key_encrypted = Column(BYTEA, nullable=False)
+    is_active = Column(Boolean, default=True, nullable=False)
+
+    owner_rel = relationship("Owner", back_populates="funpay_accounts")
+    steam_accounts = relationship("Account", back_populates="funpay_account_rel")
+
+    def __repr__(self):
+        return f"<FunPayAccount(id={self.id}, name='{self.name}', owner_id={self.owner_id})>"
+
+class Account(Base): # Steam Account
+    __tablename__ = "accounts"
+    __table_args__ = (
+        # check_expired_rentals: status='rented' AND rent_end_time < now
+        Index('ix_accounts_rented_rent_end_time', 'rent_end_time', postgresql_where=text("status = 'rented'")),
+        # Статистика по статусам в разрезе FunPay аккаунта
+        Index('ix_accounts_funpay_account_id_status', 'funpay_account_id', 'status'),
+    )
+
+    id = Column(Integer, primary_key=True, index=True)
+    owner_tg_id = Column(BigInteger, ForeignKey('owners.tg_id'), nullable=False) # Внешний ключ на Owner.tg_id
+    funpay_account_id = Column(Integer, ForeignKey('funpay_accounts.id'), nullable=True)
+    
+    login = Column(String(64), unique=True, nullable=False, index=True)
+    base_password_encrypted = Column(BYTEA, nullable=False) # BYTEA для бинарных данных
+    shared_secret_encrypted = Column(BYTEA, nullable=False)
+    current_password = Column(String(64), nullable=True) # Хранится в открытом виде, действует только во время аренды
+    price_per_hour = Column(DECIMAL(10, 2), nullable=False) # DECIMAL для точности денег
+    status = Column(String(20), default='available', nullable=False) # available, rented, blocked
+    renter_username = Column(String(64), nullable=True)
+    rent_end_time = Column(DateTime, nullable=True)
+    max_rental_duration = Column(Integer, nullable=True) # Макс. время аренды в часах
+    allowed_regions = Column(Text, nullable=True) # JSON или просто текст
+    game_limits = Column(Text, nullable=True) # JSON или просто текст
+
+    owner_rel = relationship("Owner", back_populates="steam_accounts")
+    funpay_account_rel = relationship("FunPayAccount", back_populates="steam_accounts")
+    transactions = relationship("Transaction", back_populates="account_rel")
+
+    def __repr__(self):
+        return f"<Account(id={self.id}, login='{self.login}', status='{self.status}')>"
+
+class Transaction(Base):
+    __tablename__ = "transactions"
+    __table_args__ = (
+        Index('ix_transactions_owner_tg_id_timestamp', 'owner_tg_id', 'timestamp'),
+        # Уникальность external_id обеспечивает transaction_external_ids (см. миграцию v0004)
+        Index('ix_transactions_external_id', 'external_id'),
+        {'postgresql_partition_by': 'RANGE (timestamp)'},
+    )
+
+    id = Column(String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
+    owner_tg_id = Column(BigInteger, ForeignKey('owners.tg_id'), nullable=False)
+    account_id = Column(Integer, ForeignKey('accounts.id'), nullable=True)
+    
+    transaction_type = Column(String(20), nullable=False) # 'rental', 'topup', 'subscription'
+    external_id = Column(String(64), nullable=True) # ID заказа FunPay или платежа YooKassa
+    
+    timestamp = Column(DateTime, default=datetime.utcnow, primary_key=True) # Ключ партиционирования
+    amount = Column(DECIMAL(10, 2), nullable=False) # DECIMAL для точности денег
+    status = Column(String(20), default='completed', nullable=False) # 'pending', 'completed', 'failed'
+
+    owner_rel = relationship("Owner", back_populates="transactions")
+    account_rel = relationship("Account", back_populates="transactions")
+
+    def __repr__(self):
+        return f"<Transaction(id='{self.id}', type='{self.transaction_type}', amount={self.amount})>"
+
+class TransactionExternalId(Base):
+    """
+    Глобально уникальные external_id транзакций, заполняются триггером trg_transactions_external_id
+    (миграция v0004). В отличие от transactions, не архивируются вместе со старыми партициями.
+    """
+    __tablename__ = "transaction_external_ids"
+    __table_args__ = (
+        Index('ix_transaction_external_ids_timestamp', 'timestamp'),
+    )
+
+    external_id = Column(String(64), primary_key=True)
+    transaction_id = Column(String(36), nullable=False)
+    timestamp = Column(DateTime, nullable=False)
+
+    def __repr__(self):
+        return f"<TransactionExternalId('{self.external_id}' -> '{self.transaction_id}')>"
+
+class RevenueRollup(Base):
+    """Агрегаты по транзакциям, поддерживаются триггером trg_transactions_rollup (миграция v0003)."""
+    __tablename__ = "revenue_rollups"
+
+    scope = Column(String(16), primary_key=True) # global, owner, funpay_account, account
+    scope_id = Column(BigInteger, primary_key=True) # номер слота для global (v0009), tg_id для owner, иначе id
+    granularity = Column(String(8), primary_key=True) # hour, day, total
+    bucket_start = Column(DateTime, primary_key=True) # для total - epoch
+    transaction_type = Column(String(20), primary_key=True)
+    tx_count = Column(Integer, default=0, nullable=False)
+    amount = Column(DECIMAL(14, 2), default=0, nullable=False)
+    rented_hours = Column(DECIMAL(14, 2), default=0, nullable=False)
+
+    def __repr__(self):
+        return f"<RevenueRollup({self.scope}:{self.scope_id}, {self.granularity}@{self.bucket_start}, amount={self.amount})>"
+
+class GlobalCounter(Base):
+    """
+    Счетчики owners / accounts / accounts_rented, поддерживаются триггерами (миграция v0003).
+    Значение счетчика - сумма value по всем его слотам (миграция v0009).
+    """
+    __tablename__ = "global_counters"
+
+    name = Column(String(32), primary_key=True)
+    slot = Column(SmallInteger, primary_key=True, default=0)
+    value = Column(BigInteger, default=0, nullable=False)
+
+    def __repr__(self):
+        return f"<GlobalCounter({self.name}[{self.slot}]={self.value})>"
+
+class NotificationOutbox(Base):
+    """Неотправленные уведомления в Telegram (миграция v0005, доставка - bot/notifications.py)."""
+    __tablename__ = "notification_outbox"
+    __table_args__ = (
+        Index('ix_notification_outbox_not_before', 'not_before'),
+        Index('ix_notification_outbox_chat_id_digest_key', 'chat_id', 'digest_key'),
+    )
+
+    id = Column(BigInteger, primary_key=True)
+    chat_id = Column(BigInteger, nullable=False)
+    text = Column(Text, nullable=False)
+    digest_key = Column(String(32), nullable=True) # Уведомления с одним ключом склеиваются в дайджест
+    created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+    not_before = Column(DateTime, default=datetime.utcnow, nullable=False)
+    attempts = Column(Integer, default=0, nullable=False)
+    last_error = Column(Text, nullable=True)
+
+    def __repr__(self):
+        return f"<NotificationOutbox(id={self.id}, chat_id={self.chat_id}, attempts={self.attempts})>"
+
+class BotUserState(Base):
+    """user_data бота, зашифрованный JSON (миграция v0006, запись - bot/persistence.py)."""
+    __tablename__ = "bot_user_state"
+
+    user_id = Column(BigInteger, primary_key=True)
+    data = Column(BYTEA, nullable=False)
+    updated_at = Column(DateTime, default=datetime.utcnow, nullable=False, index=True)
+
+    def __repr__(self):
+        return f"<BotUserState(user_id={self.user_id}, updated_at={self.updated_at})>"
+
+class YooKassaInbox(Base):
+    """Уведомления YooKassa о платежах (миграция v0007, обработка - bot/payments.py)."""
+    __tablename__ = "yookassa_inbox"
+    __table_args__ = (
+        Index('ix_yookassa_inbox_pending', 'not_before', postgresql_where=text("status = 'pending'")),
+    )
+
+    payment_id = Column(String(64), primary_key=True) # Дедупликация повторных уведомлений
+    tg_user_id = Column(BigInteger, nullable=True)
+    amount = Column(DECIMAL(10, 2), nullable=True)
+    currency = Column(String(3), nullable=True)
+    payload = Column(Text, nullable=False)
+    status = Column(String(16), default='pending', nullable=False) # pending, applied, rejected, failed
+    attempts = Column(Integer, default=0, nullable=False)
+    last_error = Column(Text, nullable=True)
+    received_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+    not_before = Column(DateTime, default=datetime.utcnow, nullable=False)
+    processed_at = Column(DateTime, nullable=True)
+
+    def __repr__(self):
+        return f"<YooKassaInbox(payment_id='{self.payment_id}', status='{self.status}')>"
+
+class SchedulerLease(Base):
+    """Аренда глобальной задачи планировщика (миграция v0008, захват - bot/leases.py)."""
+    __tablename__ = "scheduler_leases"
+
+    job_id = Column(String(64), primary_key=True)
+    holder = Column(String(128), nullable=False) # host:pid реплики, выполняющей задачу
+    lease_until = Column(DateTime, nullable=False)
+    last_started_at = Column(DateTime, nullable=False)
+    last_finished_at = Column(DateTime, nullable=True)
+
+    def __repr__(self):
+        return f"<SchedulerLease(job_id='{self.job_id}', holder='{self.holder}', lease_until={self.lease_until})>"
@@ -0,0 +1,217 @@
+# bot/notifications.py
+# Уведомления владельцам в Telegram через очередь в БД (notification_outbox, миграция v0005).
+# - notify() / notify_async() только вставляют строку: вызывать можно из любого потока и процесса
+#   (Flask, обработка заказа FunPay, планировщик), бот для этого не нужен.
+# - Доставляет NotificationWorker в event loop бота: глобальный token bucket (NOTIFY_GLOBAL_RATE),
+#   не чаще раза в NOTIFY_PER_CHAT_INTERVAL в один чат, пауза по RetryAfter от Telegram.
+# - Уведомления с digest_key ждут NOTIFY_DIGEST_WINDOW секунд; если их в чате набралось
+#   NOTIFY_DIGEST_MIN и больше, уходит одно сообщение-дайджест.
+# Строки разбираются через FOR UPDATE SKIP LOCKED, поэтому несколько процессов бота не шлют дубликаты.
+import asyncio
+import logging
+import time
+from datetime import datetime, timedelta
+from typing import Optional
+from sqlalchemy import text
+from bot import metrics
+from bot.database import engine, get_async_engine, async_session_scope
+from bot.config import (
+    NOTIFY_GLOBAL_RATE, NOTIFY_PER_CHAT_INTERVAL, NOTIFY_MAX_ATTEMPTS, NOTIFY_RETRY_DELAY,
+    NOTIFY_BATCH_SIZE, NOTIFY_POLL_INTERVAL, NOTIFY_DIGEST_WINDOW, NOTIFY_DIGEST_MIN,
+)
+
+TELEGRAM_MESSAGE_MAX_LEN = 4096
+
+# Заголовки дайджестов по digest_key; {count} - число уведомлений
+DIGEST_TITLES = {
+    'rental_starting': "🔄 Начата обработка аренд: {count}",
+    'rental_started': "✅ Сдано в аренду аккаунтов: {count}",
+    'rental_ending': "🔄 Начато завершение аренд: {count}",
+    'rental_ended': "✅ Завершено аренд за последнюю минуту: {count}",
+}
+
+_INSERT_SQL = text(
+    "INSERT INTO notification_outbox (chat_id, text, digest_key, created_at, not_before) "
+    "VALUES (:chat_id, :text, :digest_key, :now, :not_before)"
+)
+
+# Готовые к отправке строки и все ожидающие строки тех же дайджестов (чтобы дайджест не дробился)
+_CLAIM_SQL = text(
+    "SELECT o.id, o.chat_id, o.text, o.digest_key, o.attempts FROM notification_outbox o "
+    "WHERE o.not_before <= :now OR (o.digest_key IS NOT NULL AND EXISTS ("
+    " SELECT 1 FROM notification_outbox d WHERE d.chat_id = o.chat_id AND d.digest_key = o.digest_key"
+    " AND d.not_before <= :now)) "
+    "ORDER BY o.id LIMIT :limit FOR UPDATE SKIP LOCKED"
+)
+
+def _insert_params(chat_id: int, message: str, digest_key: Optional[str]) -> dict:
+    now = datetime.utcnow()
+    not_before = now + timedelta(seconds=NOTIFY_DIGEST_WINDOW) if digest_key else now
+    return {"chat_id": chat_id, "text": message, "digest_key": digest_key, "now": now, "not_before": not_before}
+
+def notify(chat_id: int, message: str, digest_key: Optional[str] = None):
+    """Ставит уведомление в очередь (синхронно, своей короткой транзакцией - не трогает сессию вызывающего)."""
+    try:
+        with engine.begin() as conn:
+            conn.execute(_INSERT_SQL, _insert_params(chat_id, message, digest_key))
+    except Exception as e:
+        logging.error(f"[NOTIFY] Не удалось поставить уведомление для {chat_id} в очередь: {e}")
+        return
+    metrics.inc("notifications_enqueued_total", digest="yes" if digest_key else "no")
+    notification_worker.wakeup()
+
+async def notify_async(chat_id: int, message: str, digest_key: Optional[str] = None):
+    """То же, что notify(), для асинхронного кода."""
+    try:
+        async with get_async_engine().begin() as conn:
+            await conn.execute(_INSERT_SQL, _insert_params(chat_id, message, digest_key))
+    except Exception as e:
+        logging.error(f"[NOTIFY] Не удалось поставить уведомление для {chat_id} в очередь: {e}")
+        return
+    metrics.inc("notifications_enqueued_total", digest="yes" if digest_key else "no")
+    notification_worker.wakeup()
+
+def _render_digest(digest_key: str, texts: list) -> str:
+    title = DIGEST_TITLES.get(digest_key, "🔔 Уведомлений: {count}").format(count=len(texts))
+    lines = [title]
+    length = len(title)
+    for i, line in enumerate(texts):
+        # Запас под строку "… и еще N"
+        if length + len(line) + 1 > TELEGRAM_MESSAGE_MAX_LEN - 32:
+            lines.append(f"… и еще {len(texts) - i}")
+            break
+        lines.append(line)
+        length += len(line) + 1
+    return "\n".join(lines)
+
+def _build_messages(rows) -> list:
+    """Строки очереди -> [(chat_id, текст, [id строк])] в порядке очереди, дайджесты на месте первой строки."""
+    messages = []
+    digests = {}
+    for row_id, chat_id, message, digest_key, attempts in rows:
+        if digest_key is None:
+            messages.append((chat_id, message, [row_id]))
+            continue
+        group = digests.get((chat_id, digest_key))
+        if group is None:
+            group = digests[(chat_id, digest_key)] = {'texts': [], 'ids': [], 'index': len(messages)}
+            messages.append(None) # Место дайджеста
+        group['texts'].append(message)
+        group['ids'].append(row_id)
+    for (chat_id, digest_key), group in digests.items():
+        if len(group['texts']) >= NOTIFY_DIGEST_MIN:
+            messages[group['index']] = (chat_id, _render_digest(digest_key, group['texts']), group['ids'])
+            metrics.inc("notifications_digested_total", len(group['ids']))
+        else:
+            messages[group['index']] = [(chat_id, message, [row_id])
+                                        for message, row_id in zip(group['texts'], group['ids'])]
+    flat = []
+    for item in messages:
+        if isinstance(item, list):
+            flat.extend(item)
+        else:
+            flat.append(item)
+    return flat
+
+class NotificationWorker:
+    def __init__(self):
+        self._tokens = NOTIFY_GLOBAL_RATE
+        self._updated = time.monotonic()
+        self._paused_until = 0.0 # monotonic: RetryAfter от Telegram
+        self._chat_next = {} # chat_id -> monotonic время, раньше которого в чат не пишем
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._wakeup: Optional[asyncio.Event] = None
+
+    def wakeup(self):
+        """Будит воркер после постановки уведомления (если он работает в этом процессе)."""
+        if self._loop is not None and not self._loop.is_closed():
+            self._loop.call_soon_threadsafe(self._wakeup.set)
+
+    async def _acquire(self, chat_id: int):
+        while True:
+            now = time.monotonic()
+            self._tokens = min(NOTIFY_GLOBAL_RATE, self._tokens + (now - self._updated) * NOTIFY_GLOBAL_RATE)
+            self._updated = now
+            wait = max(self._paused_until - now, self._chat_next.get(chat_id, 0) - now,
+                       (1 - self._tokens) / NOTIFY_GLOBAL_RATE if self._tokens < 1 else 0)
+            if wait <= 0:
+                self._tokens -= 1
+                self._chat_next[chat_id] = now + NOTIFY_PER_CHAT_INTERVAL
+                return
+            metrics.observe("notifications_rate_limit_wait_seconds", wait)
+            await asyncio.sleep(wait)
+
+    async def run(self, bot):
+        """Бесконечный цикл доставки; запускается в event loop бота (post_init)."""
+        self._loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+        logging.info("[NOTIFY] Воркер очереди уведомлений запущен.")
+        while True:
+            try:
+                delivered = await self.deliver_batch(bot)
+            except Exception as e:
+                logging.error(f"[NOTIFY] Ошибка обработки очереди уведомлений: {e}", exc_info=True)
+                delivered = 0
+            if delivered < NOTIFY_BATCH_SIZE:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), NOTIFY_POLL_INTERVAL)
+                except asyncio.TimeoutError:
+                    pass
+            # Чаты, в которые давно не писали, больше не нужны для интервала
+            now = time.monotonic()
+            if len(self._chat_next) > 10000:
+                self._chat_next = {chat_id: t for chat_id, t in self._chat_next.items() if t > now}
+
+    async def deliver_batch(self, bot) -> int:
+        """Разбирает одну пачку очереди. Возвращает число взятых строк."""
+        # PTB нужен только процессу бота; notify() из веб-процесса его не импортирует
+        from telegram.error import Forbidden, RetryAfter
+        async with async_session_scope() as session:
+            rows = (await session.execute(_CLAIM_SQL, {"now": datetime.utcnow(), "limit": NOTIFY_BATCH_SIZE})).all()
+            if not rows:
+                return 0
+            attempts_by_id = {row[0]: row[4] for row in rows}
+            done_ids = []
+            for index, (chat_id, message, ids) in enumerate(_build_messages(rows)):
+                await self._acquire(chat_id)
+                try:
+                    await bot.send_message(chat_id=chat_id, text=message)
+                except RetryAfter as e:
+                    retry_after = e.retry_after.total_seconds() if hasattr(e.retry_after, 'total_seconds') else e.retry_after
+                    self._paused_until = time.monotonic() + float(retry_after)
+                    metrics.inc("notifications_retry_after_total")
+                    logging.warning(f"[NOTIFY] Telegram просит подождать {retry_after} с.")
+                    break # Оставшиеся строки пачки разблокируются коммитом и уйдут после паузы
+                except Forbidden as e:
+                    # Бот заблокирован пользователем - повторять бессмысленно
+                    logging.warning(f"[NOTIFY] Чат {chat_id} недоступен: {e}")
+                    metrics.inc("notifications_dropped_total", reason="forbidden")
+                    done_ids.extend(ids)
+                    continue
+                except Exception as e:
+                    await self._retry_later(session, ids, attempts_by_id, str(e))
+                    continue
+                metrics.inc("notifications_sent_total")
+                done_ids.extend(ids)
+            if done_ids:
+                await session.execute(text("DELETE FROM notification_outbox WHERE id = ANY(:ids)"), {"ids": done_ids})
+            await session.commit()
+            return len(rows)
+
+    async def _retry_later(self, session, ids: list, attempts_by_id: dict, error: str):
+        attempts = max(attempts_by_id[row_id] for row_id in ids) + 1
+        if attempts >= NOTIFY_MAX_ATTEMPTS:
+            logging.error(f"[NOTIFY] Уведомление не доставлено за {attempts} попыток, удаляем: {error}")
+            metrics.inc("notifications_dropped_total", len(ids), reason="attempts")
+            await session.execute(text("DELETE FROM notification_outbox WHERE id = ANY(:ids)"), {"ids": ids})
+            return
+        logging.warning(f"[NOTIFY] Ошибка отправки уведомления (попытка {attempts}): {error}")
+        metrics.inc("notifications_failed_total")
+        await session.execute(text(
+            "UPDATE notification_outbox SET attempts = :attempts, last_error = :error, not_before = :not_before "
+            "WHERE id = ANY(:ids)"
+        ), {"attempts": attempts, "error": error[:1000], "ids": ids,
+            "not_before": datetime.utcnow() + timedelta(seconds=NOTIFY_RETRY_DELAY * attempts)})
+
+notification_worker = NotificationWorker()
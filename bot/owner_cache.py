@@ -0,0 +1,64 @@
+# bot/owner_cache.py
+# Read-through кэш владельцев по tg_id для декораторов subscription_required и funpay_creds_required.
+# Хранит снимок нужных полей (конец подписки и зашифрованные учетные данные FunPay), а не ORM-объект:
+# снимок не привязан к сессии и не протухает вместе с ней. Открытый текст здесь не хранится -
+# расшифровка идет через кэш секретов bot.utils, который затирает буферы при вытеснении.
+# Записи живут OWNER_CACHE_TTL секунд; при покупке/активации подписки и смене данных FunPay
+# кэш владельца сбрасывается явно через invalidate_owner().
+import time
+from datetime import datetime
+from typing import Optional
+from bot import metrics
+from bot.cache import TTLCache
+from bot.config import OWNER_CACHE_TTL, OWNER_CACHE_SIZE
+from bot.database import async_session_scope
+from bot.repositories import OwnerRepository
+
+_owner_cache = TTLCache("owner", maxsize=OWNER_CACHE_SIZE, ttl=OWNER_CACHE_TTL)
+
+# Средняя длительность загрузки владельца из БД - по ней считаем сэкономленное попаданиями время
+_LOAD_TIME_ALPHA = 0.1
+_avg_load_seconds = 0.0
+
+def _snapshot(owner) -> dict:
+    if owner is None:
+        return {'exists': False, 'subscription_end': None, 'funpay_creds_encrypted': None}
+    encrypted_creds = None
+    if owner.has_funpay_credentials():
+        encrypted_creds = (bytes(owner.funpay_user_id_encrypted), bytes(owner.funpay_golden_key_encrypted))
+    return {
+        'exists': True,
+        'subscription_end': owner.subscription_end,
+        'funpay_creds_encrypted': encrypted_creds,
+    }
+
+async def get_owner_snapshot(owner_tg_id: int) -> dict:
+    """
+    Возвращает {'exists', 'subscription_end', 'funpay_creds_encrypted'} владельца.
+    Отсутствующий владелец тоже кэшируется, поэтому создание владельца должно вызывать invalidate_owner().
+    """
+    global _avg_load_seconds
+    snapshot = _owner_cache.get(owner_tg_id)
+    if snapshot is not None:
+        metrics.inc("owner_cache_saved_seconds_total", _avg_load_seconds)
+        return snapshot
+
+    started = time.monotonic()
+    async with async_session_scope() as session:
+        owner = await OwnerRepository(session).get_by_tg_id(owner_tg_id)
+        snapshot = _snapshot(owner)
+    elapsed = time.monotonic() - started
+    _avg_load_seconds = elapsed if not _avg_load_seconds else \
+        _avg_load_seconds + _LOAD_TIME_ALPHA * (elapsed - _avg_load_seconds)
+    metrics.observe("owner_cache_load_seconds", elapsed)
+
+    _owner_cache.set(owner_tg_id, snapshot)
+    return snapshot
+
+def is_snapshot_subscribed(snapshot: dict) -> bool:
+    subscription_end: Optional[datetime] = snapshot['subscription_end']
+    return subscription_end is not None and subscription_end > datetime.utcnow()
+
+def invalidate_owner(owner_tg_id: int):
+    """Сбрасывает кэш владельца (вызывать после изменения подписки или учетных данных FunPay)."""
+    _owner_cache.invalidate(owner_tg_id)
@@ -0,0 +1,213 @@
+# bot/partitions.py
+# Обслуживание помесячных партиций таблицы transactions (миграция v0004):
+# заранее создает партиции на следующие месяцы, а старые отсоединяет, выгружает
+# в сжатый CSV (gzip) в TRANSACTIONS_ARCHIVE_DIR и удаляет из БД.
+# Архивные месяцы по-прежнему читаются через iter_transactions / read_archived_transactions.
+# Ключи transaction_external_ids не архивируются: по ним повторная доставка заказа FunPay
+# отсекается и после удаления месяца (см. funpay_integration._process_order).
+import csv
+import gzip
+import logging
+import os
+import re
+from datetime import datetime
+from decimal import Decimal
+from typing import Iterator, Optional
+from sqlalchemy import text
+from sqlalchemy.exc import OperationalError
+from bot.config import TRANSACTIONS_PARTITION_MONTHS_AHEAD, TRANSACTIONS_RETENTION_MONTHS, TRANSACTIONS_ARCHIVE_DIR, \
+    PARTITION_DETACH_LOCK_TIMEOUT
+from bot.database import engine
+
+PARTITION_NAME_RE = re.compile(r"^transactions_y(\d{4})m(\d{2})$")
+ARCHIVE_COLUMNS = ("id", "owner_tg_id", "account_id", "transaction_type", "external_id", "timestamp", "amount", "status")
+
+def month_start(dt: datetime) -> datetime:
+    return datetime(dt.year, dt.month, 1)
+
+def add_months(dt: datetime, months: int) -> datetime:
+    month_index = dt.year * 12 + dt.month - 1 + months
+    return datetime(month_index // 12, month_index % 12 + 1, 1)
+
+def partition_name(month: datetime) -> str:
+    return f"transactions_y{month.year:04d}m{month.month:02d}"
+
+def create_partition_sql(month: datetime) -> str:
+    return (
+        f"CREATE TABLE IF NOT EXISTS {partition_name(month)} PARTITION OF transactions "
+        f"FOR VALUES FROM ('{month:%Y-%m-%d}') TO ('{add_months(month, 1):%Y-%m-%d}')"
+    )
+
+def archive_path(month: datetime, archive_dir: Optional[str] = None) -> str:
+    return os.path.join(archive_dir or TRANSACTIONS_ARCHIVE_DIR, f"{partition_name(month)}.csv.gz")
+
+def list_partitions(conn) -> list[datetime]:
+    """Месяцы существующих помесячных партиций (без DEFAULT), по возрастанию."""
+    names = conn.execute(text(
+        "SELECT c.relname FROM pg_inherits i "
+        "JOIN pg_class c ON c.oid = i.inhrelid "
+        "JOIN pg_class p ON p.oid = i.inhparent "
+        "WHERE p.relname = 'transactions'"
+    )).scalars()
+    months = []
+    for name in names:
+        match = PARTITION_NAME_RE.match(name)
+        if match:
+            months.append(datetime(int(match.group(1)), int(match.group(2)), 1))
+    return sorted(months)
+
+def ensure_transaction_partitions(conn, months_ahead: int = TRANSACTIONS_PARTITION_MONTHS_AHEAD,
+                                  now: Optional[datetime] = None):
+    """Создает партиции с текущего месяца на months_ahead месяцев вперед."""
+    current = month_start(now or datetime.utcnow())
+    for offset in range(months_ahead + 1):
+        conn.execute(text(create_partition_sql(add_months(current, offset))))
+
+def list_detached_partitions(conn) -> list[datetime]:
+    """
+    Месяцы помесячных таблиц, которые уже отсоединены от transactions, но еще не удалены -
+    архивирование прервалось между DETACH и DROP. Их дочищает следующий запуск.
+    """
+    names = conn.execute(text(
+        "SELECT relname FROM pg_class "
+        "WHERE relkind = 'r' AND NOT relispartition AND relname LIKE 'transactions\\_y%' "
+        "AND relnamespace = 'public'::regnamespace"
+    )).scalars()
+    months = []
+    for name in names:
+        match = PARTITION_NAME_RE.match(name)
+        if match:
+            months.append(datetime(int(match.group(1)), int(match.group(2)), 1))
+    return sorted(months)
+
+def _export_partition(raw_connection, month: datetime, path: str) -> int:
+    """
+    Выгружает отсоединенную партицию через COPY в gzip CSV и проверяет архив: число строк в файле
+    должно совпасть с count(*) таблицы. Пишем во временный файл и переименовываем атомарно,
+    только если проверка прошла. Возвращает число выгруженных строк.
+    """
+    tmp_path = path + ".tmp"
+    name = partition_name(month)
+    columns = ", ".join(ARCHIVE_COLUMNS)
+    with gzip.open(tmp_path, "wb", compresslevel=6) as archive:
+        with raw_connection.cursor() as cursor:
+            cursor.copy_expert(
+                f"COPY (SELECT {columns} FROM {name} ORDER BY timestamp) TO STDOUT WITH (FORMAT csv, HEADER true)",
+                archive
+            )
+    with raw_connection.cursor() as cursor:
+        cursor.execute(f"SELECT count(*) FROM {name}")
+        expected = cursor.fetchone()[0]
+    with gzip.open(tmp_path, "rt", newline="", encoding="utf-8") as archive:
+        exported = sum(1 for _ in csv.DictReader(archive))
+    if exported != expected:
+        os.remove(tmp_path)
+        raise RuntimeError(f"архив {name} неполный: {exported} строк из {expected}")
+    os.replace(tmp_path, path)
+    return exported
+
+def archive_old_partitions(retention_months: int = TRANSACTIONS_RETENTION_MONTHS,
+                           archive_dir: Optional[str] = None, now: Optional[datetime] = None) -> list[str]:
+    """
+    Отсоединяет партиции старше retention_months, выгружает их и удаляет. Возвращает пути архивов.
+    DETACH ... CONCURRENTLY невозможен при DEFAULT партиции (transactions_default), поэтому обычный
+    DETACH выполняется отдельной короткой транзакцией с lock_timeout: если блокировку не дали,
+    месяц откладывается до следующего запуска, а вставки в transactions не стоят в очереди за нами.
+    Таблица удаляется только после проверенной выгрузки; отсоединенные, но не удаленные таблицы
+    прошлых запусков архивируются первыми. Ключи transaction_external_ids архивных месяцев остаются.
+    """
+    archive_dir = archive_dir or TRANSACTIONS_ARCHIVE_DIR
+    os.makedirs(archive_dir, exist_ok=True)
+    cutoff = add_months(month_start(now or datetime.utcnow()), -retention_months)
+    archived = []
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        pending = list_detached_partitions(conn)
+        if pending:
+            logging.warning(f"[PARTITIONS] Найдены отсоединенные неархивированные партиции: "
+                            f"{', '.join(partition_name(month) for month in pending)}.")
+        for month in list_partitions(conn):
+            if add_months(month, 1) > cutoff:
+                break
+            name = partition_name(month)
+            try:
+                with engine.begin() as tx:
+                    tx.execute(text(f"SET LOCAL lock_timeout = '{PARTITION_DETACH_LOCK_TIMEOUT}s'"))
+                    tx.execute(text(f"ALTER TABLE transactions DETACH PARTITION {name}"))
+            except OperationalError as e:
+                logging.warning(f"[PARTITIONS] Не удалось отсоединить {name}, повторим при следующем запуске: {e}")
+                continue
+            pending.append(month)
+        for month in pending:
+            name = partition_name(month)
+            path = archive_path(month, archive_dir)
+            logging.info(f"[PARTITIONS] Архивируем {name} в {path}...")
+            try:
+                rows = _export_partition(conn.connection.dbapi_connection, month, path)
+            except Exception as e:
+                # Таблица остается отсоединенной и будет выгружена заново при следующем запуске
+                logging.error(f"[PARTITIONS] Ошибка выгрузки {name}, таблица не удалена: {e}")
+                continue
+            with engine.begin() as tx:
+                tx.execute(text(f"DROP TABLE {name}"))
+            logging.info(f"[PARTITIONS] {name}: выгружено и удалено строк: {rows}.")
+            archived.append(path)
+    return archived
+
+# --- Чтение архива ---
+def _parse_archived_row(row: dict) -> dict:
+    return {
+        "id": row["id"],
+        "owner_tg_id": int(row["owner_tg_id"]),
+        "account_id": int(row["account_id"]) if row["account_id"] else None,
+        "transaction_type": row["transaction_type"],
+        "external_id": row["external_id"] or None,
+        "timestamp": datetime.fromisoformat(row["timestamp"]),
+        "amount": Decimal(row["amount"]),
+        "status": row["status"],
+    }
+
+def read_archived_transactions(month: datetime, archive_dir: Optional[str] = None) -> Iterator[dict]:
+    """Читает выгруженный месяц. Если архива нет - ничего не возвращает."""
+    path = archive_path(month_start(month), archive_dir)
+    if not os.path.exists(path):
+        return
+    with gzip.open(path, "rt", newline="", encoding="utf-8") as archive:
+        for row in csv.DictReader(archive):
+            yield _parse_archived_row(row)
+
+def iter_transactions(owner_tg_id: int, start: datetime, end: datetime,
+                      archive_dir: Optional[str] = None) -> Iterator[dict]:
+    """
+    Транзакции владельца за [start, end) по возрастанию времени: архивные месяцы (до самой старой
+    живой партиции) читаются из файлов, остальное - из БД (запрос попадает только в нужные партиции).
+    """
+    with engine.connect() as conn:
+        live_months = list_partitions(conn)
+        oldest_live = live_months[0] if live_months else month_start(start)
+        month = month_start(start)
+        while month < min(oldest_live, end):
+            # Архив выгружен в порядке timestamp
+            for row in read_archived_transactions(month, archive_dir):
+                if row["owner_tg_id"] == owner_tg_id and start <= row["timestamp"] < end:
+                    yield row
+            month = add_months(month, 1)
+        if oldest_live >= end:
+            return
+        result = conn.execute(text(
+            f"SELECT {', '.join(ARCHIVE_COLUMNS)} FROM transactions "
+            "WHERE owner_tg_id = :owner_tg_id AND timestamp >= :start AND timestamp < :end "
+            "ORDER BY timestamp"
+        ), {"owner_tg_id": owner_tg_id, "start": max(start, oldest_live), "end": end})
+        for row in result.mappings():
+            yield dict(row)
+
+def maintain_transaction_partitions():
+    """Задача планировщика: партиции наперед + архивирование старых."""
+    try:
+        with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+            ensure_transaction_partitions(conn)
+        archived = archive_old_partitions()
+        if archived:
+            logging.info(f"[PARTITIONS] Архивировано партиций: {len(archived)}.")
+    except Exception as e:
+        logging.error(f"[PARTITIONS] Ошибка обслуживания партиций transactions: {e}", exc_info=True)
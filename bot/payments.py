@@ -0,0 +1,271 @@
+# bot/payments.py
+# Пополнение баланса через YooKassa.
+# - Вебхук проверяет, что уведомление пришло с IP YooKassa, и сохраняет его в yookassa_inbox
+#   (payment_id - первичный ключ, повтор того же платежа отбрасывается), после чего сразу отвечает 200.
+# - YooKassaInboxWorker в фоне забирает пачку необработанных уведомлений короткой транзакцией
+#   (FOR UPDATE SKIP LOCKED + not_before сдвигается на YOOKASSA_INBOX_CLAIM_TTL, чтобы другие воркеры
+#   их не взяли), затем без открытой транзакции и блокировок сверяет платежи через API YooKassa
+#   (статус, сумма, получатель - из ответа API, а не из тела уведомления). Зачисление через bot.ledger
+#   и смена статуса уведомления идут в отдельной короткой транзакции на платеж, только если
+#   уведомление все еще pending. Упавший воркер не теряет уведомления: по истечении claim их заберут снова.
+# Уведомления о других событиях и повторы не дают повторного зачисления в любом порядке прихода.
+# SDK YooKassa импортируется при первом обращении (yookassa_api()), а Flask - при регистрации вебхука:
+# воркеру (RUN_MODE=worker) и боту они не нужны.
+import importlib.util
+import json
+import logging
+import threading
+import time
+from datetime import datetime, timedelta
+from decimal import Decimal
+from typing import Optional, TYPE_CHECKING
+from sqlalchemy import text
+from bot import metrics
+from bot.config import (
+    YOOKASSA_ACCOUNT_ID, YOOKASSA_SECRET_KEY, YOOKASSA_ENABLED, YOOKASSA_VERIFY_IP, YOOKASSA_TRUST_PROXY,
+    YOOKASSA_INBOX_BATCH_SIZE, YOOKASSA_INBOX_POLL_INTERVAL, YOOKASSA_INBOX_MAX_ATTEMPTS, YOOKASSA_INBOX_RETRY_DELAY,
+    YOOKASSA_INBOX_CLAIM_TTL,
+)
+from bot.database import engine, session_scope
+from bot.ledger import credit_balance, to_money
+from bot.notifications import notify
+
+if TYPE_CHECKING:
+    from flask import Flask
+
+YOOKASSA_SDK_AVAILABLE = importlib.util.find_spec('yookassa') is not None
+if not YOOKASSA_SDK_AVAILABLE:
+    logging.error("Не удалось импортировать YooKassa SDK.")
+
+_sdk = None
+_sdk_lock = threading.Lock()
+
+def yookassa_api():
+    """Модуль yookassa с настроенными учетными данными магазина (импортируется при первом вызове)."""
+    global _sdk
+    if _sdk is None:
+        with _sdk_lock:
+            if _sdk is None:
+                import yookassa
+                if YOOKASSA_ENABLED:
+                    yookassa.Configuration.configure(YOOKASSA_ACCOUNT_ID, YOOKASSA_SECRET_KEY)
+                _sdk = yookassa
+    return _sdk
+
+SUCCEEDED_EVENT = 'payment.succeeded'
+
+_INSERT_SQL = text(
+    "INSERT INTO yookassa_inbox (payment_id, tg_user_id, amount, currency, payload, received_at, not_before) "
+    "VALUES (:payment_id, :tg_user_id, :amount, :currency, :payload, :now, :now) "
+    "ON CONFLICT (payment_id) DO NOTHING RETURNING payment_id"
+)
+
+def _client_ip() -> str:
+    from flask import request
+    if YOOKASSA_TRUST_PROXY and request.headers.get('X-Forwarded-For'):
+        return request.headers['X-Forwarded-For'].split(',')[0].strip()
+    return request.remote_addr or ''
+
+def is_trusted_source(ip: str) -> bool:
+    """Уведомления YooKassa не подписываются - проверяется IP отправителя по списку YooKassa."""
+    if not YOOKASSA_VERIFY_IP:
+        return True
+    yookassa_api()
+    from yookassa.domain.common.security_helper import SecurityHelper
+    try:
+        return SecurityHelper().is_ip_trusted(ip)
+    except ValueError:
+        return False
+
+def _parse_notification(event_json: dict) -> Optional[dict]:
+    payment_object = event_json.get('object') or {}
+    payment_id = payment_object.get('id')
+    if not payment_id or len(payment_id) > 64:
+        return None
+    user_id_str = (payment_object.get('metadata') or {}).get('tg_user_id')
+    amount = payment_object.get('amount') or {}
+    try:
+        tg_user_id = int(user_id_str) if user_id_str else None
+        value = to_money(amount['value']) if amount.get('value') else None
+    except (ValueError, ArithmeticError):
+        return None
+    return {"payment_id": payment_id, "tg_user_id": tg_user_id, "amount": value,
+            "currency": amount.get('currency'), "payload": json.dumps(event_json, ensure_ascii=False)}
+
+def record_notification(event_json: dict) -> str:
+    """Сохраняет уведомление. Возвращает queued / duplicate / ignored / invalid."""
+    if event_json.get('event') != SUCCEEDED_EVENT:
+        # Зачисляем только по payment.succeeded; остальные события (и их порядок) на баланс не влияют
+        logging.info(f"[YOOKASSA] Получено другое событие: {event_json.get('event')}")
+        return 'ignored'
+    params = _parse_notification(event_json)
+    if params is None:
+        logging.error(f"[YOOKASSA] Некорректные данные в вебхуке: {event_json}")
+        return 'invalid'
+    params["now"] = datetime.utcnow()
+    with engine.begin() as conn:
+        inserted = conn.execute(_INSERT_SQL, params).scalar_one_or_none()
+    if inserted is None:
+        logging.info(f"[YOOKASSA] Повторное уведомление по платежу {params['payment_id']}, пропускаем.")
+        return 'duplicate'
+    yookassa_inbox_worker.wakeup()
+    return 'queued'
+
+def create_yookassa_webhook_handler(app: 'Flask'):
+    from flask import request
+
+    @app.route('/payment/yookassa/webhook', methods=['POST'])
+    def yookassa_webhook():
+        """Принимает уведомление YooKassa о платеже; зачисление - в YooKassaInboxWorker."""
+        started = time.monotonic()
+        try:
+            ip = _client_ip()
+            if not is_trusted_source(ip):
+                logging.warning(f"[YOOKASSA WEBHOOK] Уведомление с недоверенного IP {ip} отклонено.")
+                result = 'forbidden'
+                return 'Forbidden', 403
+            event_json = request.get_json(silent=True)
+            if not isinstance(event_json, dict):
+                result = 'invalid'
+                return 'Bad Request', 400
+            logging.debug(f"[YOOKASSA WEBHOOK] Получены данные: {event_json}")
+            result = record_notification(event_json)
+            if result == 'invalid':
+                return 'Bad Request', 400
+            return '', 200 # Важно вернуть 200, чтобы Юкасса не ретранслировала
+        except Exception as e:
+            logging.error(f"[YOOKASSA] Ошибка обработки вебхука: {e}", exc_info=True)
+            result = 'error'
+            return 'Internal Error', 500 # YooKassa повторит доставку
+        finally:
+            metrics.inc("yookassa_webhook_total", result=result)
+            metrics.observe("yookassa_webhook_seconds", time.monotonic() - started)
+
+class _RetryLater(Exception):
+    pass
+
+class YooKassaInboxWorker:
+    def __init__(self):
+        self._wakeup = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self.run, daemon=True, name="yookassa-inbox")
+                self._thread.start()
+                logging.info("[YOOKASSA] Обработчик входящих уведомлений запущен.")
+
+    def wakeup(self):
+        self._wakeup.set()
+
+    def run(self):
+        """Бесконечный цикл обработки в текущем потоке (RUN_MODE=worker); start() - в фоновом потоке."""
+        while True:
+            try:
+                processed = self.process_batch()
+            except Exception as e:
+                logging.error(f"[YOOKASSA] Ошибка обработки очереди уведомлений: {e}", exc_info=True)
+                processed = 0
+            if processed < YOOKASSA_INBOX_BATCH_SIZE:
+                self._wakeup.wait(YOOKASSA_INBOX_POLL_INTERVAL)
+                self._wakeup.clear()
+
+    def claim_batch(self, limit: int = YOOKASSA_INBOX_BATCH_SIZE) -> list[tuple[str, int]]:
+        """Забирает пачку уведомлений на YOOKASSA_INBOX_CLAIM_TTL. Блокировки снимаются сразу после захвата."""
+        now = datetime.utcnow()
+        with engine.begin() as conn:
+            return [tuple(row) for row in conn.execute(text(
+                "UPDATE yookassa_inbox SET not_before = :claim_until WHERE payment_id IN ("
+                " SELECT payment_id FROM yookassa_inbox WHERE status = 'pending' AND not_before <= :now"
+                " ORDER BY received_at LIMIT :limit FOR UPDATE SKIP LOCKED"
+                ") RETURNING payment_id, attempts"
+            ), {"now": now, "claim_until": now + timedelta(seconds=YOOKASSA_INBOX_CLAIM_TTL), "limit": limit}).all()]
+
+    def process_batch(self) -> int:
+        """Обрабатывает пачку уведомлений. Возвращает число взятых строк."""
+        rows = self.claim_batch()
+        for payment_id, attempts in rows:
+            result = self._process(payment_id, attempts)
+            if result is not None:
+                tg_user_id, amount, balance = result
+                notify(tg_user_id, f"✅ Баланс пополнен на {amount:.2f} руб.\nТекущий баланс: {balance:.2f} руб.")
+        return len(rows)
+
+    def _process(self, payment_id: str, attempts: int) -> Optional[tuple[int, Decimal, Decimal]]:
+        # Запрос к API - вне транзакции: строка уведомления не заблокирована, соединение с БД не занято
+        try:
+            tg_user_id, amount = self._verify(payment_id)
+        except _RetryLater as e:
+            return self._retry(payment_id, attempts, str(e))
+        except Exception as e:
+            logging.error(f"[YOOKASSA] Ошибка проверки платежа {payment_id}: {e}")
+            return self._retry(payment_id, attempts, str(e))
+        if tg_user_id is None:
+            with session_scope() as db:
+                self._set_status(db, payment_id, 'rejected', "Платеж не прошел проверку")
+                db.commit()
+            return None
+        # Статус уведомления и зачисление - в одной короткой транзакции. Статус меняется только
+        # из pending, поэтому уведомление, уже обработанное другим воркером, второй раз не зачисляется.
+        try:
+            with session_scope() as db:
+                if not self._set_status(db, payment_id, 'applied'):
+                    logging.info(f"[YOOKASSA] Платеж {payment_id} уже обработан, пропускаем.")
+                    return None
+                balance = credit_balance(db, tg_user_id, amount, 'topup', external_id=payment_id)
+                if balance is None:
+                    db.rollback()
+                    logging.error(f"[YOOKASSA] Владелец с TG ID {tg_user_id} не найден.")
+                    self._set_status(db, payment_id, 'failed', f"Владелец с TG ID {tg_user_id} не найден")
+                    db.commit()
+                    return None
+                db.commit()
+        except Exception as e:
+            logging.error(f"[YOOKASSA] Ошибка зачисления платежа {payment_id}: {e}", exc_info=True)
+            return self._retry(payment_id, attempts, str(e))
+        metrics.inc("yookassa_topups_applied_total")
+        logging.info(f"[YOOKASSA] Баланс пользователя {tg_user_id} пополнен на {amount} RUB. Payment ID: {payment_id}")
+        return tg_user_id, amount, balance
+
+    def _verify(self, payment_id: str) -> tuple[Optional[int], Optional[Decimal]]:
+        """Статус, сумма и получатель - из API YooKassa. (None, None) - платеж не подлежит зачислению."""
+        payment = yookassa_api().Payment.find_one(payment_id)
+        if payment.status in ('pending', 'waiting_for_capture'):
+            raise _RetryLater(f"Платеж в статусе {payment.status}")
+        if payment.status != 'succeeded' or payment.amount.currency != 'RUB':
+            logging.warning(f"[YOOKASSA] Платеж {payment_id}: статус {payment.status}, валюта {payment.amount.currency}.")
+            return None, None
+        user_id_str = (payment.metadata or {}).get('tg_user_id')
+        if not user_id_str or not str(user_id_str).isdigit():
+            logging.warning(f"[YOOKASSA] Платеж {payment_id} без tg_user_id в метаданных.")
+            return None, None
+        return int(user_id_str), to_money(payment.amount.value)
+
+    def _set_status(self, db, payment_id: str, status: str, error: Optional[str] = None) -> bool:
+        """Меняет статус pending-уведомления. False - уведомление уже не pending."""
+        result = db.execute(text(
+            "UPDATE yookassa_inbox SET status = :status, last_error = :error, processed_at = :now "
+            "WHERE payment_id = :payment_id AND status = 'pending'"
+        ), {"status": status, "error": error, "now": datetime.utcnow(), "payment_id": payment_id})
+        if not result.rowcount:
+            return False
+        metrics.inc("yookassa_inbox_processed_total", status=status)
+        return True
+
+    def _retry(self, payment_id: str, attempts: int, error: str) -> None:
+        attempts += 1
+        with session_scope() as db:
+            if attempts >= YOOKASSA_INBOX_MAX_ATTEMPTS:
+                logging.error(f"[YOOKASSA] Платеж {payment_id} не обработан за {attempts} попыток: {error}")
+                self._set_status(db, payment_id, 'failed', error[:1000])
+            else:
+                db.execute(text(
+                    "UPDATE yookassa_inbox SET attempts = :attempts, last_error = :error, not_before = :not_before "
+                    "WHERE payment_id = :payment_id AND status = 'pending'"
+                ), {"attempts": attempts, "error": error[:1000], "payment_id": payment_id,
+                    "not_before": datetime.utcnow() + timedelta(seconds=YOOKASSA_INBOX_RETRY_DELAY * attempts)})
+            db.commit()
+
+yookassa_inbox_worker = YooKassaInboxWorker()
@@ -0,0 +1,207 @@
+# bot/persistence.py
+# BasePersistence для PTB поверх Postgres: user_data (текущее меню, активный пошаговый диалог из
+# bot/conversations.py) переживает рестарт бота и переезд на другой инстанс.
+# - Хранится компактный JSON, зашифрованный активным ключом (в диалогах бывают пароли и golden key).
+# - Запись объединяется: PTB сбрасывает изменения раз в PERSISTENCE_UPDATE_INTERVAL секунд, все
+#   пользователи одного сброса пишутся одним executemany, а неизменившиеся (по отпечатку) пропускаются.
+# - Пустой user_data - удаление строки; строки, не записанные дольше PERSISTENCE_USER_TTL, удаляются
+#   задачей purge_expired_user_state (bot/scheduler.py) и не загружаются при старте. Чтобы не потерять состояние активного
+#   пользователя, у которого данные не менялись, его строка переписывается (обновляется updated_at),
+#   если с прошлой записи прошло больше половины TTL.
+# - Несколько процессов бота (реплики в режиме webhook) делят одно состояние: перед обработкой апдейта
+#   PTB вызывает refresh_user_data, и строка пользователя перечитывается, если ее updated_at отличается
+#   от записанного или загруженного этим процессом (значит, ее переписала или удалила другая реплика).
+#   Сравнивается равенство, а не порядок, поэтому расхождение часов реплик не мешает.
+# chat_data, bot_data, callback_data и ConversationHandler бот не использует и не сохраняет.
+import asyncio
+import hashlib
+import json
+import logging
+from datetime import datetime, timedelta
+from typing import Optional
+from sqlalchemy import text
+from telegram.ext import BasePersistence, PersistenceInput
+from bot import metrics
+from bot.config import PERSISTENCE_UPDATE_INTERVAL, PERSISTENCE_USER_TTL
+from bot.database import get_async_engine
+from bot.utils import encrypt_bytes, decrypt_bytes
+
+_UPSERT_SQL = text(
+    "INSERT INTO bot_user_state (user_id, data, updated_at) VALUES (:user_id, :data, :updated_at) "
+    "ON CONFLICT (user_id) DO UPDATE SET data = EXCLUDED.data, updated_at = EXCLUDED.updated_at"
+)
+
+def _serialize(data: dict) -> bytes:
+    return json.dumps(data, separators=(',', ':'), sort_keys=True, ensure_ascii=False).encode('utf-8')
+
+def _fingerprint(payload: bytes) -> bytes:
+    return hashlib.blake2b(payload, digest_size=16).digest()
+
+class PostgresPersistence(BasePersistence):
+    def __init__(self, update_interval: float = PERSISTENCE_UPDATE_INTERVAL, user_ttl: float = PERSISTENCE_USER_TTL):
+        super().__init__(
+            store_data=PersistenceInput(bot_data=False, chat_data=False, user_data=True, callback_data=False),
+            update_interval=update_interval,
+        )
+        self.user_ttl = user_ttl
+        self._written: dict[int, bytes] = {} # user_id -> отпечаток сохраненного JSON
+        self._written_at: dict[int, datetime] = {} # user_id -> updated_at сохраненной строки
+        self._pending: dict[int, Optional[bytes]] = {} # user_id -> JSON для записи (None - удалить)
+        self._writing: set[int] = set() # user_id, чья запись сейчас идет в БД
+        self._flush_task: Optional[asyncio.Task] = None
+
+    async def get_user_data(self) -> dict:
+        cutoff = datetime.utcnow() - timedelta(seconds=self.user_ttl)
+        async with get_async_engine().connect() as conn:
+            rows = (await conn.execute(
+                text("SELECT user_id, data, updated_at FROM bot_user_state WHERE updated_at >= :cutoff"),
+                {"cutoff": cutoff}
+            )).all()
+        user_data = {}
+        for user_id, data, updated_at in rows:
+            try:
+                payload = decrypt_bytes(bytes(data))
+                user_data[user_id] = json.loads(payload)
+            except Exception as e:
+                logging.error(f"[PERSISTENCE] Не удалось прочитать состояние пользователя {user_id}: {e}")
+                continue
+            self._written[user_id] = _fingerprint(payload)
+            self._written_at[user_id] = updated_at
+        metrics.set_gauge("persistence_users_loaded", len(user_data))
+        logging.info(f"[PERSISTENCE] Загружено состояние {len(user_data)} пользователей.")
+        return user_data
+
+    async def update_user_data(self, user_id: int, data: dict) -> None:
+        if not data:
+            await self.drop_user_data(user_id)
+            return
+        payload = _serialize(data)
+        if self._written.get(user_id) == _fingerprint(payload) and not self._is_stale(user_id):
+            metrics.inc("persistence_writes_skipped_total")
+            return
+        self._pending[user_id] = payload
+        self._schedule_flush()
+
+    async def drop_user_data(self, user_id: int) -> None:
+        if user_id in self._written or user_id in self._pending:
+            self._pending[user_id] = None
+            self._schedule_flush()
+
+    def _is_stale(self, user_id: int) -> bool:
+        """Строка скоро попадет под purge_expired_user_state - пора обновить updated_at."""
+        written_at = self._written_at.get(user_id)
+        return written_at is None or datetime.utcnow() - written_at > timedelta(seconds=self.user_ttl / 2)
+
+    def _schedule_flush(self):
+        # Все update_user_data одного сброса PTB вызываются подряд - пишем их одной пачкой после них
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.get_running_loop().create_task(self._flush_soon())
+
+    async def _flush_soon(self):
+        await asyncio.sleep(0)
+        await self._write_pending()
+
+    async def _write_pending(self):
+        pending, self._pending = self._pending, {}
+        if not pending:
+            return
+        now = datetime.utcnow()
+        upserts = [{"user_id": user_id, "data": encrypt_bytes(payload), "updated_at": now}
+                   for user_id, payload in pending.items() if payload is not None]
+        deletes = [user_id for user_id, payload in pending.items() if payload is None]
+        self._writing = set(pending)
+        try:
+            async with get_async_engine().begin() as conn:
+                if upserts:
+                    await conn.execute(_UPSERT_SQL, upserts)
+                if deletes:
+                    await conn.execute(text("DELETE FROM bot_user_state WHERE user_id = ANY(:ids)"), {"ids": deletes})
+        except Exception as e:
+            logging.error(f"[PERSISTENCE] Ошибка записи состояния {len(pending)} пользователей: {e}")
+            # Вернем в очередь то, что не перезаписано более новыми изменениями
+            for user_id, payload in pending.items():
+                self._pending.setdefault(user_id, payload)
+            return
+        finally:
+            self._writing = set()
+        for user_id, payload in pending.items():
+            if payload is None:
+                self._written.pop(user_id, None)
+                self._written_at.pop(user_id, None)
+            else:
+                self._written[user_id] = _fingerprint(payload)
+                self._written_at[user_id] = now
+        metrics.inc("persistence_writes_total", len(upserts), op="upsert")
+        metrics.inc("persistence_writes_total", len(deletes), op="delete")
+
+    async def flush(self) -> None:
+        if self._flush_task is not None and not self._flush_task.done():
+            await self._flush_task
+        await self._write_pending()
+
+    # --- Не используется ботом ---
+    async def get_chat_data(self) -> dict:
+        return {}
+
+    async def get_bot_data(self) -> dict:
+        return {}
+
+    async def get_callback_data(self):
+        return None
+
+    async def get_conversations(self, name: str) -> dict:
+        return {}
+
+    async def update_chat_data(self, chat_id: int, data) -> None:
+        pass
+
+    async def update_bot_data(self, data) -> None:
+        pass
+
+    async def update_callback_data(self, data) -> None:
+        pass
+
+    async def update_conversation(self, name: str, key, new_state) -> None:
+        pass
+
+    async def drop_chat_data(self, chat_id: int) -> None:
+        pass
+
+    async def refresh_user_data(self, user_id: int, user_data: dict) -> None:
+        """Подхватывает состояние, записанное другой репликой. user_data меняется на месте."""
+        if user_id in self._pending or user_id in self._writing:
+            return # Свои незаписанные изменения новее
+        known_at = self._written_at.get(user_id)
+        async with get_async_engine().connect() as conn:
+            row = (await conn.execute(text(
+                "SELECT updated_at, CASE WHEN updated_at IS DISTINCT FROM :known_at THEN data END "
+                "FROM bot_user_state WHERE user_id = :user_id"
+            ), {"user_id": user_id, "known_at": known_at})).first()
+        if row is None:
+            if known_at is not None:
+                # Строку удалила другая реплика (диалог завершен там) или purge
+                user_data.clear()
+                self._written.pop(user_id, None)
+                self._written_at.pop(user_id, None)
+                metrics.inc("persistence_refreshed_total", result="dropped")
+            return
+        updated_at, data = row
+        if data is None:
+            return
+        try:
+            payload = decrypt_bytes(bytes(data))
+            loaded = json.loads(payload)
+        except Exception as e:
+            logging.error(f"[PERSISTENCE] Не удалось прочитать состояние пользователя {user_id}: {e}")
+            return
+        user_data.clear()
+        user_data.update(loaded)
+        self._written[user_id] = _fingerprint(payload)
+        self._written_at[user_id] = updated_at
+        metrics.inc("persistence_refreshed_total", result="reloaded")
+
+    async def refresh_chat_data(self, chat_id: int, chat_data) -> None:
+        pass
+
+    async def refresh_bot_data(self, bot_data) -> None:
+        pass
@@ -0,0 +1,198 @@
+# bot/repositories.py
+# Асинхронный слой доступа к данным (SQLAlchemy 2.0 AsyncSession поверх asyncpg).
+# Используется обработчиками Telegram и планировщиком, чтобы запросы к Postgres не блокировали event loop.
+from datetime import datetime
+from typing import Optional
+from sqlalchemy import select, update, func
+from sqlalchemy.ext.asyncio import AsyncSession
+from bot.models import Owner, FunPayAccount, Account, Transaction, RevenueRollup, GlobalCounter
+
+class OwnerRepository:
+    def __init__(self, session: AsyncSession):
+        self.session = session
+
+    async def get_by_tg_id(self, tg_id: int) -> Optional[Owner]:
+        result = await self.session.execute(select(Owner).where(Owner.tg_id == tg_id))
+        return result.scalar_one_or_none()
+
+    async def get_or_create(self, tg_id: int) -> tuple[Owner, bool]:
+        """Возвращает владельца и флаг, был ли он создан."""
+        owner = await self.get_by_tg_id(tg_id)
+        if owner:
+            return owner, False
+        owner = Owner(tg_id=tg_id)
+        self.session.add(owner)
+        await self.session.flush()
+        return owner, True
+
+class FunPayAccountRepository:
+    def __init__(self, session: AsyncSession):
+        self.session = session
+
+    async def get_for_owner(self, funpay_account_id: int, owner_tg_id: int) -> Optional[FunPayAccount]:
+        """FunPay аккаунт по ID, только если он принадлежит владельцу с owner_tg_id."""
+        result = await self.session.execute(
+            select(FunPayAccount).join(Owner).where(
+                FunPayAccount.id == funpay_account_id,
+                Owner.tg_id == owner_tg_id
+            )
+        )
+        return result.scalar_one_or_none()
+
+    async def list_active_for_owner(self, owner_id: int) -> list[FunPayAccount]:
+        result = await self.session.execute(
+            select(FunPayAccount).where(
+                FunPayAccount.owner_id == owner_id,
+                FunPayAccount.is_active.is_(True)
+            ).order_by(FunPayAccount.id)
+        )
+        return list(result.scalars())
+
+    async def get_active_by_name(self, owner_id: int, name: str) -> Optional[FunPayAccount]:
+        result = await self.session.execute(
+            select(FunPayAccount).where(
+                FunPayAccount.owner_id == owner_id,
+                FunPayAccount.name == name,
+                FunPayAccount.is_active.is_(True)
+            ).limit(1)
+        )
+        return result.scalar_one_or_none()
+
+    async def add(self, owner_id: int, name: str, user_id_encrypted: bytes, golden_key_encrypted: bytes) -> FunPayAccount:
+        fp_account = FunPayAccount(
+            owner_id=owner_id, name=name,
+            user_id_encrypted=user_id_encrypted,
+            golden_key_encrypted=golden_key_encrypted,
+            is_active=True
+        )
+        self.session.add(fp_account)
+        await self.session.flush()
+        return fp_account
+
+class AccountRepository:
+    def __init__(self, session: AsyncSession):
+        self.session = session
+
+    async def get_by_id(self, account_id: int) -> Optional[Account]:
+        return await self.session.get(Account, account_id)
+
+    async def get_by_login(self, login: str) -> Optional[Account]:
+        result = await self.session.execute(select(Account).where(Account.login == login))
+        return result.scalar_one_or_none()
+
+    async def get_by_login_for_owner(self, login: str, owner_tg_id: int,
+                                     funpay_account_id: Optional[int] = None) -> Optional[Account]:
+        """Steam аккаунт по логину, только если он принадлежит владельцу (и FunPay аккаунту, если задан)."""
+        query = select(Account).where(Account.login == login, Account.owner_tg_id == owner_tg_id)
+        if funpay_account_id is not None:
+            query = query.where(Account.funpay_account_id == funpay_account_id)
+        result = await self.session.execute(query)
+        return result.scalar_one_or_none()
+
+    async def list_for_funpay_account(self, funpay_account_id: int) -> list[Account]:
+        result = await self.session.execute(
+            select(Account).where(Account.funpay_account_id == funpay_account_id).order_by(Account.id)
+        )
+        return list(result.scalars())
+
+    async def claim_expired_rentals(self, now: datetime, claim_until: datetime, limit: int) -> list:
+        """
+        Захватывает до limit истекших аренд (FOR UPDATE SKIP LOCKED): rent_end_time сдвигается на claim_until,
+        поэтому другие реплики не видят их, пока идет смена пароля. Если процесс упал или смена не удалась,
+        аренда снова станет истекшей в claim_until. Возвращает строки
+        (id, login, owner_tg_id, current_password, base_password_encrypted, shared_secret_encrypted).
+        """
+        expired = (
+            select(Account.id).where(Account.status == 'rented', Account.rent_end_time < now)
+            .order_by(Account.rent_end_time).limit(limit).with_for_update(skip_locked=True)
+        )
+        result = await self.session.execute(
+            update(Account).where(Account.id.in_(expired)).values(rent_end_time=claim_until)
+            .returning(Account.id, Account.login, Account.owner_tg_id, Account.current_password,
+                       Account.base_password_encrypted, Account.shared_secret_encrypted)
+            .execution_options(synchronize_session=False)
+        )
+        return list(result.all())
+
+    async def release_rental(self, account_id: int):
+        """Возвращает аккаунт в статус 'available' и очищает данные аренды."""
+        await self.session.execute(
+            update(Account).where(Account.id == account_id, Account.status == 'rented').values(
+                status='available',
+                current_password=None,
+                renter_username=None,
+                rent_end_time=None
+            )
+        )
+
+    async def add(self, account: Account) -> Account:
+        self.session.add(account)
+        await self.session.flush()
+        return account
+
+class TransactionRepository:
+    def __init__(self, session: AsyncSession):
+        self.session = session
+
+    async def add(self, owner_tg_id: int, transaction_type: str, amount, account_id: Optional[int] = None,
+                  external_id: Optional[str] = None, status: str = 'completed') -> Transaction:
+        transaction = Transaction(
+            owner_tg_id=owner_tg_id,
+            account_id=account_id,
+            transaction_type=transaction_type,
+            external_id=external_id,
+            amount=amount,
+            status=status
+        )
+        self.session.add(transaction)
+        await self.session.flush()
+        return transaction
+
+    async def get_by_external_id(self, external_id: str) -> Optional[Transaction]:
+        result = await self.session.execute(select(Transaction).where(Transaction.external_id == external_id))
+        return result.scalar_one_or_none()
+
+class RollupRepository:
+    """
+    Чтение агрегатов revenue_rollups и global_counters - без сканирования истории.
+    Глобальные агрегаты разбиты на слоты (миграция v0009) и суммируются при чтении.
+    """
+    EPOCH = datetime(1970, 1, 1)
+
+    def __init__(self, session: AsyncSession):
+        self.session = session
+
+    async def get_counters(self) -> dict[str, int]:
+        result = await self.session.execute(
+            select(GlobalCounter.name, func.sum(GlobalCounter.value)).group_by(GlobalCounter.name)
+        )
+        return {name: int(value) for name, value in result.all()}
+
+    async def get_bucket(self, scope: str, scope_id: Optional[int] = None, granularity: str = 'total',
+                         bucket_start: Optional[datetime] = None) -> dict[str, RevenueRollup]:
+        """
+        {тип транзакции: агрегат} для одного бакета (по умолчанию - за все время).
+        Для scope='global' scope_id не указывается: слоты суммируются.
+        Возвращаемые агрегаты не привязаны к сессии - не изменяйте их.
+        """
+        query = select(
+            RevenueRollup.transaction_type,
+            func.sum(RevenueRollup.tx_count),
+            func.sum(RevenueRollup.amount),
+            func.sum(RevenueRollup.rented_hours)
+        ).where(
+            RevenueRollup.scope == scope,
+            RevenueRollup.granularity == granularity,
+            RevenueRollup.bucket_start == (bucket_start or self.EPOCH)
+        ).group_by(RevenueRollup.transaction_type)
+        if scope != 'global':
+            query = query.where(RevenueRollup.scope_id == scope_id)
+        result = await self.session.execute(query)
+        return {
+            transaction_type: RevenueRollup(
+                scope=scope, scope_id=scope_id or 0, granularity=granularity,
+                bucket_start=bucket_start or self.EPOCH, transaction_type=transaction_type,
+                tx_count=int(tx_count), amount=amount, rented_hours=rented_hours
+            )
+            for transaction_type, tx_count, amount, rented_hours in result.all()
+        }
@@ -0,0 +1,75 @@
+# bot/router.py
+# Табличная маршрутизация текстовых кнопок и callback data.
+# Точные совпадения - поиск в dict, префиксные маршруты (например funpay_view_<id>) - префиксное дерево
+# с выбором самого длинного префикса; остаток после префикса приводится к типу параметра маршрута.
+# Каждый вызов обработчика пишет гистограмму handler_latency_seconds{route=...}.
+import time
+from typing import Any, Awaitable, Callable, Optional
+from bot import metrics
+
+Handler = Callable[..., Awaitable[Any]]
+
+class Route:
+    __slots__ = ('name', 'handler', 'param_type')
+
+    def __init__(self, name: str, handler: Handler, param_type: Optional[Callable[[str], Any]] = None):
+        self.name = name
+        self.handler = handler
+        self.param_type = param_type
+
+class _TrieNode:
+    __slots__ = ('children', 'route')
+
+    def __init__(self):
+        self.children: dict[str, _TrieNode] = {}
+        self.route: Optional[Route] = None
+
+class Router:
+    def __init__(self, name: str):
+        self.name = name
+        self._exact: dict[str, Route] = {}
+        self._prefixes = _TrieNode()
+
+    def exact(self, key: str, handler: Handler, name: Optional[str] = None):
+        """Маршрут по точному совпадению. Обработчик вызывается как handler(*args, None)."""
+        self._exact[key] = Route(name or f"{self.name}:{key}", handler)
+
+    def prefix(self, prefix: str, handler: Handler, param_type: Callable[[str], Any] = str, name: Optional[str] = None):
+        """Маршрут по префиксу. Обработчик вызывается как handler(*args, param_type(остаток))."""
+        node = self._prefixes
+        for char in prefix:
+            node = node.children.setdefault(char, _TrieNode())
+        node.route = Route(name or f"{self.name}:{prefix}*", handler, param_type)
+
+    def resolve(self, key: str) -> Optional[tuple[Route, Any]]:
+        """Возвращает (маршрут, параметр) или None. Параметр неподходящего типа - это отсутствие маршрута."""
+        route = self._exact.get(key)
+        if route is not None:
+            return route, None
+        node, match, match_len = self._prefixes, None, 0
+        for i, char in enumerate(key):
+            node = node.children.get(char)
+            if node is None:
+                break
+            if node.route is not None:
+                match, match_len = node.route, i + 1
+        if match is None:
+            return None
+        try:
+            return match, match.param_type(key[match_len:])
+        except ValueError:
+            return None
+
+    async def dispatch(self, key: str, *args) -> bool:
+        """Вызывает обработчик маршрута. False - если маршрута нет."""
+        resolved = self.resolve(key)
+        if resolved is None:
+            metrics.inc("router_unmatched_total", router=self.name)
+            return False
+        route, param = resolved
+        started = time.monotonic()
+        try:
+            await route.handler(*args, param)
+        finally:
+            metrics.observe("handler_latency_seconds", time.monotonic() - started, route=route.name)
+        return True
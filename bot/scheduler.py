@@ -1,77 +1,93 @@
-# bot/scheduler.py
-import logging
-from datetime import datetime
-import asyncio
-from bot.database import get_db
-from bot.models import Account
-from bot.steam_api import change_password
-from bot.utils import generate_secure_password, decrypt_data
-from bot.bot import get_bot_instance
-
-async def notify_owner(owner_tg_id: int, message: str):
-    bot_instance = get_bot_instance()
-    if bot_instance:
-        try:
-            await bot_instance.send_message(chat_id=owner_tg_id, text=message)
-            logging.info(f"[SCHEDULER NOTIFY] Уведомление отправлено владельцу {owner_tg_id}.")
-        except Exception as e:
-            logging.error(f"[SCHEDULER NOTIFY] Ошибка отправки уведомления владельцу {owner_tg_id}: {e}")
-
-async def check_expired_rentals(app=None):
-    logging.info("[SCHEDULER] Начало проверки истекших аренд...")
-    try:
-        db_gen = get_db()
-        db = next(db_gen)
-        now = datetime.utcnow()
-        expired_accounts = db.query(Account).filter(
-            Account.status == 'rented',
-            Account.rent_end_time < now
-        ).all()
-
-        if not expired_accounts:
-            logging.info("[SCHEDULER] Нет истекших аренд.")
-            db.close()
-            return
-
-        logging.info(f"[SCHEDULER] Найдено {len(expired_accounts)} истекших аренд.")
-
-        for account in expired_accounts:
-            try:
-                logging.info(f"[SCHEDULER] Обрабатываем {account.login} (ID: {account.id})...")
-                new_password = generate_secure_password()
-                owner_tg_id = account.owner.tg_id
-                old_temp_password = account.current_password or decrypt_data(account.base_password_encrypted)
-
-                await notify_owner(owner_tg_id, f"🔄 Начат процесс завершения аренды аккаунта {account.login}...")
-
-                loop = asyncio.new_event_loop()
-                asyncio.set_event_loop(loop)
-                change_result = loop.run_until_complete(
-                    change_password(account.login, old_temp_password, new_password, owner_tg_id)
-                )
-                loop.close()
-
-                if not change_result:
-                    error_msg = f"❌ Ошибка сброса пароля для аккаунта {account.login} при завершении аренды."
-                    logging.error(f"[SCHEDULER] {error_msg}")
-                    await notify_owner(owner_tg_id, error_msg)
-                    continue
-
-                account.status = "available"
-                account.current_password = None
-                account.renter_username = None
-                account.rent_end_time = None
-                db.commit()
-                success_msg = f"✅ Аренда аккаунта {account.login} успешно завершена."
-                logging.info(f"[SCHEDULER] {success_msg}")
-                await notify_owner(owner_tg_id, success_msg)
-
-            except Exception as e:
-                logging.error(f"[SCHEDULER] Ошибка обработки {account.login} (ID: {account.id}): {e}", exc_info=True)
-                await notify_owner(owner_tg_id, f"❌ Критическая ошибка при завершении аренды {account.login}.")
-
-        db.close()
-        logging.info("[SCHEDULER] Проверка истекших аренд завершена.")
-
-    except Exception as e:
-        logging.critical(f"[SCHEDULER] Критическая ошибка: {e}", exc_info=True)
\ No newline at end of file
+# bot/scheduler.py
+import logging
+from datetime import datetime, timedelta
+from typing import Optional
+from sqlalchemy import text
+from bot import metrics
+from bot.config import RENTAL_RETURN_BATCH_SIZE, RENTAL_RETURN_CLAIM_TTL, PERSISTENCE_USER_TTL
+from bot.database import async_session_scope, get_async_engine
+from bot.repositories import AccountRepository
+from bot.stats import invalidate_owner_stats
+from bot.steam_api import change_password
+from bot.utils import generate_secure_password, decrypt_data
+from bot.notifications import notify_async
+
+async def notify_owner(owner_tg_id: int, message: str, digest_key: Optional[str] = None):
+    await notify_async(owner_tg_id, message, digest_key)
+
+async def check_expired_rentals(app=None):
+    """
+    Завершает истекшие аренды пачками по RENTAL_RETURN_BATCH_SIZE. Каждая пачка захватывается
+    (AccountRepository.claim_expired_rentals) и коммитится до логина в Steam, поэтому несколько
+    реплик планировщика не сбрасывают пароль одного аккаунта дважды.
+    """
+    logging.info("[SCHEDULER] Начало проверки истекших аренд...")
+    total = 0
+    try:
+        async with async_session_scope() as session:
+            accounts_repo = AccountRepository(session)
+            while True:
+                now = datetime.utcnow()
+                rentals = await accounts_repo.claim_expired_rentals(
+                    now, now + timedelta(seconds=RENTAL_RETURN_CLAIM_TTL), RENTAL_RETURN_BATCH_SIZE
+                )
+                # Фиксируем захват и не держим соединение из пула, пока идет логин в Steam
+                await session.commit()
+                if not rentals:
+                    break
+                total += len(rentals)
+                logging.info(f"[SCHEDULER] Захвачено {len(rentals)} истекших аренд.")
+                for rental in rentals:
+                    await _return_rental(session, accounts_repo, *rental)
+
+        if not total:
+            logging.info("[SCHEDULER] Нет истекших аренд.")
+        logging.info("[SCHEDULER] Проверка истекших аренд завершена.")
+
+    except Exception as e:
+        logging.critical(f"[SCHEDULER] Критическая ошибка: {e}", exc_info=True)
+
+async def _return_rental(session, accounts_repo: AccountRepository, account_id: int, login: str, owner_tg_id: int,
+                         current_password: Optional[str], base_password_encrypted: bytes,
+                         shared_secret_encrypted: Optional[bytes]):
+    try:
+        logging.info(f"[SCHEDULER] Обрабатываем {login} (ID: {account_id})...")
+        new_password = generate_secure_password()
+        old_temp_password = current_password or decrypt_data(base_password_encrypted)
+
+        await notify_owner(owner_tg_id, f"🔄 Начат процесс завершения аренды аккаунта {login}...", 'rental_ending')
+
+        change_result = await change_password(
+            login, old_temp_password, new_password, owner_tg_id, shared_secret_encrypted
+        )
+
+        if not change_result:
+            # Аренда снова станет истекшей через RENTAL_RETURN_CLAIM_TTL - тогда и повторим
+            error_msg = f"❌ Ошибка сброса пароля для аккаунта {login} при завершении аренды."
+            logging.error(f"[SCHEDULER] {error_msg}")
+            await notify_owner(owner_tg_id, error_msg)
+            return
+
+        await accounts_repo.release_rental(account_id)
+        await session.commit()
+        invalidate_owner_stats(owner_tg_id)
+        success_msg = f"✅ Аренда аккаунта {login} успешно завершена."
+        logging.info(f"[SCHEDULER] {success_msg}")
+        await notify_owner(owner_tg_id, success_msg, 'rental_ended')
+
+    except Exception as e:
+        await session.rollback()
+        logging.error(f"[SCHEDULER] Ошибка обработки {login} (ID: {account_id}): {e}", exc_info=True)
+        await notify_owner(owner_tg_id, f"❌ Критическая ошибка при завершении аренды {login}.")
+
+async def purge_expired_user_state():
+    """
+    Удаляет состояние пользователей бота (bot_user_state, bot/persistence.py), не записывавшееся
+    дольше PERSISTENCE_USER_TTL. Живет здесь, а не в bot/persistence.py, чтобы процесс планировщика не грузил PTB.
+    """
+    cutoff = datetime.utcnow() - timedelta(seconds=PERSISTENCE_USER_TTL)
+    async with get_async_engine().begin() as conn:
+        result = await conn.execute(text("DELETE FROM bot_user_state WHERE updated_at < :cutoff"), {"cutoff": cutoff})
+    if result.rowcount:
+        logging.info(f"[PERSISTENCE] Удалено устаревшее состояние {result.rowcount} пользователей.")
+        metrics.inc("persistence_expired_total", result.rowcount)
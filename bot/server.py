@@ -0,0 +1,99 @@
+# bot/server.py
+# Боевые веб-серверы вместо dev-сервера Werkzeug.
+#
+# RUN_MODE=web - gevent WSGIServer (serve_forever).
+# Каждый запрос - отдельный greenlet (до WEB_MAX_CONNECTIONS одновременно); psycopg2 переключается
+# на кооперативный режим через psycogreen, чтобы запросы к БД не блокировали остальные greenlet'ы.
+# Смена пароля Steam при аренде выполняется в потоках ОС threadpool хаба (до WEB_BLOCKING_THREADS),
+# см. bot/steam_api.py.
+# Процесс должен быть пропатчен gevent.monkey.patch_all() до импорта остальных модулей (см. app.py).
+# Бот и планировщик глобальных задач в этом процессе не запускаются - у них свои процессы (RUN_MODE=bot, RUN_MODE=scheduler).
+#
+# Остановка по SIGTERM/SIGINT: сервер перестает принимать соединения и ждет текущие запросы,
+# затем дожидается заказов FunPay в обработке и отправки сообщений покупателям (до WEB_SHUTDOWN_TIMEOUT).
+#
+# RUN_MODE=webhook и all - многопоточный waitress (serve_threaded / create_threaded_server): в этих
+# процессах работает asyncio loop бота, с которым monkey-patching gevent несовместим. Запрос занимает
+# поток из WEB_THREADS, соединения сверх WEB_MAX_CONNECTIONS не принимаются.
+import logging
+import signal
+import threading
+import time
+from flask import Flask
+from bot.config import WEB_MAX_CONNECTIONS, WEB_SHUTDOWN_TIMEOUT, WEB_BLOCKING_THREADS, WEB_THREADS
+
+def drain(deadline: float):
+    """Ждет заказы FunPay в обработке и отправку сообщений покупателям до deadline (time.monotonic())."""
+    from bot.funpay_integration import wait_for_orders
+    from bot.funpay_outbox import funpay_outbox
+    if not wait_for_orders(max(0.0, deadline - time.monotonic())):
+        logging.warning("[WEB] Не все заказы FunPay успели обработаться до остановки.")
+    if not funpay_outbox.wait_idle(max(0.0, deadline - time.monotonic())):
+        logging.warning("[WEB] Не все сообщения покупателям успели отправиться до остановки.")
+
+def serve_forever(app: Flask, host: str = '0.0.0.0', port: int = 5000,
+                  max_connections: int = WEB_MAX_CONNECTIONS, shutdown_timeout: float = WEB_SHUTDOWN_TIMEOUT):
+    import gevent
+    from gevent.pool import Pool
+    from gevent.pywsgi import WSGIServer
+    from psycogreen.gevent import patch_psycopg
+
+    patch_psycopg()
+    gevent.get_hub().threadpool.maxsize = WEB_BLOCKING_THREADS
+    server = WSGIServer((host, port), app, spawn=Pool(max_connections), log=None)
+
+    def shutdown():
+        logging.info("[WEB] Остановка: новые соединения не принимаются, ждем текущие запросы...")
+        deadline = time.monotonic() + shutdown_timeout
+        server.stop(timeout=shutdown_timeout)
+        drain(deadline)
+        logging.info("[WEB] Веб-сервер остановлен.")
+
+    def on_signal():
+        # server.stop блокирует - выполняем не в обработчике сигнала, а в отдельном greenlet
+        gevent.spawn(shutdown)
+
+    gevent.signal_handler(signal.SIGTERM, on_signal)
+    gevent.signal_handler(signal.SIGINT, on_signal)
+    logging.info(f"[WEB] gevent WSGIServer слушает {host}:{port} (до {max_connections} соединений).")
+    server.serve_forever()
+
+def create_threaded_server(app: Flask, host: str = '0.0.0.0', port: int = 5000, threads: int = WEB_THREADS,
+                           max_connections: int = WEB_MAX_CONNECTIONS):
+    """Многопоточный waitress-сервер; запуск - server.run() (блокирует), остановка - stop_threaded_server."""
+    from waitress.server import create_server
+    server = create_server(app, host=host, port=port, threads=threads, connection_limit=max_connections,
+                           ident="steam-rental-bot")
+    logging.info(f"[WEB] waitress слушает {host}:{port} ({threads} потоков, до {max_connections} соединений).")
+    return server
+
+def stop_threaded_server(server, shutdown_timeout: float = WEB_SHUTDOWN_TIMEOUT):
+    """
+    Перестает принимать соединения, ждет текущие запросы, заказы FunPay и сообщения покупателям.
+    Сокеты закрываются в потоке цикла waitress (через его trigger) - закрытие из другого потока
+    роняет select на закрытом дескрипторе. Цикл server.run() завершается, когда закрыто все.
+    """
+    from waitress import wasyncore
+    logging.info("[WEB] Остановка: новые соединения не принимаются, ждем текущие запросы...")
+    deadline = time.monotonic() + shutdown_timeout
+    server.trigger.pull_trigger(lambda: wasyncore.dispatcher.close(server))
+    server.task_dispatcher.shutdown(cancel_pending=False, timeout=shutdown_timeout)
+    server.trigger.pull_trigger(lambda: wasyncore.close_all(server._map))
+    drain(deadline)
+    logging.info("[WEB] Веб-сервер остановлен.")
+
+def serve_threaded(app: Flask, host: str = '0.0.0.0', port: int = 5000,
+                   shutdown_timeout: float = WEB_SHUTDOWN_TIMEOUT):
+    """waitress в текущем (главном) потоке до SIGTERM/SIGINT."""
+    server = create_threaded_server(app, host=host, port=port)
+    stopper = threading.Thread(target=stop_threaded_server, args=(server, shutdown_timeout), name="web-shutdown")
+
+    def on_signal(signum, frame):
+        # Остановка ждет запросы, поэтому выполняется не в обработчике сигнала, а в отдельном потоке
+        if stopper.ident is None:
+            stopper.start()
+    signal.signal(signal.SIGTERM, on_signal)
+    signal.signal(signal.SIGINT, on_signal)
+    server.run()
+    if stopper.ident is not None:
+        stopper.join()
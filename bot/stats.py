@@ -0,0 +1,93 @@
+# bot/stats.py
+# Сводная статистика владельца для меню FunPay аккаунтов.
+# Все счетчики (по статусам, активные аренды, выручка) считаются одним сгруппированным запросом
+# и кэшируются на STATS_CACHE_TTL секунд. Кэш сбрасывается при изменении состояния аренды.
+# Выручка и часы аренды берутся из revenue_rollups, а не суммированием transactions.
+from decimal import Decimal
+from typing import Optional
+from sqlalchemy import select, func, and_
+from sqlalchemy.ext.asyncio import AsyncSession
+from bot.cache import TTLCache
+from bot.config import STATS_CACHE_TTL, STATS_CACHE_SIZE
+from bot.models import Owner, FunPayAccount, Account, RevenueRollup
+
+_dashboard_cache = TTLCache("owner_dashboard", maxsize=STATS_CACHE_SIZE, ttl=STATS_CACHE_TTL)
+
+def _empty_stats() -> dict:
+    return {'total': 0, 'by_status': {}, 'active_rentals': 0, 'revenue': Decimal('0'), 'rented_hours': Decimal('0')}
+
+def _build_dashboard_query(owner_tg_id: int):
+    return (
+        select(
+            Owner.id,
+            FunPayAccount.id,
+            FunPayAccount.name,
+            FunPayAccount.is_active,
+            Account.status,
+            func.count(Account.id),
+            # Агрегат один на FunPay аккаунт и повторяется в каждой группе статуса
+            func.coalesce(func.max(RevenueRollup.amount), 0),
+            func.coalesce(func.max(RevenueRollup.rented_hours), 0)
+        )
+        .select_from(Owner)
+        .outerjoin(FunPayAccount, FunPayAccount.owner_id == Owner.id)
+        .outerjoin(Account, Account.funpay_account_id == FunPayAccount.id)
+        .outerjoin(RevenueRollup, and_(
+            RevenueRollup.scope == 'funpay_account',
+            RevenueRollup.scope_id == FunPayAccount.id,
+            RevenueRollup.granularity == 'total',
+            RevenueRollup.transaction_type == 'rental'
+        ))
+        .where(Owner.tg_id == owner_tg_id)
+        .group_by(Owner.id, FunPayAccount.id, FunPayAccount.name, FunPayAccount.is_active, Account.status)
+        .order_by(FunPayAccount.id)
+    )
+
+async def get_owner_dashboard(session: AsyncSession, owner_tg_id: int) -> Optional[dict]:
+    """
+    Возвращает статистику владельца или None, если владельца нет:
+    {'owner_id', 'totals': {...}, 'funpay_accounts': {id: {'id', 'name', 'is_active', 'total',
+    'by_status', 'active_rentals', 'revenue', 'rented_hours'}},
+    'funpay_account_ids_by_name': {name: id}} - индекс активных FunPay аккаунтов для кнопок меню.
+    Возвращаемый словарь общий для всех читателей кэша - не изменяйте его.
+    """
+    dashboard = _dashboard_cache.get(owner_tg_id)
+    if dashboard is not None:
+        return dashboard
+
+    rows = (await session.execute(_build_dashboard_query(owner_tg_id))).all()
+    if not rows:
+        return None
+
+    totals = _empty_stats()
+    funpay_accounts = {}
+    for owner_id, fp_id, fp_name, fp_is_active, status, count, revenue, rented_hours in rows:
+        if fp_id is None:
+            continue # Владелец без FunPay аккаунтов
+        fp_stats = funpay_accounts.get(fp_id)
+        if fp_stats is None:
+            fp_stats = funpay_accounts[fp_id] = {'id': fp_id, 'name': fp_name, 'is_active': fp_is_active, **_empty_stats()}
+            fp_stats['revenue'] = Decimal(revenue)
+            fp_stats['rented_hours'] = Decimal(rented_hours)
+            totals['revenue'] += fp_stats['revenue']
+            totals['rented_hours'] += fp_stats['rented_hours']
+        if status is None:
+            continue # FunPay аккаунт без Steam аккаунтов
+        for stats in (fp_stats, totals):
+            stats['total'] += count
+            stats['by_status'][status] = stats['by_status'].get(status, 0) + count
+            if status == 'rented':
+                stats['active_rentals'] += count
+
+    ids_by_name = {}
+    for fp_stats in funpay_accounts.values():
+        if fp_stats['is_active']:
+            ids_by_name.setdefault(fp_stats['name'], fp_stats['id'])
+    dashboard = {'owner_id': rows[0][0], 'totals': totals, 'funpay_accounts': funpay_accounts,
+                 'funpay_account_ids_by_name': ids_by_name}
+    _dashboard_cache.set(owner_tg_id, dashboard)
+    return dashboard
+
+def invalidate_owner_stats(owner_tg_id: int):
+    """Сбрасывает кэш статистики владельца (вызывать при изменении аренд и аккаунтов)."""
+    _dashboard_cache.invalidate(owner_tg_id)
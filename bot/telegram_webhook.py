@@ -0,0 +1,107 @@
+# bot/telegram_webhook.py
+# Режим webhook: Telegram присылает апдейты на тот же Flask-сервер, что и вебхуки FunPay/YooKassa.
+# Application работает в своем потоке с постоянным event loop (там же пул asyncpg и обработчики),
+# Flask-обработчик только проверяет секрет, разбирает апдейт и кладет его в application.update_queue -
+# ответ Telegram уходит сразу, не дожидаясь обработки. Если loop бота не работает (еще не запущен
+# или упал), апдейт не принимается: ответ 503, и Telegram повторит доставку позже.
+import asyncio
+import hmac
+import logging
+import secrets
+import threading
+from typing import Optional
+from flask import Flask, request
+from telegram import Update
+from bot import metrics
+from bot.bot import build_application, ALLOWED_UPDATES
+from bot.config import TELEGRAM_WEBHOOK_URL, TELEGRAM_WEBHOOK_PATH, TELEGRAM_WEBHOOK_SECRET, \
+    TELEGRAM_WEBHOOK_SUBMIT_TIMEOUT
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+class WebhookBot:
+    def __init__(self, application=None, webhook_url: Optional[str] = TELEGRAM_WEBHOOK_URL,
+                 secret_token: Optional[str] = TELEGRAM_WEBHOOK_SECRET):
+        self.application = application or build_application()
+        self.webhook_url = webhook_url
+        # Секрет из допустимых для Telegram символов (A-Z, a-z, 0-9, _ и -)
+        self.secret_token = secret_token or secrets.token_urlsafe(32)
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self._started = threading.Event()
+        self._startup_error: Optional[BaseException] = None
+
+    def start(self, timeout: float = 60):
+        """Запускает Application в отдельном потоке и регистрирует webhook в Telegram."""
+        thread = threading.Thread(target=self._run, daemon=True, name="telegram-webhook-bot")
+        thread.start()
+        if not self._started.wait(timeout):
+            raise RuntimeError("Telegram бот не запустился за отведенное время")
+        if self._startup_error:
+            raise RuntimeError(f"Не удалось запустить Telegram бот: {self._startup_error}")
+
+    def _run(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        try:
+            self.loop.run_until_complete(self._startup())
+        except BaseException as e:
+            self._startup_error = e
+            self._started.set()
+            return
+        self._started.set()
+        self.loop.run_forever()
+
+    async def _startup(self):
+        application = self.application
+        await application.initialize()
+        if application.post_init:
+            await application.post_init(application)
+        await application.start() # Разбор update_queue и вызов обработчиков
+        if self.webhook_url:
+            await application.bot.set_webhook(
+                url=self.webhook_url,
+                secret_token=self.secret_token,
+                allowed_updates=ALLOWED_UPDATES,
+            )
+            logging.info(f"[TELEGRAM WEBHOOK] Webhook установлен: {self.webhook_url}")
+        else:
+            logging.warning("[TELEGRAM WEBHOOK] TELEGRAM_WEBHOOK_URL не задан, webhook в Telegram не регистрируется.")
+
+    def check_secret(self, header_value: Optional[str]) -> bool:
+        return bool(header_value) and hmac.compare_digest(header_value, self.secret_token)
+
+    def submit(self, data: dict, timeout: float = TELEGRAM_WEBHOOK_SUBMIT_TIMEOUT) -> bool:
+        """
+        Кладет апдейт в очередь Application (вызывается из потоков Flask).
+        False - апдейт не принят: loop бота не работает или постановка в очередь не завершилась за timeout.
+        """
+        loop = self.loop
+        if loop is None or not loop.is_running():
+            return False
+        update = Update.de_json(data, self.application.bot)
+        future = asyncio.run_coroutine_threadsafe(self.application.update_queue.put(update), loop)
+        try:
+            future.result(timeout)
+        except Exception as e:
+            future.cancel()
+            logging.error(f"[TELEGRAM WEBHOOK] Не удалось поставить апдейт в очередь: {e!r}")
+            return False
+        return True
+
+def register_telegram_webhook(app: Flask, webhook_bot: WebhookBot, path: str = TELEGRAM_WEBHOOK_PATH):
+    @app.route(path, methods=['POST'])
+    def telegram_webhook():
+        if not webhook_bot.check_secret(request.headers.get(SECRET_HEADER)):
+            metrics.inc("telegram_webhook_updates_total", result="forbidden")
+            logging.warning("[TELEGRAM WEBHOOK] Запрос с неверным секретом отклонен.")
+            return 'Forbidden', 403
+        data = request.get_json(silent=True)
+        if not isinstance(data, dict):
+            metrics.inc("telegram_webhook_updates_total", result="bad_request")
+            return 'Bad Request', 400
+        if not webhook_bot.submit(data):
+            metrics.inc("telegram_webhook_updates_total", result="unavailable")
+            return 'Service Unavailable', 503
+        metrics.inc("telegram_webhook_updates_total", result="accepted")
+        return '', 200
+    logging.info(f"[TELEGRAM WEBHOOK] Прием апдейтов по адресу {path}")
@@ -1,135 +1,270 @@
-# bot/utils.py
-import os
-import base64
-from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
-from cryptography.hazmat.primitives import padding
-from cryptography.hazmat.backends import default_backend
-import secrets
-import string
-from typing import Optional # Импорт для аннотаций
-from bot.config import MASTER_ENCRYPTION_KEY
-from bot.database import get_db
-from bot.models import Owner
-from datetime import datetime, timedelta
-
-class SimpleCrypto:
-    def __init__(self, key: bytes):
-        if len(key) != 32:
-            raise ValueError("Key must be 32 bytes long for AES-256")
-        self.key = key
-        self.backend = default_backend()
-
-    def encrypt(self, plaintext: bytes) -> bytes:
-        iv = os.urandom(16)
-        cipher = Cipher(algorithms.AES(self.key), modes.CBC(iv), backend=self.backend)
-        encryptor = cipher.encryptor()
-        padder = padding.PKCS7(128).padder()
-        padded_data = padder.update(plaintext)
-        padded_data += padder.finalize()
-        ciphertext = encryptor.update(padded_data) + encryptor.finalize()
-        return iv + ciphertext
-
-    def decrypt(self, ciphertext: bytes) -> bytes:
-        iv = ciphertext[:16]
-        actual_ciphertext = ciphertext[16:]
-        cipher = Cipher(algorithms.AES(self.key), modes.CBC(iv), backend=self.backend)
-        decryptor = cipher.decryptor()
-        padded_plaintext = decryptor.update(actual_ciphertext) + decryptor.finalize()
-        unpadder = padding.PKCS7(128).unpadder()
-        plaintext = unpadder.update(padded_plaintext)
-        plaintext += unpadder.finalize()
-        return plaintext
-
-# --- ИНИЦИАЛИЗАЦИЯ КРИПТО-ОБЪЕКТА ---
-# ВАЖНО: Убедитесь, что MASTER_ENCRYPTION_KEY в .env содержит ровно 32 символа.
-# Если ключ неверный, бот упадет при импорте этого модуля.
-try:
-    _crypto = SimpleCrypto(MASTER_ENCRYPTION_KEY.encode())
-    _CRYPTO_AVAILABLE = True
-except ValueError as e:
-    print(f"[ERROR] Ошибка инициализации криптографии: {e}")
-    print("[ERROR] Проверьте переменную MASTER_ENCRYPTION_KEY в .env. Она должна быть длиной 32 символа.")
-    _crypto = None
-    _CRYPTO_AVAILABLE = False
-# -----------------------------------
-
-def encrypt_data(data: str) -> bytes:
-    """Шифрует строку и возвращает байты."""
-    if not _CRYPTO_AVAILABLE or _crypto is None:
-        raise RuntimeError("Криптография недоступна. Проверьте MASTER_ENCRYPTION_KEY.")
-    return _crypto.encrypt(data.encode('utf-8'))
-
-def decrypt_data(encrypted_data: bytes) -> str: # <-- ИСПРАВЛЕНО: правильное имя параметра
-    """Расшифровывает байты и возвращает строку."""
-    if not _CRYPTO_AVAILABLE or _crypto is None:
-        raise RuntimeError("Криптография недоступна. Проверьте MASTER_ENCRYPTION_KEY.")
-    return _crypto.decrypt(encrypted_data).decode('utf-8')
-
-def generate_secure_password(length=12) -> str:
-    """Генерирует безопасный случайный пароль."""
-    alphabet = string.ascii_letters + string.digits
-    return ''.join(secrets.choice(alphabet) for _ in range(length))
-
-def parse_account_id_from_product_name(product_name: str) -> Optional[int]: # <-- ИСПРАВЛЕНО: Аннотация
-    """Парсит ID аккаунта из названия товара FunPay."""
-    import re
-    match = re.search(r'\[ID:(\d+)\]', product_name)
-    if match:
-        return int(match.group(1))
-    return None
-
-# --- ХЕЛПЕРЫ ДЛЯ ПОДПИСКИ ---
-def is_user_subscribed(owner_tg_id: int) -> bool:
-    """Проверяет, подписан ли пользователь."""
-    try:
-        db_gen = get_db()
-        db = next(db_gen)
-        owner = db.query(Owner).filter(Owner.tg_id == owner_tg_id).first()
-        db.close()
-        if owner and owner.is_subscribed():
-            return True
-        return False
-    except Exception:
-        return False
-
-def get_decrypted_funpay_creds(owner_tg_id: int) -> Optional[tuple[str, str]]:
-    """Получает и расшифровывает учетные данные FunPay для владельца."""
-    try:
-        db_gen = get_db()
-        db = next(db_gen)
-        owner = db.query(Owner).filter(Owner.tg_id == owner_tg_id).first()
-        db.close()
-        if owner and owner.has_funpay_credentials():
-            user_id = decrypt_data(owner.funpay_user_id_encrypted)
-            golden_key = decrypt_data(owner.funpay_golden_key_encrypted)
-            return user_id, golden_key
-        return None
-    except Exception as e:
-        print(f"Error getting FunPay creds for {owner_tg_id}: {e}")
-        return None
-
-# --- ДЕКОРАТОР ДЛЯ ПРОВЕРКИ FUNPAY CREDENTIALS ---
-def funpay_creds_required(func):
-    async def wrapper(update, context):
-        from bot.utils import get_decrypted_funpay_creds
-        user_id = update.effective_user.id
-        creds = get_decrypted_funpay_creds(user_id)
-        if not creds:
-            await update.message.reply_text(
-                "⚠️ Учетные данные FunPay не найдены.\n"
-                "Пожалуйста, добавьте их через меню 'Мои аккаунты FunPay'."
-            )
-            return
-        return await func(update, context)
-    return wrapper
-
-# --- ХЕЛПЕР ДЛЯ ПОДПИСКИ ---
-def add_subscription_days(owner, days: int):
-    """Добавляет дни подписки владельцу."""
-    current_end = owner.subscription_end or datetime.utcnow()
-    if current_end < datetime.utcnow():
-        new_end = datetime.utcnow() + timedelta(days=days)
-    else:
-        new_end = current_end + timedelta(days=days)
-    owner.subscription_end = new_end
-    return new_end
+# bot/utils.py
+import os
+import base64
+from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+from cryptography.hazmat.primitives import padding
+from cryptography.hazmat.backends import default_backend
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from cryptography.exceptions import InvalidTag
+import secrets
+import string
+import hashlib
+import threading
+import time
+from typing import Optional # Импорт для аннотаций
+from bot.config import MASTER_ENCRYPTION_KEY, ENCRYPTION_KEYS, ACTIVE_KEY_ID, SECRET_CACHE_TTL, SECRET_CACHE_SIZE
+from bot.cache import TTLCache
+from bot import metrics
+from bot.owner_cache import get_owner_snapshot, is_snapshot_subscribed
+
+class SimpleCrypto:
+    def __init__(self, key: bytes):
+        if len(key) != 32:
+            raise ValueError("Key must be 32 bytes long for AES-256")
+        self.key = key
+        self.backend = default_backend()
+
+    def encrypt(self, plaintext: bytes) -> bytes:
+        iv = os.urandom(16)
+        cipher = Cipher(algorithms.AES(self.key), modes.CBC(iv), backend=self.backend)
+        encryptor = cipher.encryptor()
+        padder = padding.PKCS7(128).padder()
+        padded_data = padder.update(plaintext)
+        padded_data += padder.finalize()
+        ciphertext = encryptor.update(padded_data) + encryptor.finalize()
+        return iv + ciphertext
+
+    def decrypt(self, ciphertext: bytes) -> bytes:
+        iv = ciphertext[:16]
+        actual_ciphertext = ciphertext[16:]
+        cipher = Cipher(algorithms.AES(self.key), modes.CBC(iv), backend=self.backend)
+        decryptor = cipher.decryptor()
+        padded_plaintext = decryptor.update(actual_ciphertext) + decryptor.finalize()
+        unpadder = padding.PKCS7(128).unpadder()
+        plaintext = unpadder.update(padded_plaintext)
+        plaintext += unpadder.finalize()
+        return plaintext
+
+class EnvelopeCrypto:
+    """
+    Версионированный конверт AES-256-GCM: MAGIC | версия | key_id | nonce(12) | шифротекст+тег.
+    Заголовок (MAGIC, версия, key_id) аутентифицируется как associated data.
+    Значения без заголовка (или не прошедшие проверку тега) считаются старым форматом
+    SimpleCrypto (AES-CBC) и расшифровываются legacy-ключом.
+    """
+    MAGIC = b"SRB"
+    VERSION = 1
+    HEADER_SIZE = len(MAGIC) + 2
+    NONCE_SIZE = 12
+
+    def __init__(self, keys: dict[int, bytes], active_key_id: int, legacy: Optional[SimpleCrypto] = None):
+        for key_id, key in keys.items():
+            if not 0 < key_id < 256:
+                raise ValueError(f"key id {key_id} должен быть в диапазоне 1..255")
+            if len(key) != 32:
+                raise ValueError(f"Ключ {key_id} должен быть длиной 32 байта для AES-256")
+        if active_key_id not in keys:
+            raise ValueError(f"Активный ключ {active_key_id} отсутствует в наборе ключей")
+        self.active_key_id = active_key_id
+        self._aeads = {key_id: AESGCM(key) for key_id, key in keys.items()}
+        self.legacy = legacy
+
+    def header(self, key_id: int) -> bytes:
+        return self.MAGIC + bytes((self.VERSION, key_id))
+
+    def key_id_of(self, ciphertext: bytes) -> Optional[int]:
+        """key_id конверта или None для старого формата."""
+        if len(ciphertext) > self.HEADER_SIZE + self.NONCE_SIZE and ciphertext.startswith(self.MAGIC) \
+                and ciphertext[len(self.MAGIC)] == self.VERSION:
+            return ciphertext[len(self.MAGIC) + 1]
+        return None
+
+    def needs_reencrypt(self, ciphertext: bytes) -> bool:
+        return self.key_id_of(ciphertext) != self.active_key_id
+
+    def encrypt(self, plaintext: bytes) -> bytes:
+        header = self.header(self.active_key_id)
+        nonce = os.urandom(self.NONCE_SIZE)
+        return header + nonce + self._aeads[self.active_key_id].encrypt(nonce, plaintext, header)
+
+    def decrypt(self, ciphertext: bytes) -> bytes:
+        ciphertext = bytes(ciphertext)
+        key_id = self.key_id_of(ciphertext)
+        if key_id is not None:
+            aead = self._aeads.get(key_id)
+            if aead is None:
+                raise ValueError(f"Неизвестный key id {key_id}: ключ удален из ENCRYPTION_KEYS?")
+            header, body = ciphertext[:self.HEADER_SIZE], ciphertext[self.HEADER_SIZE:]
+            try:
+                return aead.decrypt(body[:self.NONCE_SIZE], body[self.NONCE_SIZE:], header)
+            except InvalidTag:
+                if self.legacy is None:
+                    raise
+                # Случайный IV старого формата может совпасть с MAGIC - пробуем CBC
+        if self.legacy is None:
+            raise ValueError("Значение в старом формате, а legacy-ключ не настроен")
+        return self.legacy.decrypt(ciphertext)
+
+# --- ИНИЦИАЛИЗАЦИЯ КРИПТО-ОБЪЕКТА ---
+# Ключи берутся из ENCRYPTION_KEYS (если не заданы - MASTER_ENCRYPTION_KEY под key id 1).
+# MASTER_ENCRYPTION_KEY (ровно 32 символа) также служит legacy-ключом для старых CBC-значений.
+# Если ключи неверные, шифрование недоступно и encrypt_data / decrypt_data бросают RuntimeError.
+try:
+    try:
+        _legacy_crypto = SimpleCrypto(MASTER_ENCRYPTION_KEY.encode())
+    except ValueError:
+        _legacy_crypto = None
+    _crypto = EnvelopeCrypto(ENCRYPTION_KEYS, ACTIVE_KEY_ID, legacy=_legacy_crypto)
+    _CRYPTO_AVAILABLE = True
+except ValueError as e:
+    print(f"[ERROR] Ошибка инициализации криптографии: {e}")
+    print("[ERROR] Проверьте ENCRYPTION_KEYS / ACTIVE_KEY_ID и MASTER_ENCRYPTION_KEY в .env.")
+    _crypto = None
+    _CRYPTO_AVAILABLE = False
+# -----------------------------------
+
+def _record_crypto_throughput(op: str, size: int, started: float):
+    metrics.inc("crypto_bytes_total", size, op=op)
+    metrics.inc("crypto_seconds_total", time.perf_counter() - started, op=op)
+
+def encrypt_bytes(data: bytes) -> bytes:
+    """Шифрует байты активным ключом (формат конверта EnvelopeCrypto)."""
+    if not _CRYPTO_AVAILABLE or _crypto is None:
+        raise RuntimeError("Криптография недоступна. Проверьте ENCRYPTION_KEYS.")
+    started = time.perf_counter()
+    ciphertext = _crypto.encrypt(data)
+    _record_crypto_throughput("encrypt", len(data), started)
+    return ciphertext
+
+def encrypt_data(data: str) -> bytes:
+    """Шифрует строку и возвращает байты."""
+    return encrypt_bytes(data.encode('utf-8'))
+
+def needs_reencrypt(encrypted_data: bytes) -> bool:
+    """True, если значение зашифровано не активным ключом (или в старом формате)."""
+    if not _CRYPTO_AVAILABLE or _crypto is None:
+        raise RuntimeError("Криптография недоступна. Проверьте ENCRYPTION_KEYS.")
+    return _crypto.needs_reencrypt(bytes(encrypted_data))
+
+def active_key_header() -> bytes:
+    """Заголовок конверта активного ключа (для фильтрации в SQL)."""
+    return _crypto.header(_crypto.active_key_id)
+
+def _decrypt_uncached(encrypted_data: bytes) -> bytearray:
+    if not _CRYPTO_AVAILABLE or _crypto is None:
+        raise RuntimeError("Криптография недоступна. Проверьте ENCRYPTION_KEYS.")
+    started = time.perf_counter()
+    plaintext = bytearray(_crypto.decrypt(encrypted_data))
+    _record_crypto_throughput("decrypt", len(encrypted_data), started)
+    return plaintext
+
+def decrypt_bytes(encrypted_data: bytes) -> bytes:
+    """Расшифровывает байты без кэша секретов (для больших значений, которые не читаются повторно)."""
+    return bytes(_decrypt_uncached(encrypted_data))
+
+# --- КЭШ РАСШИФРОВАННЫХ СЕКРЕТОВ ---
+# Ключ - keyed BLAKE2b от шифротекста (ключ случайный на процесс, отпечатки не сравнить между запусками),
+# значение - bytearray с открытым текстом, который затирается нулями при любом удалении из кэша.
+# Возвращаемые str неизменяемы и затереть их нельзя, поэтому TTL короткий, а размер жестко ограничен.
+_secret_digest_key = secrets.token_bytes(32)
+_secret_lock = threading.RLock() # Чтение буфера и его затирание не должны пересекаться
+
+def _wipe_secret(_digest: bytes, buffer: bytearray):
+    with _secret_lock:
+        buffer[:] = bytes(len(buffer))
+
+_secret_cache = TTLCache("secrets", maxsize=SECRET_CACHE_SIZE, ttl=SECRET_CACHE_TTL, on_evict=_wipe_secret)
+
+def _secret_digest(encrypted_data: bytes) -> bytes:
+    return hashlib.blake2b(encrypted_data, digest_size=16, key=_secret_digest_key).digest()
+
+def decrypt_data(encrypted_data: bytes) -> str: # <-- ИСПРАВЛЕНО: правильное имя параметра
+    """Расшифровывает байты и возвращает строку."""
+    return decrypt_many([encrypted_data])[0]
+
+def decrypt_many(encrypted_items: list[bytes]) -> list[str]:
+    """
+    Расшифровывает несколько значений за раз; одинаковые шифротексты расшифровываются один раз.
+    _secret_lock держится только на чтение и запись кэша: сама расшифровка идет без него,
+    чтобы промахи кэша в разных потоках не выстраивались в очередь друг за другом.
+    """
+    digests = [_secret_digest(bytes(encrypted_data)) for encrypted_data in encrypted_items]
+    decrypted = {}
+    missing = {}
+    with _secret_lock:
+        for digest, encrypted_data in zip(digests, encrypted_items):
+            if digest in decrypted or digest in missing:
+                continue
+            buffer = _secret_cache.get(digest)
+            if buffer is None:
+                missing[digest] = encrypted_data
+            else:
+                decrypted[digest] = buffer.decode('utf-8')
+    # Свежий буфер принадлежит только этому вызову, пока не попал в кэш, - затереть его некому
+    fresh = {digest: _decrypt_uncached(encrypted_data) for digest, encrypted_data in missing.items()}
+    for digest, buffer in fresh.items():
+        decrypted[digest] = buffer.decode('utf-8')
+    if fresh:
+        with _secret_lock:
+            for digest, buffer in fresh.items():
+                _secret_cache.set(digest, buffer)
+    return [decrypted[digest] for digest in digests]
+
+def purge_secret_cache():
+    """Удаляет (и затирает) истекшие секреты. Без этого они лежат в памяти до следующего обращения."""
+    _secret_cache.purge_expired()
+
+def generate_secure_password(length=12) -> str:
+    """Генерирует безопасный случайный пароль."""
+    alphabet = string.ascii_letters + string.digits
+    return ''.join(secrets.choice(alphabet) for _ in range(length))
+
+def parse_account_id_from_product_name(product_name: str) -> Optional[int]: # <-- ИСПРАВЛЕНО: Аннотация
+    """Парсит ID аккаунта из названия товара FunPay."""
+    import re
+    match = re.search(r'\[ID:(\d+)\]', product_name)
+    if match:
+        return int(match.group(1))
+    return None
+
+# --- ХЕЛПЕРЫ ДЛЯ ПОДПИСКИ ---
+async def is_user_subscribed(owner_tg_id: int) -> bool:
+    """Проверяет, подписан ли пользователь (через кэш владельцев)."""
+    try:
+        return is_snapshot_subscribed(await get_owner_snapshot(owner_tg_id))
+    except Exception:
+        return False
+
+def decrypt_owner_funpay_creds(owner) -> Optional[tuple[str, str]]:
+    """Расшифровывает учетные данные FunPay уже загруженного владельца."""
+    if owner and owner.has_funpay_credentials():
+        user_id, golden_key = decrypt_many([owner.funpay_user_id_encrypted, owner.funpay_golden_key_encrypted])
+        return user_id, golden_key
+    return None
+
+async def get_decrypted_funpay_creds(owner_tg_id: int) -> Optional[tuple[str, str]]:
+    """Получает и расшифровывает учетные данные FunPay владельца (через кэш владельцев и кэш секретов)."""
+    try:
+        encrypted_creds = (await get_owner_snapshot(owner_tg_id))['funpay_creds_encrypted']
+        if not encrypted_creds:
+            return None
+        user_id, golden_key = decrypt_many(list(encrypted_creds))
+        return user_id, golden_key
+    except Exception as e:
+        print(f"Error getting FunPay creds for {owner_tg_id}: {e}")
+        return None
+
+# --- ДЕКОРАТОР ДЛЯ ПРОВЕРКИ FUNPAY CREDENTIALS ---
+def funpay_creds_required(func):
+    async def wrapper(update, context):
+        from bot.utils import get_decrypted_funpay_creds
+        user_id = update.effective_user.id
+        creds = await get_decrypted_funpay_creds(user_id)
+        if not creds:
+            await update.message.reply_text(
+                "⚠️ Учетные данные FunPay не найдены.\n"
+                "Пожалуйста, добавьте их через меню 'Мои аккаунты FunPay'."
+            )
+            return
+        return await func(update, context)
+    return wrapper
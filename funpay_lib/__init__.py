@@ -1,5 +1,5 @@
 from .account import Account
 from .updater.runner import Runner
 from .updater import events
-from .common import exceptions, utils, enums
+from .common import exceptions, utils, enums, ratelimit
 from . import types
@@ -16,20 +16,26 @@ import logging
 import random
 import string
 import json
+import html
 import time
 import re
 
 from . import types
-from .common import exceptions, utils, enums
+from .common import exceptions, utils, enums, ratelimit
 
 logger = logging.getLogger("FunPayAPI.account")
 PRIVATE_CHAT_ID_RE = re.compile(r"users-\d+-\d+$")
+APP_DATA_RE = re.compile(r'<body[^>]*\sdata-app-data="([^"]*)"')
 
 
 class Account:
     """
     Класс для управления аккаунтом FunPay.
 
+    Чтобы все экземпляры использовали одни и те же категории, присвойте :py:obj:`.Account.category_catalog`
+    объект с методом ``get(build)``, который возвращает сохраненный результат
+    :meth:`FunPayAPI.account.Account.parse_categories` или вызывает ``build()``.
+
     :param golden_key: токен (golden_key) аккаунта.
     :type golden_key: :obj:`str`
 
@@ -44,11 +50,18 @@ class Account:
 
     :param locale: текущий язык аккаунта, опционально.
     :type locale: :obj:`Literal["ru", "en", "uk"]` or :obj:`None`
+
+    :param rate_limiter: ограничитель частоты запросов (может быть общим для нескольких аккаунтов), опционально.
+    :type rate_limiter: :class:`FunPayAPI.common.ratelimit.RateLimiter` or :obj:`None`
     """
 
+    category_catalog = None
+    """Общий каталог категорий (см. описание класса) или None - тогда каждый экземпляр парсит категории сам."""
+
     def __init__(self, golden_key: str, user_agent: str | None = None,
                  requests_timeout: int | float = 10, proxy: Optional[dict] = None,
-                 locale: Literal["ru", "en", "uk"] | None = None):
+                 locale: Literal["ru", "en", "uk"] | None = None,
+                 rate_limiter: ratelimit.RateLimiter | None = None):
         self.golden_key: str = golden_key
         """Токен (golden_key) аккаунта."""
         self.user_agent: str | None = user_agent
@@ -75,6 +88,10 @@ class Account:
         """Время последнего возникновения ошибки \"Нельзя отправлять сообщения слишком часто.\""""
         self.last_multiuser_flood_err_time: float = 0
         """Время последнего возникновения ошибки \"Нельзя слишком часто отправлять сообщения разным пользователям.\""""
+        self.rate_limiter: ratelimit.RateLimiter | None = rate_limiter
+        """Ограничитель частоты запросов."""
+        self.__last_sent_chat_id: int | str | None = None
+        """ID чата, в который было отправлено последнее сообщение."""
         self.__locale: Literal["ru", "en", "uk"] | None = None
         """Текущий язык аккаунта."""
         self.__default_locale: Literal["ru", "en", "uk"] | None = locale
@@ -130,7 +147,8 @@ class Account:
 
     def method(self, request_method: Literal["post", "get"], api_method: str, headers: dict, payload: Any,
                exclude_phpsessid: bool = False, raise_not_200: bool = False,
-               locale: Literal["ru", "en", "uk"] | None = None) -> requests.Response:
+               locale: Literal["ru", "en", "uk"] | None = None,
+               endpoint_class: str | None = None) -> requests.Response:
         """
         Отправляет запрос к FunPay. Добавляет в заголовки запроса user_agent и куки.
 
@@ -152,6 +170,10 @@ class Account:
         :param raise_not_200: возбуждать ли исключение, если статус код ответа != 200?
         :type raise_not_200: :obj:`bool`
 
+        :param endpoint_class: класс запроса для :py:obj:`.Account.rate_limiter`
+            (по умолчанию runner для runner/ и page для остального).
+        :type endpoint_class: :obj:`str` or :obj:`None`
+
         :return: объект ответа.
         :rtype: :class:`requests.Response`
         """
@@ -187,6 +209,10 @@ class Account:
         locale = locale or self.__set_locale
         if request_method == "get" and locale and locale != self.locale:
             link += f'{"&" if "?" in link else "?"}setlocale={locale}'
+        if not endpoint_class:
+            endpoint_class = ratelimit.RUNNER if "runner/" in link else ratelimit.PAGE
+        if self.rate_limiter:
+            self.rate_limiter.acquire(self, endpoint_class)
         for i in range(10):
             response = getattr(requests, request_method)(link, headers=headers, data=payload,
                                                          timeout=self.requests_timeout,
@@ -201,6 +227,8 @@ class Account:
                                                          proxies=self.proxy or {})
         if response.status_code == 429:
             self.last_429_err_time = time.time()
+            if self.rate_limiter:
+                self.rate_limiter.penalize(self, endpoint_class, "429")
 
         if response.status_code == 403:
             raise exceptions.UnauthorizedError(response)
@@ -258,6 +286,29 @@ class Account:
         self.__initiated = True
         return self
 
+    def refresh_session(self) -> Account:
+        """
+        Облегченное обновление :py:obj:`.Account.phpsessid` и :py:obj:`.Account.csrf_token` для уже
+        инициализированного аккаунта. В отличие от :meth:`FunPayAPI.account.Account.get` не строит DOM страницы:
+        из HTML регулярным выражением извлекается только data-app-data, баланс, счетчики и категории не обновляются.
+
+        :return: объект аккаунта с обновленной сессией.
+        :rtype: :class:`FunPayAPI.account.Account`
+        """
+        if not self.is_initiated:
+            raise exceptions.AccountNotInitiatedError()
+        response = self.method("get", "https://funpay.com/", {}, {}, True, raise_not_200=True)
+        html_response = response.content.decode()
+        app_data = APP_DATA_RE.search(html_response)
+        if not app_data or 'class="user-link-name"' not in html_response:
+            raise exceptions.UnauthorizedError(response)
+        self.app_data = json.loads(html.unescape(app_data.group(1)))
+        self.__locale = self.app_data.get("locale")
+        self.csrf_token = self.app_data["csrf-token"]
+        self.phpsessid = response.cookies.get_dict().get("PHPSESSID", self.phpsessid)
+        self.last_update = int(time.time())
+        return self
+
     def get_subcategory_public_lots(self, subcategory_type: enums.SubCategoryTypes, subcategory_id: int,
                                     locale: Literal["ru", "en", "uk"] | None = None) -> list[types.LotShortcut]:
         """
@@ -712,7 +763,10 @@ class Account:
             "csrf_token": self.csrf_token
         }
 
-        response = self.method("post", "runner/", headers, payload, raise_not_200=True)
+        if self.rate_limiter and chat_id != self.__last_sent_chat_id:
+            self.rate_limiter.acquire(self, ratelimit.MULTI_USER_SEND)
+        response = self.method("post", "runner/", headers, payload, raise_not_200=True,
+                               endpoint_class=ratelimit.CHAT_SEND)
         json_response = response.json()
         if not (resp := json_response.get("response")):
             raise exceptions.MessageNotDeliveredError(response, None, chat_id)
@@ -722,11 +776,16 @@ class Account:
                               "You cannot send messages too frequently.",
                               "Не можна надсилати повідомлення занадто часто."):
                 self.last_flood_err_time = time.time()
+                if self.rate_limiter:
+                    self.rate_limiter.penalize(self, ratelimit.CHAT_SEND)
             elif error_text in ("Нельзя слишком часто отправлять сообщения разным пользователям.",
                                 "Не можна надто часто надсилати повідомлення різним користувачам.",
                                 "You cannot message multiple users too frequently."):
                 self.last_multiuser_flood_err_time = time.time()
+                if self.rate_limiter:
+                    self.rate_limiter.penalize(self, ratelimit.MULTI_USER_SEND)
             raise exceptions.MessageNotDeliveredError(response, error_text, chat_id)
+        self.__last_sent_chat_id = chat_id
         if leave_as_unread:
             message_text = text
             fake_html = f"""
@@ -1919,18 +1978,47 @@ class Account:
     def __setup_categories(self, html: str):
         """
         Парсит категории и подкатегории с основной страницы и добавляет их в свойства класса.
+        Если задан :py:obj:`.Account.category_catalog`, структуры берутся из общего каталога
+        (и парсятся, только если каталог пуст или устарел).
 
         :param html: HTML страница.
         """
+        if self.category_catalog is not None:
+            catalog = self.category_catalog.get(lambda: self.parse_categories(html))
+        else:
+            catalog = self.parse_categories(html)
+        (self.__categories, self.__sorted_categories,
+         self.__subcategories, self.__sorted_subcategories) = catalog
+
+    @staticmethod
+    def parse_categories(html: str) -> tuple[list[types.Category], dict[int, types.Category],
+                                             list[types.SubCategory],
+                                             dict[types.SubCategoryTypes, dict[int, types.SubCategory]]]:
+        """
+        Парсит категории и подкатегории с основной страницы.
+
+        :param html: HTML страница.
+
+        :return: (категории, {id: категория}, подкатегории, {тип: {id: подкатегория}}).
+        """
+        categories: list[types.Category] = []
+        sorted_categories: dict[int, types.Category] = {}
+        subcategories_list: list[types.SubCategory] = []
+        sorted_subcategories: dict[types.SubCategoryTypes, dict[int, types.SubCategory]] = {
+            types.SubCategoryTypes.COMMON: {},
+            types.SubCategoryTypes.CURRENCY: {}
+        }
+        result = (categories, sorted_categories, subcategories_list, sorted_subcategories)
+
         parser = BeautifulSoup(html, "lxml")
         games_table = parser.find_all("div", {"class": "promo-game-list"})
         if not games_table:
-            return
+            return result
 
         games_table = games_table[1] if len(games_table) > 1 else games_table[0]
         games_divs = games_table.find_all("div", {"class": "promo-game-item"})
         if not games_divs:
-            return
+            return result
         game_position = 0
         subcategory_position = 0
         for i in games_divs:
@@ -1959,12 +2047,13 @@ class Account:
                     sobj = types.SubCategory(sid, name, stype, regional_games[j_game_id], subcategory_position)
                     subcategory_position += 1
                     regional_games[j_game_id].add_subcategory(sobj)
-                    self.__subcategories.append(sobj)
-                    self.__sorted_subcategories[stype][sid] = sobj
+                    subcategories_list.append(sobj)
+                    sorted_subcategories[stype][sid] = sobj
 
             for gid in regional_games:
-                self.__categories.append(regional_games[gid])
-                self.__sorted_categories[gid] = regional_games[gid]
+                categories.append(regional_games[gid])
+                sorted_categories[gid] = regional_games[gid]
+        return result
 
     def __parse_messages(self, json_messages: dict, chat_id: int | str,
                          interlocutor_id: Optional[int] = None, interlocutor_username: Optional[str] = None,
@@ -0,0 +1,162 @@
+"""
+В данном модуле описан ограничитель частоты запросов к FunPay (token bucket).
+
+Ограничения задаются по классам запросов (см. :class:`RateLimiter`): отдельно для каждого аккаунта
+и общие для всех аккаунтов, работающих через один прокси / IP.
+"""
+from __future__ import annotations
+
+import asyncio
+import json
+import threading
+import time
+import weakref
+from typing import Callable, Optional
+
+PAGE = "page"
+"""Загрузка страниц (GET)."""
+RUNNER = "runner"
+"""Запросы к runner/ (опрос обновлений, списки чатов)."""
+CHAT_SEND = "chat_send"
+"""Отправка сообщения в чат."""
+MULTI_USER_SEND = "multi_user_send"
+"""Отправка сообщения в чат, отличный от предыдущего (ограничение FunPay на сообщения разным пользователям)."""
+PROXY = "proxy"
+"""Общий бюджет всех запросов через один прокси / IP."""
+
+DEFAULT_LIMITS: dict[str, tuple[float, float]] = {
+    PAGE: (1.0, 3),
+    RUNNER: (1.0, 2),
+    CHAT_SEND: (0.5, 2),
+    MULTI_USER_SEND: (0.2, 2),
+    PROXY: (4.0, 8),
+}
+"""{класс запроса: (токенов в секунду, емкость)}."""
+
+DEFAULT_COOLDOWNS: dict[str, float] = {
+    "429": 30.0,
+    CHAT_SEND: 10.0,
+    MULTI_USER_SEND: 30.0,
+}
+"""Пауза (сек.) после отказа FunPay: 429, "слишком часто" и "слишком часто разным пользователям"."""
+
+
+class TokenBucket:
+    """
+    Потокобезопасное ведро токенов с резервированием: токены могут уходить в минус,
+    тогда вызывающий ждет, пока его токен накопится. Так ожидающие обслуживаются по очереди.
+
+    :param rate: скорость пополнения (токенов в секунду).
+    :param capacity: максимальное количество накопленных токенов (размер всплеска).
+    """
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self) -> float:
+        """
+        Резервирует токен.
+
+        :return: сколько секунд нужно подождать перед запросом.
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            self.tokens -= 1
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0.0
+            return max(wait, self.blocked_until - now)
+
+    def penalize(self, seconds: float):
+        """Блокирует ведро на seconds секунд и сжигает накопленные токены (после отказа FunPay)."""
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            self.blocked_until = max(self.blocked_until, now + seconds)
+            self.tokens = min(self.tokens, 0)
+
+
+class RateLimiter:
+    """
+    Ограничитель запросов для :class:`FunPayAPI.account.Account`. Для каждого аккаунта хранятся
+    ведра по классам запросов, для каждого прокси - общее ведро :data:`PROXY`.
+
+    :param limits: {класс запроса: (токенов в секунду, емкость)}, дополняет :data:`DEFAULT_LIMITS`.
+    :param cooldowns: паузы после отказов, дополняет :data:`DEFAULT_COOLDOWNS`.
+    :param on_wait: вызывается как on_wait(класс запроса, секунды) перед каждым ожиданием.
+    """
+
+    def __init__(self, limits: Optional[dict[str, tuple[float, float]]] = None,
+                 cooldowns: Optional[dict[str, float]] = None,
+                 on_wait: Optional[Callable[[str, float], None]] = None):
+        self.limits = {**DEFAULT_LIMITS, **(limits or {})}
+        self.cooldowns = {**DEFAULT_COOLDOWNS, **(cooldowns or {})}
+        self.on_wait = on_wait
+        self._account_buckets: weakref.WeakKeyDictionary = weakref.WeakKeyDictionary()
+        self._proxy_buckets: dict[str, TokenBucket] = {}
+        self._lock = threading.Lock()
+
+    def _new_bucket(self, endpoint_class: str) -> TokenBucket:
+        rate, capacity = self.limits[endpoint_class]
+        return TokenBucket(rate, capacity)
+
+    def _buckets(self, account, endpoint_class: str) -> list[tuple[str, TokenBucket]]:
+        proxy_key = json.dumps(account.proxy or {}, sort_keys=True)
+        with self._lock:
+            account_buckets = self._account_buckets.setdefault(account, {})
+            bucket = account_buckets.get(endpoint_class)
+            if bucket is None:
+                bucket = account_buckets[endpoint_class] = self._new_bucket(endpoint_class)
+            proxy_bucket = self._proxy_buckets.get(proxy_key)
+            if proxy_bucket is None:
+                proxy_bucket = self._proxy_buckets[proxy_key] = self._new_bucket(PROXY)
+        return [(endpoint_class, bucket), (PROXY, proxy_bucket)]
+
+    def _reserve(self, account, endpoint_class: str) -> float:
+        wait = 0.0
+        for name, bucket in self._buckets(account, endpoint_class):
+            bucket_wait = bucket.reserve()
+            if bucket_wait > wait:
+                wait = bucket_wait
+        if wait > 0 and self.on_wait:
+            self.on_wait(endpoint_class, wait)
+        return wait
+
+    def acquire(self, account, endpoint_class: str):
+        """Блокирующе ждет разрешения на запрос класса endpoint_class."""
+        wait = self._reserve(account, endpoint_class)
+        if wait > 0:
+            time.sleep(wait)
+
+    async def acquire_async(self, account, endpoint_class: str):
+        """То же, что :meth:`acquire`, но без блокировки event loop."""
+        wait = self._reserve(account, endpoint_class)
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+    def penalize(self, account, endpoint_class: str, reason: Optional[str] = None):
+        """
+        Ставит паузу после отказа FunPay.
+
+        :param endpoint_class: класс запроса, ведро которого блокируется.
+        :param reason: ключ :py:obj:`cooldowns` (по умолчанию - endpoint_class).
+        """
+        seconds = self.cooldowns.get(reason or endpoint_class, 0)
+        if seconds:
+            for name, bucket in self._buckets(account, endpoint_class):
+                if name == endpoint_class:
+                    bucket.penalize(seconds)
+
+    def cooldown_left(self, account, endpoint_class: str) -> float:
+        """Сколько секунд осталось до снятия паузы с класса запросов аккаунта."""
+        with self._lock:
+            bucket = self._account_buckets.get(account, {}).get(endpoint_class)
+        return max(0.0, bucket.blocked_until - time.monotonic()) if bucket else 0.0
@@ -0,0 +1,81 @@
+# tests/conftest.py
+# Общие настройки тестов.
+# - bot.config требует TELEGRAM_BOT_TOKEN и MASTER_ENCRYPTION_KEY при импорте - подставляем тестовые значения.
+# - Тесты с маркером postgres работают с настоящим Postgres и запускаются, только если задан TEST_DB_NAME
+#   (а также TEST_DB_HOST / TEST_DB_PORT / TEST_DB_USER / TEST_DB_PASS). Схема этой базы пересоздается
+#   при каждом запуске - не указывайте рабочую базу.
+# - Маркер slow - долгие тесты (сидинг больших наборов данных), benchmark - микробенчмарки с бюджетом.
+#   Пропустить их: pytest -m "not slow and not benchmark".
+import os
+import sys
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+os.environ.setdefault("TELEGRAM_BOT_TOKEN", "123456:TEST")
+os.environ.setdefault("MASTER_ENCRYPTION_KEY", "test-master-key-0123456789abcdefghij")
+os.environ.setdefault("TRANSACTIONS_ARCHIVE_DIR", os.path.join(ROOT, ".pytest_cache", "archive"))
+POSTGRES_AVAILABLE = bool(os.environ.get("TEST_DB_NAME"))
+if POSTGRES_AVAILABLE:
+    for name in ("HOST", "PORT", "USER", "PASS", "NAME"):
+        if os.environ.get(f"TEST_DB_{name}"):
+            os.environ[f"DB_{name}"] = os.environ[f"TEST_DB_{name}"]
+
+# Таблицы, которые очищаются между тестами (порядок не важен - TRUNCATE ... CASCADE)
+TABLES = ("owners", "funpay_accounts", "accounts", "transactions", "transaction_external_ids", "revenue_rollups",
+          "notification_outbox", "bot_user_state", "yookassa_inbox", "scheduler_leases")
+
+def pytest_configure(config):
+    config.addinivalue_line("markers", "postgres: тест работает с Postgres из TEST_DB_*")
+    config.addinivalue_line("markers", "slow: долгий тест (большой набор данных)")
+    config.addinivalue_line("markers", "benchmark: микробенчмарк с бюджетом времени")
+
+def pytest_collection_modifyitems(config, items):
+    if POSTGRES_AVAILABLE:
+        return
+    skip = pytest.mark.skip(reason="TEST_DB_NAME не задан - тесты с Postgres пропущены")
+    for item in items:
+        if "postgres" in item.keywords:
+            item.add_marker(skip)
+
+@pytest.fixture(scope="session")
+def pg_engine():
+    """Синхронный движок приложения на тестовой базе со свежей схемой (все миграции)."""
+    pytest.importorskip("sqlalchemy")
+    pytest.importorskip("psycopg2")
+    from sqlalchemy import text
+    from bot.database import engine
+    from bot.migrations import upgrade
+    with engine.begin() as conn:
+        conn.execute(text("DROP SCHEMA public CASCADE"))
+        conn.execute(text("CREATE SCHEMA public"))
+    upgrade()
+    yield engine
+    engine.dispose()
+
+@pytest.fixture
+def db(pg_engine):
+    """Пустые таблицы перед тестом; счетчики global_counters обнуляются (TRUNCATE не вызывает триггеры)."""
+    from sqlalchemy import text
+    with pg_engine.begin() as conn:
+        conn.execute(text(f"TRUNCATE {', '.join(TABLES)} CASCADE"))
+        conn.execute(text("UPDATE global_counters SET value = 0"))
+    return pg_engine
+
+@pytest.fixture
+def owner_factory(db):
+    """Создает владельца с заданным балансом; возвращает tg_id."""
+    from sqlalchemy import text
+    counter = iter(range(1, 1_000_000))
+
+    def create(balance="0", tg_id=None, **columns) -> int:
+        tg_id = tg_id or 10_000 + next(counter)
+        with db.begin() as conn:
+            conn.execute(text(
+                "INSERT INTO owners (tg_id, is_active, balance, subscription_end) "
+                "VALUES (:tg_id, true, :balance, :subscription_end)"
+            ), {"tg_id": tg_id, "balance": balance, "subscription_end": columns.get("subscription_end")})
+        return tg_id
+    return create
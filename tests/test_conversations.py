@@ -0,0 +1,80 @@
+# tests/test_conversations.py
+# Пошаговые диалоги (bot/conversations.py): переходы шагов, истечение по TTL и микробенчмарк dispatch.
+import asyncio
+import time
+from types import SimpleNamespace
+import pytest
+
+pytest.importorskip("dotenv")
+
+def _update(text: str):
+    return SimpleNamespace(message=SimpleNamespace(text=text))
+
+@pytest.fixture
+def machine():
+    from bot.conversations import ConversationMachine
+    machine = ConversationMachine(ttl=60)
+
+    @machine.step('add', 'name')
+    async def name_step(update, context, conversation, text):
+        conversation.data['name'] = text
+        return 'price'
+
+    @machine.step('add', 'price')
+    async def price_step(update, context, conversation, text):
+        if not text.isdigit():
+            return conversation.step
+        context.user_data['added'] = (conversation.data['name'], int(text))
+        return None
+    return machine
+
+def test_steps_advance_and_finish(machine):
+    context = SimpleNamespace(user_data={})
+    machine.start(context, 'add', 'name')
+
+    async def run():
+        assert await machine.dispatch(_update(" acc "), context)
+        assert machine.get(context).step == 'price'
+        assert await machine.dispatch(_update("abc"), context)
+        assert machine.get(context).step == 'price'
+        assert await machine.dispatch(_update("15"), context)
+        assert not await machine.dispatch(_update("lost"), context)
+    asyncio.run(run())
+    assert context.user_data == {'added': ('acc', 15)}
+
+def test_expired_conversation_is_dropped(machine, monkeypatch):
+    from bot import conversations
+    context = SimpleNamespace(user_data={})
+    machine.start(context, 'add', 'name')
+    now = time.time()
+    monkeypatch.setattr(conversations.time, "time", lambda: now + 61)
+    assert not asyncio.run(machine.dispatch(_update("acc"), context))
+    assert conversations.USER_DATA_KEY not in context.user_data
+
+@pytest.mark.benchmark
+def test_dispatch_benchmark():
+    """Микробенчмарк: 50 диалогов по 4 шага, пользователи на разных шагах, один event loop."""
+    from bot.conversations import ConversationMachine
+    machine = ConversationMachine(ttl=600)
+    steps = ('a', 'b', 'c', 'd')
+    for flow in range(50):
+        for n, step in enumerate(steps):
+            async def handler(update, context, conversation, text, _next=steps[(n + 1) % len(steps)]):
+                return _next
+            machine.step(f"flow_{flow}", step)(handler)
+    contexts = [SimpleNamespace(user_data={}) for _ in range(200)]
+    for n, context in enumerate(contexts):
+        machine.start(context, f"flow_{n % 50}", steps[n % len(steps)])
+    update = _update("text")
+    rounds = 100
+
+    async def run():
+        started = time.perf_counter()
+        for _ in range(rounds):
+            for context in contexts:
+                await machine.dispatch(update, context)
+        return time.perf_counter() - started
+    elapsed = asyncio.run(run())
+    calls = rounds * len(contexts)
+    print(f"\nConversationMachine.dispatch: {calls / elapsed:.0f} вызовов/с ({elapsed / calls * 1e6:.2f} мкс/вызов)")
+    assert elapsed / calls < 100e-6
@@ -0,0 +1,34 @@
+# tests/test_leases.py
+# Аренды задач планировщика (bot/leases.py): сроки считаются по часам БД, а не реплики.
+from datetime import timedelta
+import pytest
+
+pytestmark = pytest.mark.postgres
+
+@pytest.fixture
+def leases(pg_engine):
+    from sqlalchemy import text
+    from bot import leases
+    with pg_engine.begin() as conn:
+        conn.execute(text("TRUNCATE scheduler_leases"))
+    return leases
+
+def test_lease_is_exclusive_until_released(leases):
+    assert leases.try_acquire("job", timedelta(0), ttl=60)
+    assert not leases.try_acquire("job", timedelta(0), ttl=60)
+    assert leases.renew("job", ttl=60)
+    leases.release("job")
+    assert leases.try_acquire("job", timedelta(0), ttl=60)
+
+def test_interval_is_measured_by_db_clock(leases, pg_engine):
+    from sqlalchemy import text
+    assert leases.try_acquire("job", timedelta(hours=1), ttl=60)
+    leases.release("job")
+    assert not leases.try_acquire("job", timedelta(hours=1), ttl=60)
+    with pg_engine.begin() as conn:
+        last_started, lease_until, db_now = conn.execute(text(
+            "SELECT last_started_at, lease_until, now() AT TIME ZONE 'utc' FROM scheduler_leases"
+        )).one()
+    # Сроки записаны в UTC по часам БД
+    assert abs((db_now - last_started).total_seconds()) < 60
+    assert lease_until <= db_now
@@ -0,0 +1,87 @@
+# tests/test_ledger.py
+# Стресс-тест атомарных изменений баланса (bot/ledger.py) на Postgres: параллельные пополнения
+# (синхронные сессии в потоках) и покупки подписки (асинхронные сессии) одного владельца.
+# Ни одно изменение не должно потеряться, баланс не уходит в минус, на каждое изменение - одна транзакция.
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from decimal import Decimal
+import pytest
+
+pytestmark = pytest.mark.postgres
+
+CREDITS = 200
+CREDIT_AMOUNT = Decimal("10.00")
+PURCHASES = 120
+PRICE = Decimal("30.00")
+CREDIT_THREADS = 8
+PURCHASE_CONCURRENCY = 16
+
+def _credit(tg_id: int):
+    from bot.database import session_scope
+    from bot.ledger import credit_balance
+    with session_scope() as db:
+        assert credit_balance(db, tg_id, CREDIT_AMOUNT) is not None
+        db.commit()
+
+async def _purchase(tg_id: int, semaphore: asyncio.Semaphore) -> bool:
+    from bot.database import async_session_scope
+    from bot.ledger import purchase_subscription
+    async with semaphore:
+        async with async_session_scope() as session:
+            purchase = await purchase_subscription(session, tg_id, PRICE, 1)
+            if purchase is None:
+                return False
+            balance, _ = purchase
+            assert balance >= 0
+            await session.commit()
+            return True
+
+def _run_purchases(tg_id: int, start: threading.Event) -> int:
+    from bot.database import dispose_async_engine
+
+    async def run():
+        semaphore = asyncio.Semaphore(PURCHASE_CONCURRENCY)
+        start.wait()
+        try:
+            results = await asyncio.gather(*(_purchase(tg_id, semaphore) for _ in range(PURCHASES)))
+        finally:
+            await dispose_async_engine()
+        return sum(results)
+    return asyncio.run(run())
+
+def test_parallel_credits_and_purchases(db, owner_factory):
+    from sqlalchemy import text
+    tg_id = owner_factory(balance="0")
+    started_at = datetime.utcnow()
+    start = threading.Event()
+    with ThreadPoolExecutor(CREDIT_THREADS + 1) as pool:
+        purchases = pool.submit(_run_purchases, tg_id, start)
+        credits = [pool.submit(_credit, tg_id) for _ in range(CREDITS)]
+        start.set()
+        for future in credits:
+            future.result()
+        succeeded = purchases.result()
+
+    with db.connect() as conn:
+        balance, subscription_end = conn.execute(text(
+            "SELECT balance, subscription_end FROM owners WHERE tg_id = :tg_id"
+        ), {"tg_id": tg_id}).one()
+        counts = dict(conn.execute(text(
+            "SELECT transaction_type, count(*) FROM transactions WHERE owner_tg_id = :tg_id GROUP BY 1"
+        ), {"tg_id": tg_id}).all())
+        amounts = dict(conn.execute(text(
+            "SELECT transaction_type, sum(amount) FROM transactions WHERE owner_tg_id = :tg_id GROUP BY 1"
+        ), {"tg_id": tg_id}).all())
+
+    assert succeeded <= CREDITS * CREDIT_AMOUNT // PRICE
+    assert balance == CREDITS * CREDIT_AMOUNT - succeeded * PRICE
+    assert balance >= 0
+    assert counts.get("topup") == CREDITS
+    assert counts.get("subscription", 0) == succeeded
+    assert amounts["topup"] - amounts.get("subscription", 0) == balance
+    if succeeded:
+        # Каждая покупка продлила подписку ровно на день
+        assert started_at + timedelta(days=succeeded) <= subscription_end
+        assert subscription_end <= datetime.utcnow() + timedelta(days=succeeded)
@@ -0,0 +1,29 @@
+# tests/test_metrics.py
+# /metrics процессов без веб-сервера (RUN_MODE=bot, worker, scheduler): встроенный HTTP-сервер bot.metrics.
+import socket
+import urllib.error
+import urllib.request
+import pytest
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+def test_http_server_exposes_metrics():
+    from bot import metrics
+    port = _free_port()
+    server = metrics.start_http_server(port, host="127.0.0.1")
+    try:
+        metrics.inc("test_metrics_http_total", route="menu")
+        metrics.observe("test_metrics_http_seconds", 0.02)
+        with urllib.request.urlopen(f"http://127.0.0.1:{port}/metrics", timeout=5) as response:
+            body = response.read().decode()
+        assert 'test_metrics_http_total{route="menu"} 1' in body
+        assert "test_metrics_http_seconds_count 1" in body
+        with pytest.raises(urllib.error.HTTPError) as error:
+            urllib.request.urlopen(f"http://127.0.0.1:{port}/other", timeout=5)
+        assert error.value.code == 404
+    finally:
+        server.shutdown()
+        server.server_close()
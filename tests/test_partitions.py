@@ -0,0 +1,94 @@
+# tests/test_partitions.py
+# Архивирование старых партиций transactions: DETACH при существующей DEFAULT партиции, выгрузка
+# с проверкой до DROP, дочистка таблиц, отсоединенных прерванным прошлым запуском, и чтение
+# архивных месяцев вместе с живыми партициями.
+import csv
+import gzip
+from datetime import datetime, timedelta
+import pytest
+
+pytestmark = pytest.mark.postgres
+
+NOW = datetime(2026, 6, 15)
+OLD_MONTH = datetime(2024, 1, 1)
+
+@pytest.fixture
+def old_partition(db, owner_factory):
+    from sqlalchemy import text
+    from bot.partitions import create_partition_sql, partition_name
+    tg_id = owner_factory()
+    with db.begin() as conn:
+        conn.execute(text(create_partition_sql(OLD_MONTH)))
+        for n in range(5):
+            conn.execute(text(
+                "INSERT INTO transactions (id, owner_tg_id, transaction_type, external_id, timestamp, amount, status) "
+                "VALUES (:id, :tg_id, 'topup', :external_id, :ts, 10, 'completed')"
+            ), {"id": f"old-{n}", "tg_id": tg_id, "external_id": f"old-order-{n}",
+                "ts": OLD_MONTH + timedelta(days=n)})
+    yield partition_name(OLD_MONTH)
+    with db.begin() as conn:
+        conn.execute(text(f"DROP TABLE IF EXISTS {partition_name(OLD_MONTH)}"))
+
+def _table_exists(engine, name: str) -> bool:
+    from sqlalchemy import text
+    with engine.connect() as conn:
+        return conn.execute(text("SELECT to_regclass(:name)"), {"name": name}).scalar() is not None
+
+def _archived_ids(path: str) -> list[str]:
+    with gzip.open(path, "rt", newline="", encoding="utf-8") as archive:
+        return [row["id"] for row in csv.DictReader(archive)]
+
+def test_archive_detaches_exports_and_drops(db, old_partition, tmp_path):
+    from sqlalchemy import text
+    from bot.partitions import archive_old_partitions
+    archived = archive_old_partitions(retention_months=12, archive_dir=str(tmp_path), now=NOW)
+    assert len(archived) == 1
+    assert sorted(_archived_ids(archived[0])) == [f"old-{n}" for n in range(5)]
+    assert not _table_exists(db, old_partition)
+    # Ключи дедупликации архивного месяца остаются
+    with db.connect() as conn:
+        assert conn.execute(text(
+            "SELECT count(*) FROM transaction_external_ids WHERE external_id LIKE 'old-order-%'"
+        )).scalar() == 5
+
+def test_archive_finishes_leftover_detached_partition(db, old_partition, tmp_path):
+    from sqlalchemy import text
+    from bot.partitions import archive_old_partitions, list_partitions
+    # Прошлый запуск успел только отсоединить партицию
+    with db.begin() as conn:
+        conn.execute(text(f"ALTER TABLE transactions DETACH PARTITION {old_partition}"))
+    with db.connect() as conn:
+        assert OLD_MONTH not in list_partitions(conn)
+    archived = archive_old_partitions(retention_months=12, archive_dir=str(tmp_path), now=NOW)
+    assert len(archived) == 1
+    assert len(_archived_ids(archived[0])) == 5
+    assert not _table_exists(db, old_partition)
+
+def test_failed_export_keeps_table(db, old_partition, tmp_path, monkeypatch):
+    from bot import partitions
+
+    def broken_export(raw_connection, month, path):
+        raise RuntimeError("диск заполнен")
+    monkeypatch.setattr(partitions, "_export_partition", broken_export)
+    assert partitions.archive_old_partitions(retention_months=12, archive_dir=str(tmp_path), now=NOW) == []
+    assert _table_exists(db, old_partition)
+    with db.connect() as conn:
+        assert partitions.list_detached_partitions(conn) == [OLD_MONTH]
+
+def test_iter_transactions_merges_archive_and_live(db, old_partition, tmp_path):
+    from sqlalchemy import text
+    from bot.partitions import archive_old_partitions, iter_transactions
+    with db.connect() as conn:
+        tg_id = conn.execute(text("SELECT owner_tg_id FROM transactions WHERE id = 'old-0'")).scalar()
+    live_ts = datetime.utcnow() - timedelta(minutes=1)
+    with db.begin() as conn:
+        conn.execute(text(
+            "INSERT INTO transactions (id, owner_tg_id, transaction_type, timestamp, amount, status) "
+            "VALUES ('live-0', :tg_id, 'topup', :ts, 10, 'completed')"
+        ), {"tg_id": tg_id, "ts": live_ts})
+    archive_old_partitions(retention_months=12, archive_dir=str(tmp_path), now=NOW)
+    rows = list(iter_transactions(tg_id, OLD_MONTH + timedelta(days=1), live_ts + timedelta(seconds=1),
+                                  archive_dir=str(tmp_path)))
+    assert [row["id"] for row in rows] == ["old-1", "old-2", "old-3", "old-4", "live-0"]
+    assert rows[0]["external_id"] == "old-order-1"
+    assert rows[0]["timestamp"] == OLD_MONTH + timedelta(days=1)
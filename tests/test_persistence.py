@@ -0,0 +1,102 @@
+# tests/test_persistence.py
+# Сохранение user_data: неизменившиеся данные не пишутся, но строка активного пользователя
+# переписывается до того, как purge_expired_user_state сочтет ее устаревшей; реплики бота видят
+# записи друг друга через refresh_user_data.
+import asyncio
+from datetime import datetime, timedelta
+import pytest
+
+for module in ("telegram", "dotenv", "sqlalchemy", "psycopg2", "cryptography"):
+    pytest.importorskip(module)
+
+TTL = 3600
+
+@pytest.fixture
+def persistence(monkeypatch):
+    from bot.persistence import PostgresPersistence, _fingerprint
+    persistence = PostgresPersistence(user_ttl=TTL)
+    written = []
+
+    async def fake_write_pending():
+        pending, persistence._pending = persistence._pending, {}
+        now = datetime.utcnow()
+        for user_id, payload in pending.items():
+            written.append(user_id)
+            persistence._written[user_id] = _fingerprint(payload)
+            persistence._written_at[user_id] = now
+    monkeypatch.setattr(persistence, "_write_pending", fake_write_pending)
+    persistence.written = written
+    return persistence
+
+def test_unchanged_data_is_skipped_until_half_ttl(persistence):
+    async def scenario():
+        await persistence.update_user_data(1, {"menu": "main"})
+        await persistence.flush()
+        await persistence.update_user_data(1, {"menu": "main"})
+        await persistence.flush()
+        assert persistence.written == [1]
+        # Строка записана давно - ее нужно переписать, иначе purge удалит состояние активного пользователя
+        persistence._written_at[1] = datetime.utcnow() - timedelta(seconds=TTL / 2 + 1)
+        await persistence.update_user_data(1, {"menu": "main"})
+        await persistence.flush()
+        assert persistence.written == [1, 1]
+    asyncio.run(scenario())
+
+@pytest.mark.postgres
+def test_active_user_survives_purge(db, monkeypatch):
+    from sqlalchemy import text
+    from bot import scheduler
+    from bot.persistence import PostgresPersistence
+
+    async def scenario():
+        persistence = PostgresPersistence(user_ttl=TTL)
+        await persistence.update_user_data(7, {"menu": "main"})
+        await persistence.flush()
+        # Состояние не менялось почти весь TTL
+        with db.begin() as conn:
+            conn.execute(text("UPDATE bot_user_state SET updated_at = :old"),
+                         {"old": datetime.utcnow() - timedelta(seconds=TTL - 60)})
+        await persistence.get_user_data()
+        await persistence.update_user_data(7, {"menu": "main"})
+        await persistence.flush()
+        monkeypatch.setattr(scheduler, "PERSISTENCE_USER_TTL", TTL)
+        await scheduler.purge_expired_user_state()
+    asyncio.run(scenario())
+    with db.connect() as conn:
+        assert conn.execute(text("SELECT count(*) FROM bot_user_state WHERE user_id = 7")).scalar() == 1
+
+@pytest.mark.postgres
+def test_replicas_see_each_others_writes(db):
+    from bot.database import dispose_async_engine
+    from bot.persistence import PostgresPersistence
+
+    async def scenario():
+        first, second = PostgresPersistence(user_ttl=TTL), PostgresPersistence(user_ttl=TTL)
+        try:
+            await first.update_user_data(7, {"menu": "main"})
+            await first.flush()
+            second_data = (await second.get_user_data())[7]
+            await second.refresh_user_data(7, second_data)
+            assert second_data == {"menu": "main"}
+            # Другая реплика продолжила диалог
+            await first.update_user_data(7, {"menu": "funpay", "funpay_account_id": 3})
+            await first.flush()
+            await second.refresh_user_data(7, second_data)
+            assert second_data == {"menu": "funpay", "funpay_account_id": 3}
+            # Своя незаписанная правка не затирается
+            await second.update_user_data(7, {"menu": "subscribe"})
+            local = {"menu": "subscribe"}
+            await second.refresh_user_data(7, local)
+            assert local == {"menu": "subscribe"}
+            await second.flush()
+            # ...а после записи и удаления на другой реплике состояние сбрасывается
+            first_data = {"menu": "funpay", "funpay_account_id": 3}
+            await first.refresh_user_data(7, first_data)
+            assert first_data == {"menu": "subscribe"}
+            await first.drop_user_data(7)
+            await first.flush()
+            await second.refresh_user_data(7, local)
+            assert local == {}
+        finally:
+            await dispose_async_engine()
+    asyncio.run(scenario())
@@ -0,0 +1,127 @@
+# tests/test_query_plans.py
+# Регрессия планов горячих запросов аренды (индексы миграции v0002 и партиции v0004):
+# на засеянном наборе (по умолчанию 1M аккаунтов и 1M транзакций, TEST_EXPLAIN_ROWS) ни один
+# из запросов не должен читать большие таблицы последовательным сканом.
+import os
+from datetime import datetime
+import pytest
+
+pytestmark = [pytest.mark.postgres, pytest.mark.slow]
+
+ROWS = int(os.environ.get("TEST_EXPLAIN_ROWS", "1000000"))
+OWNERS = 1000
+FUNPAY_ACCOUNTS = 2000
+HISTORY_MONTHS = 12
+
+@pytest.fixture(scope="module")
+def seeded(pg_engine):
+    from sqlalchemy import text
+    from bot.partitions import add_months, month_start, create_partition_sql
+    with pg_engine.begin() as conn:
+        conn.execute(text(
+            "TRUNCATE owners, funpay_accounts, accounts, transactions, transaction_external_ids, "
+            "revenue_rollups RESTART IDENTITY CASCADE"
+        ))
+        for offset in range(HISTORY_MONTHS, 0, -1):
+            conn.execute(text(create_partition_sql(add_months(month_start(datetime.utcnow()), -offset))))
+        # Триггеры агрегатов на сидинге не нужны и замедлили бы его на порядок
+        conn.execute(text("ALTER TABLE accounts DISABLE TRIGGER USER"))
+        conn.execute(text("ALTER TABLE owners DISABLE TRIGGER USER"))
+        conn.execute(text("ALTER TABLE transactions DISABLE TRIGGER USER"))
+        conn.execute(text(
+            "INSERT INTO owners (tg_id, is_active, balance) "
+            "SELECT g, true, 0 FROM generate_series(1, :n) g"
+        ), {"n": OWNERS})
+        conn.execute(text(
+            "INSERT INTO funpay_accounts (owner_id, name, user_id_encrypted, golden_key_encrypted, is_active) "
+            "SELECT o.id, 'fp' || g, '\\x00', '\\x00', true "
+            "FROM generate_series(1, :n) g JOIN owners o ON o.tg_id = 1 + g % :owners"
+        ), {"n": FUNPAY_ACCOUNTS, "owners": OWNERS})
+        # ~1% аккаунтов сдано, часть аренд уже истекла
+        conn.execute(text(
+            "INSERT INTO accounts (owner_tg_id, funpay_account_id, login, base_password_encrypted, "
+            " shared_secret_encrypted, price_per_hour, status, rent_end_time) "
+            "SELECT 1 + g % :owners, 1 + g % :fp, 'acc' || g, '\\x00', '\\x00', 10, "
+            " CASE WHEN g % 100 = 0 THEN 'rented' ELSE 'available' END, "
+            " CASE WHEN g % 100 = 0 THEN now() - (g % 7 - 3) * interval '1 hour' END "
+            "FROM generate_series(1, :n) g"
+        ), {"n": ROWS, "owners": OWNERS, "fp": FUNPAY_ACCOUNTS})
+        conn.execute(text(
+            "INSERT INTO transactions (id, owner_tg_id, account_id, transaction_type, external_id, timestamp, "
+            " amount, status) "
+            "SELECT md5(g::text), 1 + g % :owners, 1 + g % :n, 'rental', 'order-' || g, "
+            " now() - (g % (:months * 30 * 24)) * interval '1 hour', 10, 'completed' "
+            "FROM generate_series(1, :n) g"
+        ), {"n": ROWS, "owners": OWNERS, "months": HISTORY_MONTHS})
+        conn.execute(text(
+            "INSERT INTO transaction_external_ids (external_id, transaction_id, timestamp) "
+            "SELECT external_id, id, timestamp FROM transactions"
+        ))
+        conn.execute(text("ALTER TABLE accounts ENABLE TRIGGER USER"))
+        conn.execute(text("ALTER TABLE owners ENABLE TRIGGER USER"))
+        conn.execute(text("ALTER TABLE transactions ENABLE TRIGGER USER"))
+    with pg_engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        conn.execute(text("ANALYZE owners, funpay_accounts, accounts, transactions, transaction_external_ids"))
+    yield pg_engine
+    with pg_engine.begin() as conn:
+        conn.execute(text(
+            "TRUNCATE owners, funpay_accounts, accounts, transactions, transaction_external_ids CASCADE"
+        ))
+
+def _scans(plan: dict):
+    """(тип узла, таблица, индекс) всех узлов плана."""
+    yield plan.get("Node Type"), plan.get("Relation Name"), plan.get("Index Name")
+    for child in plan.get("Plans", ()):
+        yield from _scans(child)
+
+def explain(engine, sql: str, params: dict) -> list:
+    from sqlalchemy import text
+    with engine.connect() as conn:
+        plan = conn.execute(text(f"EXPLAIN (FORMAT JSON) {sql}"), params).scalar()
+        conn.rollback()
+    return list(_scans(plan[0]["Plan"]))
+
+def assert_no_seq_scan(scans: list, *tables: str):
+    for node_type, relation, _ in scans:
+        if node_type == "Seq Scan" and relation and relation.startswith(tables):
+            pytest.fail(f"Seq Scan по {relation}: {scans}")
+
+def assert_uses_index(scans: list, index_name: str):
+    assert any(index == index_name for _, _, index in scans), f"{index_name} не используется: {scans}"
+
+def test_expired_rentals_use_partial_index(seeded):
+    scans = explain(seeded,
+        "SELECT id FROM accounts WHERE status = 'rented' AND rent_end_time < :now "
+        "ORDER BY rent_end_time LIMIT 10 FOR UPDATE SKIP LOCKED", {"now": datetime.utcnow()})
+    assert_no_seq_scan(scans, "accounts")
+    assert_uses_index(scans, "ix_accounts_rented_rent_end_time")
+
+def test_accounts_by_funpay_account_and_status(seeded):
+    scans = explain(seeded,
+        "SELECT status, count(*) FROM accounts WHERE funpay_account_id = :fp GROUP BY status", {"fp": 42})
+    assert_no_seq_scan(scans, "accounts")
+    assert_uses_index(scans, "ix_accounts_funpay_account_id_status")
+
+def test_owner_dashboard_join(seeded):
+    scans = explain(seeded,
+        "SELECT f.id, a.status, count(a.id) FROM owners o "
+        "JOIN funpay_accounts f ON f.owner_id = o.id "
+        "LEFT JOIN accounts a ON a.funpay_account_id = f.id "
+        "WHERE o.tg_id = :tg_id GROUP BY f.id, a.status", {"tg_id": 7})
+    assert_no_seq_scan(scans, "accounts", "funpay_accounts", "owners")
+
+def test_transactions_by_owner_and_time(seeded):
+    scans = explain(seeded,
+        "SELECT id, amount FROM transactions WHERE owner_tg_id = :tg_id "
+        "AND timestamp >= now() - interval '30 days' ORDER BY timestamp", {"tg_id": 7})
+    assert_no_seq_scan(scans, "transactions")
+    # Старые месяцы отсекаются по ключу партиционирования
+    relations = {relation for _, relation, _ in scans if relation}
+    assert len(relations) <= 2, relations
+
+def test_transactions_by_external_id(seeded):
+    scans = explain(seeded, "SELECT id FROM transactions WHERE external_id = :id", {"id": "order-12345"})
+    assert_no_seq_scan(scans, "transactions")
+    scans = explain(seeded, "SELECT transaction_id FROM transaction_external_ids WHERE external_id = :id",
+                    {"id": "order-12345"})
+    assert_no_seq_scan(scans, "transaction_external_ids")
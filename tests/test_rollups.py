@@ -0,0 +1,45 @@
+# tests/test_rollups.py
+# Глобальные счетчики и агрегаты разбиты на слоты (v0009): параллельные вставки из разных соединений
+# не должны терять обновления, а чтение через RollupRepository - возвращать сумму слотов.
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+import pytest
+
+pytestmark = pytest.mark.postgres
+
+WORKERS = 8
+PER_WORKER = 25
+
+def _insert_owner_with_topups(engine, tg_id: int):
+    from sqlalchemy import text
+    with engine.begin() as conn:
+        conn.execute(text("INSERT INTO owners (tg_id, is_active, balance) VALUES (:tg_id, true, 0)"),
+                     {"tg_id": tg_id})
+    for n in range(PER_WORKER):
+        with engine.begin() as conn:
+            conn.execute(text(
+                "INSERT INTO transactions (id, owner_tg_id, transaction_type, timestamp, amount, status) "
+                "VALUES (:id, :tg_id, 'topup', :ts, 10, 'completed')"
+            ), {"id": f"{tg_id}-{n}", "tg_id": tg_id, "ts": datetime.utcnow()})
+
+def test_sharded_counters_sum_to_totals(db):
+    from sqlalchemy import text
+    from bot.database import async_session_scope
+    from bot.repositories import RollupRepository
+
+    with ThreadPoolExecutor(WORKERS) as pool:
+        list(pool.map(lambda tg_id: _insert_owner_with_topups(db, tg_id), range(1, WORKERS + 1)))
+
+    with db.connect() as conn:
+        slots = conn.execute(text("SELECT count(DISTINCT scope_id) FROM revenue_rollups WHERE scope = 'global'")).scalar()
+    assert slots >= 1
+
+    async def read():
+        async with async_session_scope() as session:
+            repo = RollupRepository(session)
+            return await repo.get_counters(), await repo.get_bucket('global')
+    counters, totals = asyncio.run(read())
+    assert counters["owners"] == WORKERS
+    assert totals["topup"].tx_count == WORKERS * PER_WORKER
+    assert totals["topup"].amount == 10 * WORKERS * PER_WORKER
@@ -0,0 +1,119 @@
+# tests/test_router.py
+# Маршрутизация кнопок (bot/router.py) и кнопки меню FunPay аккаунта без выбранного аккаунта.
+import asyncio
+import time
+from types import SimpleNamespace
+import pytest
+
+@pytest.fixture
+def router():
+    from bot.router import Router
+    router = Router("test")
+    router.exact("funpay_add", lambda *args: None)
+    router.prefix("funpay_", lambda *args: None)
+    router.prefix("funpay_view_", lambda *args: None, int)
+    return router
+
+def test_exact_wins_over_prefix(router):
+    route, param = router.resolve("funpay_add")
+    assert route.name == "test:funpay_add" and param is None
+
+def test_longest_prefix_and_param_type(router):
+    route, param = router.resolve("funpay_view_42")
+    assert route.name == "test:funpay_view_*" and param == 42
+    route, param = router.resolve("funpay_other")
+    assert route.name == "test:funpay_*" and param == "other"
+
+def test_bad_param_is_no_route(router):
+    assert router.resolve("funpay_view_abc") is None
+    assert router.resolve("unknown") is None
+
+def test_dispatch_passes_args_and_param():
+    from bot.router import Router
+    calls = []
+
+    async def handler(update, context, param):
+        calls.append((update, context, param))
+    router = Router("test")
+    router.prefix("funpay_stats_", handler, int)
+    assert asyncio.run(router.dispatch("funpay_stats_7", "update", "context")) is True
+    assert asyncio.run(router.dispatch("nothing", "update", "context")) is False
+    assert calls == [("update", "context", 7)]
+
+@pytest.mark.benchmark
+def test_resolve_benchmark():
+    """Микробенчмарк: 200 точных и 200 префиксных маршрутов, смесь попаданий и промахов."""
+    from bot.router import Router
+    router = Router("bench")
+    for n in range(200):
+        router.exact(f"button_{n}", lambda *args: None)
+        router.prefix(f"action_{n}_", lambda *args: None, int)
+    keys = [f"button_{n}" for n in range(200)] + [f"action_{n}_{n * 7}" for n in range(200)] + ["missing"] * 40
+    rounds = 200
+    started = time.perf_counter()
+    for _ in range(rounds):
+        for key in keys:
+            router.resolve(key)
+    elapsed = time.perf_counter() - started
+    calls = rounds * len(keys)
+    print(f"\nRouter.resolve: {calls / elapsed:.0f} вызовов/с ({elapsed / calls * 1e6:.2f} мкс/вызов)")
+    assert elapsed / calls < 50e-6
+
+@pytest.mark.parametrize("handler_name", ["_text_add_steam", "_text_funpay_account_stats",
+                                          "_text_back_to_funpay_account"])
+def test_funpay_account_buttons_without_selection_show_list(handler_name, monkeypatch):
+    pytest.importorskip("telegram")
+    pytest.importorskip("dotenv")
+    pytest.importorskip("sqlalchemy")
+    pytest.importorskip("cryptography")
+    pytest.importorskip("psycopg2")
+    from bot import handlers
+    shown = []
+
+    async def fake_menu(query, context):
+        shown.append("list")
+
+    async def fake_show(query, context, funpay_account_id):
+        shown.append(funpay_account_id)
+    monkeypatch.setattr(handlers, "show_funpay_accounts_menu", fake_menu)
+    for name in ("start_add_steam_account", "show_specific_funpay_stats", "show_funpay_account_details"):
+        monkeypatch.setattr(handlers, name, fake_show)
+    update = SimpleNamespace(message=SimpleNamespace(), effective_user=SimpleNamespace(id=1))
+
+    asyncio.run(getattr(handlers, handler_name)(update, SimpleNamespace(user_data={}), None))
+    asyncio.run(getattr(handlers, handler_name)(update, SimpleNamespace(user_data={'funpay_account_id': 5}), None))
+    assert shown == ["list", 5]
+
+@pytest.mark.postgres
+def test_steam_account_button_is_scoped_to_owner(owner_factory, db):
+    pytest.importorskip("telegram")
+    from sqlalchemy import text
+    from bot import handlers
+    from bot.database import dispose_async_engine
+    owner, stranger = owner_factory(), owner_factory()
+    with db.begin() as conn:
+        fp_id = conn.execute(text(
+            "INSERT INTO funpay_accounts (owner_id, name, user_id_encrypted, golden_key_encrypted, is_active) "
+            "SELECT id, 'fp', '\\x00', '\\x00', true FROM owners WHERE tg_id = :tg_id RETURNING id"
+        ), {"tg_id": stranger}).scalar()
+        conn.execute(text(
+            "INSERT INTO accounts (owner_tg_id, funpay_account_id, login, base_password_encrypted, "
+            " shared_secret_encrypted, price_per_hour, status) "
+            "VALUES (:tg_id, :fp_id, 'foreign_login', '\\x00', '\\x00', 10, 'available')"
+        ), {"tg_id": stranger, "fp_id": fp_id})
+    replies = []
+
+    async def reply_text(text, **kwargs):
+        replies.append(text)
+
+    async def run(user_id, user_data):
+        update = SimpleNamespace(message=SimpleNamespace(reply_text=reply_text),
+                                 effective_user=SimpleNamespace(id=user_id))
+        try:
+            await handlers._text_steam_account(update, SimpleNamespace(user_data=user_data), "foreign_login")
+        finally:
+            await dispose_async_engine()
+    asyncio.run(run(owner, {}))
+    asyncio.run(run(owner, {'funpay_account_id': fp_id}))
+    asyncio.run(run(stranger, {'funpay_account_id': fp_id}))
+    assert [("не найден" in reply) for reply in replies] == [True, True, False]
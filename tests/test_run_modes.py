@@ -0,0 +1,110 @@
+# tests/test_run_modes.py
+# Каждый RUN_MODE грузит только свои зависимости (app.py импортирует модули внутри режимов).
+# Режим запускается в отдельном процессе с отключенными блокирующими вызовами (планировщик, сервер,
+# polling, цикл воркера, проверка схемы, сервер метрик), после чего проверяется sys.modules.
+# webhook и all намеренно грузят все и здесь не проверяются.
+# Время старта: тот же запуск под python -X importtime, суммарное время импортов режима должно
+# укладываться в бюджет IMPORT_BUDGET_MS (маркер benchmark).
+import json
+import os
+import re
+import subprocess
+import sys
+import pytest
+
+for module in ("dotenv", "sqlalchemy", "psycopg2", "cryptography", "apscheduler", "pyotp"):
+    pytest.importorskip(module)
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+HEAVY = ("telegram", "flask", "steam", "FunPayAPI")
+
+SCRIPT = """
+import json
+import sys
+from apscheduler.schedulers.background import BackgroundScheduler
+from apscheduler.schedulers.blocking import BlockingScheduler
+BackgroundScheduler.start = BlockingScheduler.start = lambda self, *args, **kwargs: None
+import bot.database
+import bot.metrics
+bot.database.init_db = lambda: None
+bot.metrics.start_http_server = lambda *args, **kwargs: None
+import app
+
+mode = sys.argv[1]
+if mode == 'web':
+    import bot.server
+    bot.server.serve_forever = lambda *args, **kwargs: None
+elif mode == 'bot':
+    import bot.bot
+    bot.bot.run_bot = lambda: None
+elif mode == 'worker':
+    import bot.payments
+    bot.payments.YOOKASSA_SDK_AVAILABLE = True
+    bot.payments.yookassa_inbox_worker.run = lambda: None
+app.RUN_MODES[mode](5000)
+print(json.dumps(sorted({name.split('.')[0] for name in sys.modules} & set(sys.argv[2:]))))
+"""
+
+# Режим -> (что должно загрузиться, что не должно)
+EXPECTED = {
+    "web": ({"flask"}, {"telegram", "steam", "FunPayAPI"}),
+    "bot": ({"telegram"}, {"flask", "steam", "FunPayAPI"}),
+    "worker": (set(), {"telegram", "flask", "steam", "FunPayAPI"}),
+    "scheduler": (set(), {"telegram", "flask", "steam", "FunPayAPI"}),
+}
+
+# Бюджет суммарного времени импортов режима, мс: примерно вдвое больше замера с прогретым кэшем ФС
+# (bot ~700, web ~630, worker и scheduler ~550 мс)
+IMPORT_BUDGET_MS = {
+    "web": 1300,
+    "bot": 1500,
+    "worker": 1200,
+    "scheduler": 1200,
+}
+
+# import time: self [us] | cumulative | imported package; вложенные импорты - с отступом в имени
+IMPORTTIME_RE = re.compile(r"^import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)$")
+
+def run_mode(mode: str, *python_args: str) -> subprocess.CompletedProcess:
+    env = dict(os.environ, RUN_MODE=mode, PYTHONPATH=ROOT, YOOKASSA_ACCOUNT_ID="1", YOOKASSA_SECRET_KEY="test")
+    result = subprocess.run([sys.executable, *python_args, "-c", SCRIPT, mode, *HEAVY], cwd=ROOT, env=env,
+                            capture_output=True, text=True, timeout=120)
+    assert result.returncode == 0, result.stderr
+    return result
+
+def loaded_modules(mode: str) -> set:
+    result = run_mode(mode)
+    return set(json.loads(result.stdout.strip().splitlines()[-1]))
+
+def import_time_ms(stderr: str) -> tuple[float, list]:
+    """Сумма cumulative по импортам верхнего уровня и самые дорогие из них (для сообщения об ошибке)."""
+    top_level = []
+    for line in stderr.splitlines():
+        match = IMPORTTIME_RE.match(line)
+        if match and len(match.group(3)) == 1:
+            top_level.append((int(match.group(2)) / 1000, match.group(4)))
+    return sum(ms for ms, _ in top_level), sorted(top_level, reverse=True)[:10]
+
+def _skip_missing(mode: str):
+    required, _ = EXPECTED[mode]
+    if "telegram" in required:
+        pytest.importorskip("telegram")
+    if "flask" in required:
+        pytest.importorskip("flask")
+
+@pytest.mark.parametrize("mode", sorted(EXPECTED))
+def test_mode_imports_only_its_dependencies(mode):
+    _skip_missing(mode)
+    required, forbidden = EXPECTED[mode]
+    loaded = loaded_modules(mode)
+    assert required <= loaded, f"{mode}: не загружены {required - loaded}"
+    assert not loaded & forbidden, f"{mode}: лишние модули {loaded & forbidden}"
+
+@pytest.mark.benchmark
+@pytest.mark.parametrize("mode", sorted(IMPORT_BUDGET_MS))
+def test_mode_import_time_within_budget(mode):
+    _skip_missing(mode)
+    total_ms, slowest = import_time_ms(run_mode(mode, "-X", "importtime").stderr)
+    print(f"\n{mode}: импорты {total_ms:.0f} мс (бюджет {IMPORT_BUDGET_MS[mode]} мс)")
+    assert total_ms > 0, "вывод -X importtime не разобран"
+    assert total_ms < IMPORT_BUDGET_MS[mode], f"{mode}: импорты {total_ms:.0f} мс, самые дорогие: {slowest}"
@@ -0,0 +1,73 @@
+# tests/test_secret_cache.py
+# Кэш расшифрованных секретов (bot/utils.py): расшифровка идет вне _secret_lock, поэтому
+# медленный промах кэша в одном потоке не задерживает попадания в других.
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import pytest
+
+pytest.importorskip("cryptography")
+pytest.importorskip("dotenv")
+pytest.importorskip("sqlalchemy")
+pytest.importorskip("psycopg2")
+
+@pytest.fixture
+def utils():
+    from bot import utils
+    utils._secret_cache.clear()
+    yield utils
+    utils._secret_cache.clear()
+
+class SlowCrypto:
+    """Обертка над EnvelopeCrypto: каждая расшифровка ждет release."""
+    def __init__(self, crypto):
+        self.crypto = crypto
+        self.started = threading.Event()
+        self.release = threading.Event()
+
+    def decrypt(self, ciphertext: bytes) -> bytes:
+        self.started.set()
+        self.release.wait(5)
+        return self.crypto.decrypt(ciphertext)
+
+def test_results_keep_order_and_duplicates(utils):
+    first, second = utils.encrypt_data("первый"), utils.encrypt_data("второй")
+    assert utils.decrypt_many([first, second, first]) == ["первый", "второй", "первый"]
+    # Второй вызов целиком из кэша
+    assert utils.decrypt_many([second, first]) == ["второй", "первый"]
+
+def test_cache_hit_not_blocked_by_slow_decrypt(utils, monkeypatch):
+    cached, slow = utils.encrypt_data("cached"), utils.encrypt_data("slow")
+    utils.decrypt_data(cached)
+    slow_crypto = SlowCrypto(utils._crypto)
+    monkeypatch.setattr(utils, "_crypto", slow_crypto)
+    with ThreadPoolExecutor(1) as pool:
+        pending = pool.submit(utils.decrypt_data, slow)
+        assert slow_crypto.started.wait(5)
+        started = time.perf_counter()
+        assert utils.decrypt_data(cached) == "cached"
+        hit_seconds = time.perf_counter() - started
+        slow_crypto.release.set()
+        assert pending.result(5) == "slow"
+    assert hit_seconds < 0.5
+
+@pytest.mark.benchmark
+def test_decrypt_many_throughput(utils):
+    """Микробенчмарк: 8 потоков, смесь попаданий и промахов кэша."""
+    threads, per_thread = 8, 500
+    hot = [utils.encrypt_data(f"hot-{n}") for n in range(16)]
+    cold = [[utils.encrypt_data(f"cold-{t}-{n}") for n in range(per_thread)] for t in range(threads)]
+    utils.decrypt_many(hot)
+
+    def worker(items):
+        for n, encrypted in enumerate(items):
+            utils.decrypt_many([hot[n % len(hot)], encrypted])
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(threads) as pool:
+        list(pool.map(worker, cold))
+    elapsed = time.perf_counter() - started
+    calls = threads * per_thread
+    print(f"\ndecrypt_many: {calls} вызовов за {elapsed:.3f} c ({calls / elapsed:.0f} вызовов/с, "
+          f"{elapsed / calls * 1e6:.1f} мкс/вызов)")
+    assert elapsed / calls < 0.005
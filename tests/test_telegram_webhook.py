@@ -0,0 +1,69 @@
+# tests/test_telegram_webhook.py
+# Прием апдейтов Telegram через webhook: вместо настоящего Application - заглушка с очередью,
+# Telegram изображает тестовый клиент Flask.
+import asyncio
+import threading
+import pytest
+
+for module in ("flask", "telegram", "dotenv", "sqlalchemy", "psycopg2", "cryptography"):
+    pytest.importorskip(module)
+
+SECRET = "test-secret"
+UPDATE = {"update_id": 1, "message": {"message_id": 1, "date": 0, "chat": {"id": 1, "type": "private"},
+                                       "text": "/start"}}
+
+class FakeApplication:
+    """Минимум Application, который использует WebhookBot."""
+    def __init__(self):
+        self.bot = None
+        self.post_init = None
+        self.update_queue = None
+
+    async def initialize(self):
+        self.update_queue = asyncio.Queue()
+
+    async def start(self):
+        pass
+
+@pytest.fixture
+def webhook():
+    from flask import Flask
+    from bot.telegram_webhook import WebhookBot, register_telegram_webhook
+    webhook_bot = WebhookBot(application=FakeApplication(), webhook_url=None, secret_token=SECRET)
+    app = Flask(__name__)
+    register_telegram_webhook(app, webhook_bot, path="/tg")
+    yield webhook_bot, app.test_client()
+    if webhook_bot.loop is not None and webhook_bot.loop.is_running():
+        webhook_bot.loop.call_soon_threadsafe(webhook_bot.loop.stop)
+
+def post(client, secret=SECRET, json=UPDATE):
+    return client.post("/tg", json=json, headers={"X-Telegram-Bot-Api-Secret-Token": secret})
+
+def test_rejects_wrong_secret(webhook):
+    webhook_bot, client = webhook
+    assert post(client, secret="wrong").status_code == 403
+
+def test_unavailable_until_loop_runs(webhook):
+    webhook_bot, client = webhook
+    assert post(client).status_code == 503
+
+def test_accepted_update_reaches_queue(webhook):
+    webhook_bot, client = webhook
+    webhook_bot.start(timeout=5)
+    assert post(client).status_code == 200
+    queue = webhook_bot.application.update_queue
+    update = asyncio.run_coroutine_threadsafe(queue.get(), webhook_bot.loop).result(5)
+    assert update.update_id == 1
+
+def test_unavailable_after_loop_stops(webhook):
+    webhook_bot, client = webhook
+    webhook_bot.start(timeout=5)
+    stopped = threading.Event()
+    webhook_bot.loop.call_soon_threadsafe(lambda: (webhook_bot.loop.stop(), stopped.set()))
+    assert stopped.wait(5)
+    # loop.stop() завершает run_forever после текущей итерации
+    for _ in range(100):
+        if not webhook_bot.loop.is_running():
+            break
+        threading.Event().wait(0.01)
+    assert post(client).status_code == 503
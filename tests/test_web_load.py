@@ -0,0 +1,97 @@
+# tests/test_web_load.py
+# Нагрузочный тест веб-сервера RUN_MODE=web (gevent): параллельные заказы со сменой пароля Steam не должны
+# занимать хаб gevent. Сервер запускается в отдельном процессе с monkey.patch_all(), смена пароля
+# заменена по-настоящему блокирующей заглушкой (исходный time.sleep). Если бы она шла в greenlet,
+# health-запросы ждали бы ее, а заказы выполнялись бы строго по одному.
+import os
+import socket
+import subprocess
+import sys
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+import pytest
+
+for module in ("gevent", "psycogreen", "flask", "dotenv", "sqlalchemy", "psycopg2", "cryptography", "pyotp"):
+    pytest.importorskip(module)
+
+pytestmark = pytest.mark.slow
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+ORDERS = 20
+BLOCKING_SECONDS = 0.5
+THREADS = 10
+
+SERVER_SCRIPT = """
+from gevent import monkey
+monkey.patch_all()
+import sys
+from flask import Flask
+from bot import steam_api
+from bot.server import serve_forever
+
+blocking_sleep = monkey.get_original('time', 'sleep')
+
+def fake_change_password(*args):
+    blocking_sleep(float(sys.argv[2]))
+    return True
+steam_api.change_password_blocking = fake_change_password
+
+app = Flask('load')
+
+@app.route('/order')
+def order():
+    return str(steam_api.change_password_sync('login', 'old', 'new', 1, b'secret'))
+
+@app.route('/health')
+def health():
+    return 'ok'
+
+serve_forever(app, '127.0.0.1', int(sys.argv[1]))
+"""
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+def _get(url: str) -> tuple[str, float]:
+    started = time.perf_counter()
+    with urllib.request.urlopen(url, timeout=30) as response:
+        return response.read().decode(), time.perf_counter() - started
+
+@pytest.fixture
+def server():
+    port = _free_port()
+    env = dict(os.environ, WEB_BLOCKING_THREADS=str(THREADS), PYTHONPATH=ROOT)
+    process = subprocess.Popen([sys.executable, "-c", SERVER_SCRIPT, str(port), str(BLOCKING_SECONDS)],
+                               cwd=ROOT, env=env)
+    base_url = f"http://127.0.0.1:{port}"
+    deadline = time.monotonic() + 30
+    while True:
+        try:
+            _get(base_url + "/health")
+            break
+        except OSError:
+            if time.monotonic() > deadline or process.poll() is not None:
+                process.kill()
+                pytest.fail("веб-сервер не запустился")
+            time.sleep(0.1)
+    yield base_url
+    process.terminate()
+    process.wait(30)
+
+def test_orders_do_not_block_hub(server):
+    with ThreadPoolExecutor(ORDERS + 1) as pool:
+        started = time.perf_counter()
+        orders = [pool.submit(_get, server + "/order") for _ in range(ORDERS)]
+        time.sleep(BLOCKING_SECONDS / 5)
+        health = [_get(server + "/health") for _ in range(5)]
+        results = [future.result() for future in orders]
+        elapsed = time.perf_counter() - started
+    assert all(body == "True" for body, _ in results)
+    # Хаб свободен: health отвечает, пока заказы ждут Steam
+    assert max(latency for _, latency in health) < BLOCKING_SECONDS / 2
+    # Заказы идут параллельно в THREADS потоках: ORDERS / THREADS волн, а не ORDERS
+    assert elapsed < BLOCKING_SECONDS * (ORDERS / THREADS + 2)
+    print(f"\n{ORDERS} заказов за {elapsed:.2f} с, health p100 {max(l for _, l in health) * 1000:.0f} мс")
@@ -0,0 +1,88 @@
+# tests/test_web_threaded.py
+# Веб-сервер RUN_MODE=webhook и all (waitress, bot/server.py): запросы обрабатываются параллельно
+# в потоках, а по SIGTERM сервер перестает принимать соединения, но дожидается текущих запросов.
+import os
+import signal
+import socket
+import subprocess
+import sys
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+import pytest
+
+for module in ("waitress", "flask", "dotenv", "sqlalchemy", "psycopg2", "cryptography", "pyotp"):
+    pytest.importorskip(module)
+
+pytestmark = pytest.mark.slow
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+REQUESTS = 8
+SLOW_SECONDS = 1.0
+
+SERVER_SCRIPT = """
+import sys
+import time
+from flask import Flask
+from bot.server import serve_threaded
+
+app = Flask('threaded')
+
+@app.route('/slow')
+def slow():
+    time.sleep(float(sys.argv[2]))
+    return 'done'
+
+@app.route('/health')
+def health():
+    return 'ok'
+
+serve_threaded(app, '127.0.0.1', int(sys.argv[1]), shutdown_timeout=10)
+"""
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+def _get(url: str) -> str:
+    with urllib.request.urlopen(url, timeout=30) as response:
+        return response.read().decode()
+
+@pytest.fixture
+def server():
+    port = _free_port()
+    env = dict(os.environ, WEB_THREADS=str(REQUESTS), PYTHONPATH=ROOT)
+    process = subprocess.Popen([sys.executable, "-c", SERVER_SCRIPT, str(port), str(SLOW_SECONDS)],
+                               cwd=ROOT, env=env)
+    base_url = f"http://127.0.0.1:{port}"
+    deadline = time.monotonic() + 30
+    while True:
+        try:
+            _get(base_url + "/health")
+            break
+        except OSError:
+            if time.monotonic() > deadline or process.poll() is not None:
+                process.kill()
+                pytest.fail("веб-сервер не запустился")
+            time.sleep(0.1)
+    yield process, base_url
+    if process.poll() is None:
+        process.kill()
+        process.wait(30)
+
+def test_requests_run_in_parallel_and_finish_on_sigterm(server):
+    process, base_url = server
+    with ThreadPoolExecutor(REQUESTS) as pool:
+        started = time.perf_counter()
+        requests = [pool.submit(_get, base_url + "/slow") for _ in range(REQUESTS)]
+        time.sleep(SLOW_SECONDS / 4)
+        process.send_signal(signal.SIGTERM)
+        results = [future.result() for future in requests]
+        elapsed = time.perf_counter() - started
+    assert results == ["done"] * REQUESTS
+    # Все запросы шли одновременно в WEB_THREADS потоках
+    assert elapsed < SLOW_SECONDS * 2
+    assert process.wait(30) == 0
+    with pytest.raises(OSError):
+        _get(base_url + "/health")
@@ -0,0 +1,121 @@
+# tests/test_yookassa_inbox.py
+# Повторы и порядок уведомлений YooKassa: один платеж зачисляется ровно один раз, как бы ни приходили
+# уведомления (повторы, другие события, уведомление раньше, чем платеж завершился), и проверка
+# платежа через API не держит блокировку строки уведомления. API YooKassa заменено заглушкой.
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+from types import SimpleNamespace
+import pytest
+
+for module in ("flask", "dotenv"):
+    pytest.importorskip(module)
+
+pytestmark = pytest.mark.postgres
+
+class FakePayments:
+    """Payment.find_one с управляемым статусом платежей."""
+    def __init__(self):
+        self.payments = {}
+        self.calls = 0
+        self.on_find = None
+
+    def set(self, payment_id: str, status: str, tg_user_id: int, value: str = "100.00"):
+        self.payments[payment_id] = SimpleNamespace(
+            id=payment_id, status=status, metadata={"tg_user_id": str(tg_user_id)},
+            amount=SimpleNamespace(value=value, currency="RUB"))
+
+    def find_one(self, payment_id: str):
+        self.calls += 1
+        if self.on_find:
+            self.on_find(payment_id)
+        return self.payments[payment_id]
+
+@pytest.fixture
+def api(monkeypatch):
+    from bot import payments
+    fake = FakePayments()
+    monkeypatch.setattr(payments, "yookassa_api", lambda: SimpleNamespace(Payment=fake))
+    monkeypatch.setattr(payments, "notify", lambda *args, **kwargs: None)
+    return fake
+
+def notification(payment_id: str, tg_user_id: int, event: str = "payment.succeeded") -> dict:
+    return {"event": event, "object": {"id": payment_id, "metadata": {"tg_user_id": str(tg_user_id)},
+                                       "amount": {"value": "100.00", "currency": "RUB"}}}
+
+def _balance_and_topups(db, tg_id: int):
+    from sqlalchemy import text
+    with db.connect() as conn:
+        balance = conn.execute(text("SELECT balance FROM owners WHERE tg_id = :tg_id"), {"tg_id": tg_id}).scalar()
+        topups = conn.execute(text(
+            "SELECT count(*) FROM transactions WHERE owner_tg_id = :tg_id AND transaction_type = 'topup'"
+        ), {"tg_id": tg_id}).scalar()
+    return balance, topups
+
+def _make_due(db):
+    from sqlalchemy import text
+    with db.begin() as conn:
+        conn.execute(text("UPDATE yookassa_inbox SET not_before = now() - interval '1 second'"))
+
+def test_duplicate_notifications_credit_once(db, owner_factory, api):
+    from bot.payments import record_notification, YooKassaInboxWorker
+    tg_id = owner_factory()
+    api.set("pay-1", "succeeded", tg_id)
+    results = [record_notification(notification("pay-1", tg_id)) for _ in range(3)]
+    assert results == ["queued", "duplicate", "duplicate"]
+    worker = YooKassaInboxWorker()
+    assert worker.process_batch() == 1
+    # Повтор уже обработанного платежа
+    assert record_notification(notification("pay-1", tg_id)) == "duplicate"
+    assert worker.process_batch() == 0
+    assert _balance_and_topups(db, tg_id) == (Decimal("100.00"), 1)
+
+def test_out_of_order_events(db, owner_factory, api):
+    from bot.payments import record_notification, YooKassaInboxWorker
+    tg_id = owner_factory()
+    worker = YooKassaInboxWorker()
+    # succeeded-уведомление пришло, а API еще отдает платеж в ожидании - повтор позже
+    api.set("pay-2", "waiting_for_capture", tg_id)
+    assert record_notification(notification("pay-2", tg_id)) == "queued"
+    assert worker.process_batch() == 1
+    assert _balance_and_topups(db, tg_id) == (Decimal("0.00"), 0)
+    # Запоздавшее событие другого типа ни на что не влияет
+    assert record_notification(notification("pay-2", tg_id, event="payment.waiting_for_capture")) == "ignored"
+    api.set("pay-2", "succeeded", tg_id)
+    _make_due(db)
+    assert worker.process_batch() == 1
+    assert record_notification(notification("pay-2", tg_id)) == "duplicate"
+    assert _balance_and_topups(db, tg_id) == (Decimal("100.00"), 1)
+
+def test_parallel_workers_credit_once(db, owner_factory, api):
+    from bot.payments import record_notification, YooKassaInboxWorker
+    tg_id = owner_factory()
+    for n in range(30):
+        api.set(f"pay-p{n}", "succeeded", tg_id)
+        record_notification(notification(f"pay-p{n}", tg_id))
+    workers = [YooKassaInboxWorker() for _ in range(4)]
+    with ThreadPoolExecutor(len(workers)) as pool:
+        while sum(pool.map(lambda worker: worker.process_batch(), workers)):
+            pass
+    assert _balance_and_topups(db, tg_id) == (Decimal("3000.00"), 30)
+    assert api.calls == 30
+
+def test_verify_runs_without_row_lock(db, owner_factory, api):
+    from sqlalchemy import text
+    from bot.payments import record_notification, YooKassaInboxWorker
+    tg_id = owner_factory()
+    api.set("pay-3", "succeeded", tg_id)
+    record_notification(notification("pay-3", tg_id))
+    locked = []
+
+    def check_lock(payment_id):
+        # Пока идет запрос к API, строка уведомления свободна
+        with db.connect() as conn:
+            conn.execute(text("SET lock_timeout = '1s'"))
+            locked.append(conn.execute(text(
+                "SELECT payment_id FROM yookassa_inbox WHERE payment_id = :id FOR UPDATE NOWAIT"
+            ), {"id": payment_id}).scalar())
+            conn.rollback()
+    api.on_find = check_lock
+    assert YooKassaInboxWorker().process_batch() == 1
+    assert locked == ["pay-3"]
+    assert _balance_and_topups(db, tg_id) == (Decimal("100.00"), 1)